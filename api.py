@@ -0,0 +1,176 @@
+"""Read-only JSON API for Warbler, version 1, mounted at /api/v1.
+
+Serves what the timeline, profile and message pages show, for clients
+that would otherwise scrape the HTML:
+
+    GET /api/v1/timeline                 the logged-in user's home timeline
+    GET /api/v1/users/<id>               a profile
+    GET /api/v1/users/<id>/messages      a user's messages
+    GET /api/v1/users/<id>/likes         messages a user has liked
+    GET /api/v1/messages/<id>            one message
+
+Lists come a page at a time, newest first, as {"messages": [...], "next":
+cursor}; pass the cursor back as `?before=` for the next page (it's null
+on the last). `?fields=id,text` trims each message (or the profile) to
+those fields, and skips the queries for any left out. Bodies are compact
+JSON, encoded by orjson, and carry an ETag so polling clients get an
+empty 304 when nothing changed. Errors are {"error": message} with the
+matching status.
+"""
+
+import orjson
+from flask import Blueprint, abort, current_app, g, request
+
+from models import Likes, Message, Timeline, User
+from pagination import paginate
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# field name -> fn(message, liked_ids)
+MESSAGE_FIELDS = {
+    'id': lambda msg, liked_ids: msg.id,
+    'text': lambda msg, liked_ids: msg.text,
+    'timestamp': lambda msg, liked_ids: msg.timestamp.isoformat(),
+    'user': lambda msg, liked_ids: {
+        'id': msg.user.id,
+        'username': msg.user.username,
+        'image_url': msg.user.image_url,
+    },
+    'liked': lambda msg, liked_ids: msg.id in liked_ids,
+}
+
+# field name -> fn(user); `following` is whether the viewer follows them
+USER_FIELDS = {
+    'id': lambda user: user.id,
+    'username': lambda user: user.username,
+    'image_url': lambda user: user.image_url,
+    'header_image_url': lambda user: user.header_image_url,
+    'bio': lambda user: user.bio,
+    'location': lambda user: user.location,
+    'messages_count': lambda user: user.messages_count,
+    'following_count': lambda user: user.following_count,
+    'followers_count': lambda user: user.followers_count,
+    'likes_count': lambda user: user.likes_count,
+    'following': lambda user: bool(g.user) and g.user.is_following(user),
+}
+
+
+def dumps(payload):
+    """Encode `payload` as compact UTF-8 JSON."""
+
+    return orjson.dumps(payload)
+
+
+def respond(payload, status=200):
+    """JSON response for `payload`, a 304 if the client already has it."""
+
+    response = current_app.response_class(
+        dumps(payload), status=status, mimetype='application/json')
+
+    if status == 200:
+        response.add_etag()
+        response.make_conditional(request)
+
+    return response
+
+
+def selected_fields(available):
+    """Fields named in `?fields=`, else all of `available`; 400 if unknown."""
+
+    requested = request.args.get('fields')
+
+    if not requested:
+        return list(available)
+
+    fields = [field for field in requested.split(',') if field]
+    unknown = sorted(set(fields) - set(available))
+
+    if unknown:
+        abort(400, f"Unknown fields: {', '.join(unknown)}.")
+
+    return fields
+
+
+def message_page(query, timestamp_col=Message.timestamp, id_col=Message.id):
+    """Respond with one page of the messages `query` finds."""
+
+    fields = selected_fields(MESSAGE_FIELDS)
+    messages, next_cursor = paginate(query, timestamp_col, id_col,
+                                     before=request.args.get('before'))
+
+    return respond({
+        'messages': serialize_messages(messages, fields),
+        'next': next_cursor,
+    })
+
+
+def serialize_messages(messages, fields):
+    liked_ids = set()
+
+    if 'user' in fields or 'liked' in fields:
+        liked_ids = Message.hydrate(
+            messages, g.user if 'liked' in fields else None)
+
+    return [{field: MESSAGE_FIELDS[field](msg, liked_ids) for field in fields}
+            for msg in messages]
+
+
+def api_error(error):
+    return respond({'error': error.description}, error.code)
+
+
+# by code, or the app's own 404 page would take precedence
+for code in (400, 401, 403, 404):
+    api.register_error_handler(code, api_error)
+
+
+@api.route('/timeline')
+def timeline():
+    """The logged-in user's home timeline."""
+
+    if not g.user:
+        abort(401, "Access unauthorized.")
+
+    return message_page(Timeline.messages_for(g.user.id),
+                        Timeline.timestamp, Timeline.message_id)
+
+
+@api.route('/users/<int:user_id>')
+def user_profile(user_id):
+    """A user's profile and stats."""
+
+    user = User.get_active_or_404(user_id)
+    fields = selected_fields(USER_FIELDS)
+
+    return respond({field: USER_FIELDS[field](user) for field in fields})
+
+
+@api.route('/users/<int:user_id>/messages')
+def user_messages(user_id):
+    """A user's own messages."""
+
+    User.get_active_or_404(user_id)
+    return message_page(Message.query.filter(Message.user_id == user_id))
+
+
+@api.route('/users/<int:user_id>/likes')
+def user_likes(user_id):
+    """Messages a user has liked, newest message first."""
+
+    User.get_active_or_404(user_id)
+    return message_page(
+        Message.by_active_users()
+        .join(Likes, Likes.message_id == Message.id)
+        .filter(Likes.user_id == user_id))
+
+
+@api.route('/messages/<int:message_id>')
+def message(message_id):
+    """A single message."""
+
+    msg = (Message.by_active_users()
+           .filter(Message.id == message_id)
+           .first_or_404())
+    fields = selected_fields(MESSAGE_FIELDS)
+
+    return respond(serialize_messages([msg], fields)[0])
@@ -1,416 +1,225 @@
-import os
-
-from flask import Flask, render_template, request, flash, redirect, session, g
-from flask_debugtoolbar import DebugToolbarExtension
-from sqlalchemy.exc import IntegrityError
-
-from forms import UserAddForm, UserEditForm, LoginForm, MessageForm
-from models import db, connect_db, User, Message, Likes
-
-CURR_USER_KEY = "curr_user"
-
-app = Flask(__name__)
-
-# Get DB_URI from environ variable (useful for production/testing) or,
-# if not set there, use development local db.
-app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ.get('DATABASE_URL', 'postgresql:///warbler'))
-
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = False
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
-toolbar = DebugToolbarExtension(app)
-
-connect_db(app)
-
-
-##############################################################################
-# User signup/login/logout
-
-
-@app.before_request
-def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
-
-    if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
-
-    else:
-        g.user = None
-
-
-def do_login(user):
-    """Log in user."""
-
-    session[CURR_USER_KEY] = user.id
-
+"""The Warbler application factory.
 
-def do_logout():
-    """Logout user."""
+    app = create_app('prod')
 
-    if CURR_USER_KEY in session:
-        del session[CURR_USER_KEY]
+builds the app for a profile from config.py (by default WARBLER_CONFIG,
+else "dev"); `flask run` and the other `flask` commands find it on their
+own. Importing this module does no work beyond loading Flask. Each app
+imports and sets up only the extensions and blueprints its config
+enables, so the debug toolbar, for one, never loads outside development.
+"""
 
+import os
+import time
 
-@app.route('/signup', methods=["GET", "POST"])
-def signup():
-    """Handle user signup.
-
-    Create new user and add to DB. Redirect to home page.
-
-    If form not valid, present form.
+import click
+from flask import Flask, current_app
+from flask.cli import AppGroup, with_appcontext
 
-    If the there already is a user with that username: flash message
-    and re-present form.
-    """
+from config import PROFILES
 
-    form = UserAddForm()
 
-    if form.validate_on_submit():
-        try:
-            user = User.signup(
-                username=form.username.data,
-                password=form.password.data,
-                email=form.email.data,
-                image_url=form.image_url.data or User.image_url.default.arg,
-            )
-            db.session.commit()
+def create_app(profile=None, **settings):
+    """Make a Warbler app for `profile`, with `settings` on top."""
 
-        except IntegrityError:
-            flash("Username already taken", 'danger')
-            return render_template('users/signup.html', form=form)
+    from assets import Assets
+    from conditional import apply_cache_policy
+    from metrics import Metrics
+    from jobs import JobQueue
+    import migrations  # noqa: F401 (stamps databases create_all makes)
+    from models import connect_db, hasher
+    import tasks  # noqa: F401 (registers them for the workers)
+    from views import views
 
-        do_login(user)
-    
-        return redirect("/")
+    profile = profile or os.environ.get('WARBLER_CONFIG', 'dev')
 
-    else:
-        return render_template('users/signup.html', form=form)
+    app = Flask(__name__)
+    app.config.from_object(PROFILES[profile])
+    app.config.update(settings)
 
+    if not app.config['SECRET_KEY']:
+        raise RuntimeError(f"SECRET_KEY must be set for the {profile} "
+                           f"profile.")
 
-@app.route('/login', methods=["GET", "POST"])
-def login():
-    """Handle user login."""
+    # first, so its timings cover the other extensions' request hooks
+    if app.config['METRICS_ENABLED']:
+        Metrics(app)
 
-    form = LoginForm()
+    if app.config['DEBUG_TOOLBAR']:
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
 
-    if form.validate_on_submit():
-        user = User.authenticate(form.username.data,
-                                 form.password.data)
+    Assets(app)
+    connect_db(app)
+    hasher.init_app(app)
+    JobQueue(app)
 
-        if user:
-            do_login(user)
-            flash(f"Hello, {user.username}!", "success")
-            return redirect("/")
+    app.register_blueprint(views)
 
-        flash("Invalid credentials.", 'danger')
+    if app.config['WHO_TO_FOLLOW']:
+        from graph import Graph
+        Graph(app)
 
-    return render_template('users/login.html', form=form)
+    if app.config['API_ENABLED']:
+        from api import api
+        app.register_blueprint(api)
 
+    # HTTP caching (see conditional.py)
+    app.after_request(apply_cache_policy)
 
-@app.route('/logout')
-def logout():
-    """Handle logout of user."""
+    for command in (recount_stats, load_data, build_assets, schema, jobs):
+        app.cli.add_command(command)
 
-    # remove user id from session
-    do_logout()
-    flash("Successfully logged out!", "success")
-    return redirect("/login")
+    return app
 
 
 ##############################################################################
-# General user routes:
-
-@app.route('/users')
-def list_users():
-    """Page with listing of users.
-
-    Can take a 'q' param in querystring to search by that username.
-    """
-
-    search = request.args.get('q')
-
-    if not search:
-        users = User.query.all()
-    else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
-
-    return render_template('users/index.html', users=users)
-
-
-@app.route('/users/<int:user_id>')
-def users_show(user_id):
-    """Show user profile."""
-
-    user = User.query.get_or_404(user_id)
-
-    # snagging messages in order from the database;
-    # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages)
-
-
-@app.route('/users/<int:user_id>/following')
-def show_following(user_id):
-    """Show list of people this user is following."""
-
-    if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
-
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
-
-
-@app.route('/users/<int:user_id>/followers')
-def users_followers(user_id):
-    """Show list of followers of this user."""
-
-    if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
+# Maintenance commands
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
 
+@click.command('recount-stats')
+@with_appcontext
+def recount_stats():
+    """Rebuild every user's message/follow/like counters."""
 
-@app.route('/users/<int:user_id>/likes')
-def users_likes(user_id):
-    """Show list of liked messages"""
+    from models import db, User
 
-    if not g.user:
-        flash("Access unauthorized.", "danger")
-
-    user = User.query.get_or_404(user_id)
-    user_likes = user.likes
-
-    return render_template('/users/likes.html', user=user, likes=user_likes)
-
-
-@app.route('/users/add_like/<int:message_id>', methods=["POST"])
-def add_like(message_id):
-    """Handle message like"""
-
-    if not g.user:
-        flash("Access unathorized.", "danger")
-        return redirect('/')
-
-    liked_ids = [message.id for message in g.user.likes]
-
-    message = Message.query.get_or_404(message_id)
-    poster_id = message.user.id
-
-    if poster_id == g.user.id:
-        flash("You cannot like your own message.", "danger")
-        return redirect('/')
-
-    if message_id in liked_ids:
-        liked_msg = Likes.query.filter(Likes.user_id == g.user.id).filter(Likes.message_id == message_id).first()
-
-        db.session.delete(liked_msg)
-        db.session.commit()
-
-        flash('Like successfully removed!', "success")
-        return redirect('/')
-
-    new_like = Likes(user_id=g.user.id, message_id=message_id)
-
-    db.session.add(new_like)
+    User.recount_stats()
     db.session.commit()
+    click.echo(f"Recounted stats for {User.query.count()} users.")
 
-    flash("Like added!", "success")
-    return redirect('/')
 
-    
-@app.route('/users/follow/<int:follow_id>', methods=['POST'])
-def add_follow(follow_id):
-    """Add a follow for the currently-logged-in user."""
+@click.command('load-data')
+@click.argument('directory', default='generator')
+@click.option('--workers', type=int, default=None,
+              help="Chunks loaded at once (Postgres only); default CPU count.")
+@click.option('--chunk-size', type=int, default=None,
+              help="MB of CSV per chunk; default 16.")
+@click.option('--reset', is_flag=True,
+              help="Drop and recreate every table first.")
+@click.option('--resume', is_flag=True,
+              help="Finish an interrupted load.")
+@click.option('--skip-timelines', is_flag=True,
+              help="Leave timelines empty; rebuild them later.")
+@with_appcontext
+def load_data(directory, workers, chunk_size, reset, resume, skip_timelines):
+    """Bulk load users/messages/follows/likes CSVs from DIRECTORY."""
 
-    if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
+    from loader import CHUNK_SIZE, LoadError, load
 
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
-    db.session.commit()
+    try:
+        loaded = load(directory, workers=workers,
+                      chunk_size=(chunk_size * 2**20 if chunk_size
+                                  else CHUNK_SIZE),
+                      reset=reset, resume=resume,
+                      timelines=not skip_timelines, report=click.echo)
+    except LoadError as error:
+        raise click.ClickException(str(error))
 
-    return redirect(f"/users/{g.user.id}/following")
+    for table, rows in loaded.items():
+        click.echo(f"Loaded {rows:,} rows into {table}.")
 
 
-@app.route('/users/stop-following/<int:follow_id>', methods=['POST'])
-def stop_following(follow_id):
-    """Have currently-logged-in-user stop following this user."""
+@click.command('build-assets')
+@with_appcontext
+def build_assets():
+    """Fingerprint and precompress static/ into static/dist/."""
 
-    if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
+    from assets import build
 
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
-    db.session.commit()
+    manifest = build(current_app.static_folder)
+    click.echo(f"Built {len(manifest)} assets into "
+               f"{current_app.extensions['assets'].folder}; "
+               f"restart the app to serve them.")
 
-    return redirect(f"/users/{g.user.id}/following")
 
+@click.group(cls=AppGroup)
+def schema():
+    """Inspect, upgrade and check the database schema."""
 
-@app.route('/users/profile', methods=["GET", "POST"])
-def profile():
-    """Update profile for current user."""
 
-    if not g.user:
-        flash("Access unathorized.", "danger")
-        return redirect("/")
+@schema.command('status')
+def schema_status():
+    """Show the schema version and any pending migrations."""
 
-    # prepopulate form with logged in user info 
-    form = UserEditForm(obj=g.user)
+    import migrations
+    from models import db
 
-    if form.validate_on_submit():
-        username = g.user.username
-        user = User.authenticate(username, form.password.data)
+    with db.engine.connect() as connection:
+        version = migrations.current_version(connection)
+        waiting = migrations.pending(connection)
 
-        # if authentication successful we update data on user
-        if user:
-            user.username = form.username.data
-            user.email = form.email.data
-            user.image_url = form.image_url.data
-            user.header_image_url = form.header_image_url.data
-            user.location = form.location.data
-            user.bio = form.bio.data
+    click.echo(f"Schema version {version} of {migrations.head()}.")
+    for version, name, fn in waiting:
+        click.echo(f"  pending {version}: {name}")
 
-            db.session.add(user)
-            db.session.commit()
 
-            return redirect(f"/users/{user.id}")
-            
-        else:
-            flash("Wrong password! Try again.", "danger")
-            return redirect("/")
-    
-    return render_template('/users/edit.html', form=form, user=g.user)
+@schema.command('upgrade')
+def schema_upgrade():
+    """Apply pending migrations."""
 
+    import migrations
 
-@app.route('/users/delete', methods=["POST"])
-def delete_user():
-    """Delete user."""
+    applied = migrations.upgrade()
+    for version, name, fn in applied:
+        click.echo(f"Applied {version}: {name}")
+    click.echo(f"Schema is at version {migrations.head()}.")
 
-    if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
 
-    do_logout()
+@schema.command('verify')
+def schema_verify():
+    """Check that the hot queries' plans use their indexes."""
 
-    db.session.delete(g.user)
-    db.session.commit()
-
-    return redirect("/signup")
+    import migrations
 
+    results = migrations.verify()
+    for description, index, ok, plan in results:
+        click.echo(f"{'ok' if ok else 'MISSING':<8}{description} ({index})")
+        if not ok:
+            click.echo('        ' + plan.replace('\n', '\n        '))
 
-##############################################################################
-# Messages routes:
-
-@app.route('/messages/new', methods=["GET", "POST"])
-def messages_add():
-    """Add a message:
+    if not all(ok for description, index, ok, plan in results):
+        raise click.ClickException("Some queries can't use their indexes.")
 
-    Show form if GET. If valid, update message and redirect to user page.
-    """
 
-    if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
+@click.group(cls=AppGroup)
+def jobs():
+    """Run and inspect background jobs."""
 
-    form = MessageForm()
 
-    if form.validate_on_submit():
-        msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
-        db.session.commit()
+@jobs.command('work')
+@click.option('--threads', type=int, default=4,
+              help="Jobs to run at once.")
+def jobs_work(threads):
+    """Run background jobs until interrupted."""
 
-        return redirect(f"/users/{g.user.id}")
+    queue = current_app.extensions['jobs']
 
-    return render_template('messages/new.html', form=form)
+    click.echo(f"Running jobs on {threads} threads; Ctrl-C to stop.")
+    queue.start(threads)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        click.echo("Finishing the jobs in progress...")
+        queue.stop()
 
 
-@app.route('/messages/<int:message_id>', methods=["GET"])
-def messages_show(message_id):
-    """Show a message."""
+@jobs.command('status')
+def jobs_status():
+    """Count waiting and failed jobs, and show the failures."""
 
-    msg = Message.query.get_or_404(message_id)
-    return render_template('messages/show.html', message=msg)
+    from jobs import Job
+    from models import db
 
+    waiting = Job.query.filter(Job.failed_at.is_(None))
+    failed = Job.query.filter(Job.failed_at.isnot(None))
 
-@app.route('/messages/<int:message_id>/delete', methods=["POST"])
-def messages_destroy(message_id):
-    """Delete a message."""
+    for name, count in (waiting.with_entities(Job.name, db.func.count())
+                        .group_by(Job.name).order_by(Job.name)):
+        click.echo(f"{count:>8} waiting  {name}")
 
-    if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
-
-    msg = Message.query.get_or_404(message_id)
-    # check that user can actually delete the message, i.e. they amde it 
-    if msg.user_id != g.user.id:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
-
-    db.session.delete(msg)
-    db.session.commit()
-
-    return redirect(f"/users/{g.user.id}")
-
-
-##############################################################################
-# Homepage and error pages
-
-@app.errorhandler(404)
-def not_found(error):
-    """404 page"""
-    return render_template('404.html'), 404
-
-
-@app.route('/')
-def homepage():
-    """Show homepage:
-
-    - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
-    """
-
-    if g.user:
-
-        # retrieve the ids of people the user follows and their own 
-        following_ids = [g.user.id] + [user.id for user in g.user.following]
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(following_ids))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
-
-        return render_template('home.html', messages=messages)
-
-    else:
-        return render_template('home-anon.html')
-
-
-##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
-
-@app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
-
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
+    for job in failed.order_by(Job.failed_at):
+        click.echo(f"failed {job.failed_at:%Y-%m-%d %H:%M}: {job.name} "
+                   f"{job.args} after {job.attempts} attempts")
+        click.echo('        ' + job.last_error.strip().splitlines()[-1])
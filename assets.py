@@ -0,0 +1,191 @@
+"""Fingerprinted, precompressed static assets.
+
+`flask build-assets` copies everything under static/ into static/dist/
+under names that include a hash of their contents. It also writes
+gzip and brotli variants wherever they come out meaningfully smaller, plus a manifest.json that
+maps the original names to the built ones. CSS `url(/static/...)`
+references are rewritten to the built names as well.
+
+Templates link assets through `asset_url`:
+
+    <link rel="stylesheet" href="{{ asset_url('stylesheets/style.css') }}">
+    <img src="{{ user.image_url | asset_url }}">
+
+With a manifest this gives `/assets/<built name>`. A built name changes
+whenever the contents do, so those URLs are served as immutable for a
+year, in the best encoding the client accepts. Without a build (the usual
+case in development) it falls back to the plain /static/ URL, and URLs
+that aren't ours, like users' own image links, pass through unchanged.
+"""
+
+import gzip
+import json
+import mimetypes
+import os
+import re
+from hashlib import sha1
+
+import brotli
+from flask import abort, request, send_from_directory, url_for
+
+DIST_FOLDER = 'dist'
+MANIFEST = 'manifest.json'
+
+# a year, the longest lifetime caches are expected to honour
+MAX_AGE = 365 * 24 * 60 * 60
+
+# keep a compressed copy only if it saves at least this fraction
+MIN_SAVING = 0.1
+
+CSS_URL = re.compile(r"""url\(\s*(['"]?)/static/([^'")]+)\1\s*\)""")
+
+
+def fingerprint(name, data):
+    """`name` with a hash of `data` before its extension."""
+
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{sha1(data).hexdigest()[:12]}{ext}"
+
+
+def _compressed(data):
+    """Yield (suffix, compressed data) for each encoding worth keeping."""
+
+    variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0)),
+                ('.br', brotli.compress(data))]
+
+    for suffix, packed in variants:
+        if len(packed) <= len(data) * (1 - MIN_SAVING):
+            yield suffix, packed
+
+
+def build(static_folder):
+    """Build static/dist/ from `static_folder`; returns the manifest.
+
+    Files from earlier builds are left in place, so pages already cached
+    by clients keep working until the next clean deploy.
+    """
+
+    dist = os.path.join(static_folder, DIST_FOLDER)
+    sources = []
+
+    for directory, subdirs, files in os.walk(static_folder):
+        if os.path.abspath(directory) == os.path.abspath(static_folder):
+            subdirs[:] = [d for d in subdirs if d != DIST_FOLDER]
+        for filename in files:
+            path = os.path.join(directory, filename)
+            sources.append(os.path.relpath(path, static_folder)
+                           .replace(os.sep, '/'))
+
+    # stylesheets last, so the files they point to already have new names
+    sources.sort(key=lambda name: (name.endswith('.css'), name))
+    manifest = {}
+
+    for name in sources:
+        with open(os.path.join(static_folder, name), 'rb') as source:
+            data = source.read()
+
+        if name.endswith('.css'):
+            data = CSS_URL.sub(
+                lambda match: (f'url("/assets/{manifest[match[2]]}")'
+                               if match[2] in manifest else match[0]),
+                data.decode('UTF-8')).encode('UTF-8')
+
+        built = fingerprint(name, data)
+        manifest[name] = built
+        target = os.path.join(dist, built)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+
+        with open(target, 'wb') as out:
+            out.write(data)
+        for suffix, packed in _compressed(data):
+            with open(target + suffix, 'wb') as out:
+                out.write(packed)
+
+    with open(os.path.join(dist, MANIFEST), 'w') as out:
+        json.dump(manifest, out, indent=2, sort_keys=True)
+
+    return manifest
+
+
+class Assets:
+    """Serves built assets and resolves names for templates."""
+
+    def __init__(self, app=None):
+        self.folder = None
+        self.manifest = {}
+        self.built = set()
+        self.version = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['assets'] = self
+        app.add_url_rule('/assets/<path:filename>', 'assets',
+                         self.send_asset)
+        app.add_template_global(self.url, 'asset_url')
+        app.add_template_filter(self.url, 'asset_url')
+        self.load(os.path.join(app.static_folder, DIST_FOLDER))
+
+    def load(self, folder):
+        """Use the build in `folder`; with none there, serve from /static."""
+
+        self.folder = folder
+        self.manifest = {}
+
+        try:
+            with open(os.path.join(folder, MANIFEST)) as manifest:
+                self.manifest = json.load(manifest)
+        except FileNotFoundError:
+            pass
+
+        self.built = set(self.manifest.values())
+        self.version = sha1(json.dumps(self.manifest, sort_keys=True)
+                            .encode()).hexdigest() if self.manifest else None
+
+    def url(self, path):
+        """URL for a static file, named relative to static/ or as /static/..."""
+
+        if not path:
+            return path
+
+        name = path[len('/static/'):] if path.startswith('/static/') else path
+
+        if name in self.manifest:
+            return url_for('assets', filename=self.manifest[name])
+
+        if path.startswith('/') or '://' in path:
+            return path
+
+        return url_for('static', filename=path)
+
+    def send_asset(self, filename):
+        """Serve a built file, precompressed if the client accepts it."""
+
+        if filename not in self.built:
+            abort(404)
+
+        mimetype = mimetypes.guess_type(filename)[0]
+        encoding = None
+
+        for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if (request.accept_encodings[candidate]
+                    and os.path.exists(
+                        os.path.join(self.folder, filename + suffix))):
+                encoding = candidate
+                filename += suffix
+                break
+
+        response = send_from_directory(self.folder, filename,
+                                       mimetype=mimetype)
+
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+            # newer Flask names the .gz/.br file here; the client wants the
+            # asset itself
+            response.headers.pop('Content-Disposition', None)
+        response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = (
+            f'public, max-age={MAX_AGE}, immutable')
+
+        return response
@@ -0,0 +1,7 @@
+"""Performance benchmarks for Warbler; see each module for how to run it."""
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+
+    return ordered[min(len(ordered) - 1, round(fraction * (len(ordered) - 1)))]
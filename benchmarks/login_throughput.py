@@ -0,0 +1,103 @@
+"""Benchmark login throughput against the password hashing pool size.
+
+Drives POST /login from a number of concurrent clients for each
+PASSWORD_HASH_WORKERS setting and reports successful logins per second,
+requests turned away with 503, and latency. Worker count 0 is the old
+behaviour: every request thread hashes inline.
+
+Run it from the project root like:
+
+    python -m benchmarks.login_throughput --clients 32 --workers 0 1 2 4 8
+
+It uses a scratch SQLite database unless DATABASE_URL is set.
+"""
+
+import argparse
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app import create_app
+from models import db, hasher, User
+
+app = create_app('bench')
+
+USERNAME = "bench-login"
+PASSWORD = "bench-password"
+
+
+def setup_user(rounds):
+    """Create (or reset) the account the clients log in as."""
+
+    app.config['BCRYPT_LOG_ROUNDS'] = rounds
+    hasher.init_app(app)
+    db.create_all()
+
+    user = User.query.filter_by(username=USERNAME).first()
+    if user:
+        db.session.delete(user)
+        db.session.commit()
+
+    User.signup(USERNAME, f"{USERNAME}@example.com", PASSWORD, None)
+    db.session.commit()
+    db.session.remove()
+
+
+def login():
+    """Log in once on a fresh client; return (status, seconds)."""
+
+    client = app.test_client()
+    began = time.perf_counter()
+    res = client.post("/login",
+                      data={"username": USERNAME, "password": PASSWORD})
+    return res.status_code, time.perf_counter() - began
+
+
+def run(workers, clients, logins):
+    """Time `logins` logins spread over `clients` threads."""
+
+    app.config['PASSWORD_HASH_WORKERS'] = workers
+    app.config.pop('PASSWORD_HASH_QUEUE', None)
+    hasher.init_app(app)
+
+    began = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        results = list(pool.map(lambda _: login(), range(logins)))
+    elapsed = time.perf_counter() - began
+
+    ok = [seconds for status, seconds in results if status == 302]
+    busy = sum(1 for status, _ in results if status == 503)
+    return elapsed, ok, busy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=[0, 1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument('--rounds', type=int, default=12,
+                        help="bcrypt work factor")
+    args = parser.parse_args()
+
+    with app.app_context():
+        setup_user(args.rounds)
+
+    print(f"{args.logins} logins from {args.clients} clients, "
+          f"bcrypt cost {args.rounds}, {os.cpu_count()} CPUs")
+    print(f"{'workers':>8}{'logins/s':>10}{'503s':>7}"
+          f"{'p50 ms':>10}{'max ms':>10}")
+
+    for workers in args.workers:
+        elapsed, ok, busy = run(workers, args.clients, args.logins)
+        p50 = statistics.median(ok) * 1000 if ok else float('nan')
+        slowest = max(ok) * 1000 if ok else float('nan')
+        print(f"{workers:>8}{len(ok) / elapsed:>10.1f}{busy:>7}"
+              f"{p50:>10.1f}{slowest:>10.1f}")
+
+    hasher.shutdown()
+
+
+if __name__ == '__main__':
+    main()
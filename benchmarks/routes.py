@@ -0,0 +1,487 @@
+"""Benchmark every page and action in views.py under concurrent clients.
+
+Generates a dataset with generator/create_csvs.py (or takes an existing
+CSV directory), loads it with the bulk loader, then drives each route in
+turn from a number of concurrent clients, each logged in as a different
+user. For every route it reports requests per second, p50/p95/p99
+latency and SQL statements per request. New messages are posted both
+as the clients' own users and as the most followed users, whose posts
+fan out to the most timelines; that fan-out, like account purges, runs
+as background jobs unless `--jobs-eager` times it inside the request.
+
+Run it from the project root like:
+
+    DATABASE_URL=postgresql:///warbler-bench python -m benchmarks.routes \\
+        --users 100000 --messages 5000000 --follows 2000000 --clients 16 \\
+        --save baseline.json
+
+and later, on the same dataset (`--no-load` keeps the loaded one):
+
+    python -m benchmarks.routes --no-load --compare baseline.json
+
+`--compare` exits non-zero if any route's p95 got slower by more than
+`--tolerance` (and `--floor-ms`), or it runs more SQL per request than
+before.
+
+It uses a scratch SQLite database unless DATABASE_URL is set; loading
+replaces everything in it.
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import event
+
+from app import create_app
+from benchmarks import percentile
+from loader import load
+from models import db, hasher, Follows, Message, User
+from views import CURR_USER_KEY
+
+app = create_app('bench')
+
+GENERATOR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'generator', 'create_csvs.py')
+
+# what the generator's users' passwords hash
+PASSWORD = "password"
+
+SEARCH_TERMS = ["coffee", "weekend music", "the", "zebra"]
+
+# users and messages picked at random to visit and act on
+SAMPLE_SIZE = 1000
+
+# the most followed users, whose posts fan out the furthest
+AUTHORS = 20
+
+# SQL statements run by the current thread since it last reset the count
+statements = threading.local()
+
+
+def count_statements(conn, cursor, statement, parameters, context,
+                     executemany):
+    statements.count = getattr(statements, 'count', 0) + 1
+
+
+##############################################################################
+# Dataset
+
+
+def load_dataset(args):
+    """Generate (unless given --dataset) and load the CSVs."""
+
+    if args.dataset:
+        load(args.dataset, reset=True, report=print)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"Generating {args.users:,} users, {args.messages:,} "
+              f"messages, {args.follows:,} follows...", flush=True)
+        subprocess.run([
+            sys.executable, GENERATOR, '--out', directory,
+            '--users', str(args.users), '--messages', str(args.messages),
+            '--follows', str(args.follows), '--seed', str(args.seed),
+            '--end', '2020-01-01',
+        ], check=True, stdout=subprocess.DEVNULL)
+        load(directory, reset=True, report=print)
+
+
+def sample(seed):
+    """(user id, username) and (message id, author id) pairs to use, and
+    the ids of the most followed users."""
+
+    def shuffled(column):
+        # the same "random" order on every run and database
+        return db.func.abs((column * 7919 + seed) % 104729)
+
+    # --no-load runs see the accounts earlier runs deleted
+    users = (db.session.query(User.id, User.username)
+             .filter(User.deleted_at.is_(None))
+             .order_by(shuffled(User.id)).limit(SAMPLE_SIZE).all())
+    messages = (db.session.query(Message.id, Message.user_id)
+                .join(User, User.id == Message.user_id)
+                .filter(User.deleted_at.is_(None))
+                .order_by(shuffled(Message.id)).limit(SAMPLE_SIZE).all())
+
+    authors = [user_id for (user_id,) in
+               db.session.query(User.id)
+               .filter(User.deleted_at.is_(None))
+               .order_by(User.followers_count.desc(), User.id)
+               .limit(AUTHORS)]
+
+    return users, messages, authors
+
+
+##############################################################################
+# Clients
+
+
+class Client:
+    """One simulated user, with a browser session and a few targets."""
+
+    def __init__(self, number, users, messages, authors):
+        self.number = number
+        self.user_id, self.username = users[number % len(users)]
+        self.email = User.query.get(self.user_id).email
+        self.users = users
+        self.messages = messages
+        self.turn = 0
+
+        self.http = self.logged_in(self.user_id)
+        # and a popular account, to post as
+        self.author = self.logged_in(authors[number % len(authors)])
+
+        # set up by the prepare_ methods before each timed request
+        self.doomed_message = None
+        self.leaving = None
+
+        # someone to follow and unfollow, and a message to like and unlike
+        followed = (db.session.query(Follows.user_being_followed_id)
+                    .filter(Follows.user_following_id == self.user_id))
+        stranger = (db.session.query(User.id)
+                    .filter(User.id != self.user_id)
+                    .filter(~User.id.in_(followed))
+                    .order_by(User.id).first())
+        self.stranger = stranger and stranger[0]
+        self.following = False
+        self.liking = next((message_id for message_id, author in messages
+                            if author != self.user_id), None)
+
+    @staticmethod
+    def logged_in(user_id):
+        http = app.test_client()
+        with http.session_transaction() as session:
+            session[CURR_USER_KEY] = user_id
+        return http
+
+    def pick(self, items):
+        # each client walks the samples from its own place
+        self.turn += 1
+        return items[(self.number * 31 + self.turn) % len(items)]
+
+    def home(self):
+        return self.http.get('/')
+
+    def home_anon(self):
+        return app.test_client().get('/')
+
+    def users_search(self):
+        return self.http.get(f'/users?q={self.pick(SEARCH_TERMS)}')
+
+    def profile(self):
+        return self.http.get(f'/users/{self.pick(self.users)[0]}')
+
+    def following(self):
+        return self.http.get(f'/users/{self.pick(self.users)[0]}/following')
+
+    def followers(self):
+        return self.http.get(f'/users/{self.pick(self.users)[0]}/followers')
+
+    def likes(self):
+        return self.http.get(f'/users/{self.pick(self.users)[0]}/likes')
+
+    def message(self):
+        return self.http.get(f'/messages/{self.pick(self.messages)[0]}')
+
+    def messages_search(self):
+        return self.http.get(
+            f'/messages/search?q={self.pick(SEARCH_TERMS)}')
+
+    def like_toggle(self):
+        return self.http.post(f'/messages/{self.liking}/like')
+
+    def follow_toggle(self):
+        action = 'stop-following' if self.following else 'follow'
+        response = self.http.post(f'/users/{action}/{self.stranger}')
+        self.following = not self.following
+        return response
+
+    def message_new(self):
+        self.turn += 1
+        return self.http.post('/messages/new', data={
+            'text': f"benchmark warble {self.turn}"})
+
+    def message_new_popular(self):
+        self.turn += 1
+        return self.author.post('/messages/new', data={
+            'text': f"benchmark warble {self.turn}"})
+
+    def prepare_message_delete(self):
+        self.http.post('/messages/new', data={'text': "to be deleted"})
+        with app.app_context():
+            self.doomed_message = (db.session.query(db.func.max(Message.id))
+                                   .filter(Message.user_id == self.user_id)
+                                   .scalar())
+
+    def message_delete(self):
+        return self.http.post(f'/messages/{self.doomed_message}/delete')
+
+    def profile_edit(self):
+        self.turn += 1
+        return self.http.post('/users/profile', data={
+            'username': self.username,
+            'email': self.email,
+            'bio': f"edited {self.turn} times",
+            'password': PASSWORD,
+        })
+
+    def prepare_account_delete(self):
+        self.leaving = app.test_client()
+        self.signup(self.leaving)
+
+    def account_delete(self):
+        return self.leaving.post('/users/delete')
+
+    def prepare_logout(self):
+        self.leaving = self.logged_in(self.user_id)
+
+    def logout(self):
+        return self.leaving.get('/logout')
+
+    def signup(self, http=None):
+        username = f"bench-{uuid.uuid4().hex[:12]}"
+        return (http or app.test_client()).post('/signup', data={
+            'username': username,
+            'email': f"{username}@example.com",
+            'password': PASSWORD,
+        })
+
+    def login(self):
+        return app.test_client().post('/login', data={
+            'username': self.username,
+            'password': PASSWORD,
+        })
+
+
+def succeeded(response):
+    return response.status_code < 400
+
+
+def redirected(response):
+    # forms that fail validation render again with a 200
+    return response.status_code == 302
+
+
+def redirects_to(path):
+    # refusals redirect too, but home
+    def worked(response):
+        return (response.status_code == 302
+                and path in response.headers.get('Location', ''))
+    return worked
+
+
+# `call(client)` is timed and returns the response, `worked(response)`
+# says whether it did what was asked, and `prepare(client)`, if given,
+# sets up each call beforehand, untimed and uncounted
+Route = namedtuple('Route', ['call', 'worked', 'prepare'], defaults=[None])
+
+ROUTES = {
+    'home': Route(Client.home, succeeded),
+    'home-anon': Route(Client.home_anon, succeeded),
+    'users-search': Route(Client.users_search, succeeded),
+    'profile': Route(Client.profile, succeeded),
+    'following': Route(Client.following, succeeded),
+    'followers': Route(Client.followers, succeeded),
+    'likes': Route(Client.likes, succeeded),
+    'message': Route(Client.message, succeeded),
+    'messages-search': Route(Client.messages_search, succeeded),
+    'like-toggle': Route(Client.like_toggle, succeeded),
+    'follow-toggle': Route(Client.follow_toggle, redirected),
+    'message-new': Route(Client.message_new, redirects_to('/users/')),
+    'message-new-popular': Route(Client.message_new_popular,
+                                 redirects_to('/users/')),
+    'message-delete': Route(Client.message_delete, redirects_to('/users/'),
+                            Client.prepare_message_delete),
+    'profile-edit': Route(Client.profile_edit, redirects_to('/users/')),
+    'signup': Route(Client.signup, redirected),
+    'login': Route(Client.login, redirected),
+    'logout': Route(Client.logout, redirects_to('/login'),
+                    Client.prepare_logout),
+    'account-delete': Route(Client.account_delete, redirects_to('/signup'),
+                            Client.prepare_account_delete),
+}
+
+
+##############################################################################
+# Running
+
+
+def drive(client, route, count):
+    """Call `route` `count` times; returns (seconds, statements, ok)s."""
+
+    results = []
+
+    for _ in range(count):
+        if route.prepare:
+            route.prepare(client)
+        statements.count = 0
+        began = time.perf_counter()
+        response = route.call(client)
+        seconds = time.perf_counter() - began
+        results.append((seconds, statements.count, route.worked(response)))
+
+    return results
+
+
+def run_route(clients, route, requests, warmup):
+    """Spread `requests` calls over `clients`; returns the route's stats."""
+
+    per_client = math.ceil(requests / len(clients))
+
+    with ThreadPoolExecutor(max_workers=len(clients)) as pool:
+        list(pool.map(lambda client: drive(client, route, warmup), clients))
+
+        began = time.perf_counter()
+        results = [result for client_results in pool.map(
+            lambda client: drive(client, route, per_client), clients)
+            for result in client_results]
+        elapsed = time.perf_counter() - began
+
+    timings = sorted(seconds for seconds, _, _ in results)
+
+    return {
+        'requests': len(results),
+        'errors': sum(1 for _, _, ok in results if not ok),
+        'rps': len(results) / elapsed,
+        'p50_ms': percentile(timings, 0.50) * 1000,
+        'p95_ms': percentile(timings, 0.95) * 1000,
+        'p99_ms': percentile(timings, 0.99) * 1000,
+        'statements': sum(count for _, count, _ in results) / len(results),
+    }
+
+
+def compare(results, baseline, tolerance, floor_ms):
+    """Print changes against `baseline`; returns the routes that regressed."""
+
+    regressed = []
+    print(f"\nAgainst {baseline['meta']['commit']} "
+          f"({baseline['meta']['when']}):")
+
+    for name, now in results.items():
+        before = baseline['routes'].get(name)
+        if not before:
+            continue
+
+        change = now['p95_ms'] / before['p95_ms'] - 1
+        more_sql = now['statements'] > before['statements'] + 0.5
+        slower = (change > tolerance
+                  and now['p95_ms'] - before['p95_ms'] > floor_ms)
+        if slower or more_sql:
+            regressed.append(name)
+
+        flag = 'REGRESSED' if slower or more_sql else ''
+        print(f"{name:<21}p95 {change:>+7.0%}  SQL/req "
+              f"{before['statements']:>5.1f} -> {now['statements']:>5.1f}"
+              f"  {flag}")
+
+    return regressed
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], check=True,
+            capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--follows', type=int, default=20000)
+    parser.add_argument('--dataset', help="load these CSVs instead")
+    parser.add_argument('--no-load', action='store_true',
+                        help="use the data already in the database")
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=400,
+                        help="per route")
+    parser.add_argument('--warmup', type=int, default=5,
+                        help="unrecorded requests per client per route")
+    parser.add_argument('--routes', nargs='+', choices=list(ROUTES),
+                        default=list(ROUTES))
+    parser.add_argument('--rounds', type=int, default=12,
+                        help="bcrypt work factor for signups")
+    parser.add_argument('--jobs-eager', action='store_true',
+                        help="run deferred work (timeline fan-out, account "
+                             "purges) inside the request that queues it")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', help="write results as JSON here")
+    parser.add_argument('--compare', help="a JSON file from --save")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed p95 slowdown, as a fraction")
+    parser.add_argument('--floor-ms', type=float, default=2,
+                        help="p95 slowdowns smaller than this are noise")
+    args = parser.parse_args()
+
+    app.config['BCRYPT_LOG_ROUNDS'] = args.rounds
+    app.config['JOBS_EAGER'] = args.jobs_eager
+    hasher.init_app(app)
+
+    with app.app_context():
+        if not args.no_load:
+            load_dataset(args)
+
+        users, messages, authors = sample(args.seed)
+        clients = [Client(number, users, messages, authors)
+                   for number in range(args.clients)]
+        db.session.remove()
+
+        event.listen(db.engine, 'before_cursor_execute', count_statements)
+
+    print(f"{args.requests} requests per route from {args.clients} "
+          f"clients, {db.engine.dialect.name}, {os.cpu_count()} CPUs")
+    print(f"{'route':<21}{'req/s':>9}{'errors':>8}{'p50 ms':>9}"
+          f"{'p95 ms':>9}{'p99 ms':>9}{'SQL/req':>9}")
+
+    results = {}
+
+    for name in args.routes:
+        stats = run_route(clients, ROUTES[name], args.requests, args.warmup)
+        results[name] = stats
+        print(f"{name:<21}{stats['rps']:>9.1f}{stats['errors']:>8}"
+              f"{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}"
+              f"{stats['p99_ms']:>9.1f}{stats['statements']:>9.1f}",
+              flush=True)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'when': datetime.utcnow().isoformat(timespec='seconds'),
+            'database': db.engine.dialect.name,
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'args': {key: value for key, value in vars(args).items()
+                     if key not in ('save', 'compare')},
+        },
+        'routes': results,
+    }
+
+    if args.save:
+        with open(args.save, 'w') as out:
+            json.dump(report, out, indent=2)
+        print(f"\nSaved results to {args.save}.")
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressed = compare(results, json.load(baseline),
+                                args.tolerance, args.floor_ms)
+        if regressed:
+            sys.exit(f"Regressed: {', '.join(regressed)}")
+
+
+if __name__ == '__main__':
+    main()
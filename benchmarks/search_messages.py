@@ -0,0 +1,115 @@
+"""Benchmark message search against a large messages table.
+
+Fills the database named by DATABASE_URL (by default a scratch SQLite file;
+point it at a throwaway Postgres database for production numbers) with
+synthetic messages, then times the first page and deep cursor pages of
+search_messages for common, middling and rare words.
+
+Run it from the project root like:
+
+    DATABASE_URL=postgresql:///warbler-bench \\
+        python -m benchmarks.search_messages --messages 10000000
+
+Loading is skipped if the table already holds enough messages, so repeat
+runs only pay for the searches.
+"""
+
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from app import create_app
+from benchmarks import percentile
+from models import db, User, Message
+from search import search_messages
+
+app = create_app('bench')
+
+# Zipf-ish vocabulary: early words are common, later ones rare
+VOCABULARY = [f"word{i}" for i in range(20000)]
+WEIGHTS = [1 / (rank + 1) for rank in range(len(VOCABULARY))]
+
+BATCH_SIZE = 50000
+
+
+def load(num_messages, num_users, seed):
+    """Insert users and messages until there are `num_messages`."""
+
+    rng = random.Random(seed)
+    db.create_all()
+
+    have_users = User.query.count()
+    if have_users < num_users:
+        db.session.execute(User.__table__.insert(), [
+            dict(username=f"bench{i}", email=f"bench{i}@example.com",
+                 password="x")
+            for i in range(have_users, num_users)
+        ])
+        db.session.commit()
+
+    user_ids = [user_id for (user_id,) in db.session.query(User.id)]
+    have = Message.query.count()
+    start = datetime(2015, 1, 1)
+    began = time.perf_counter()
+
+    while have < num_messages:
+        batch = min(BATCH_SIZE, num_messages - have)
+        db.session.execute(Message.__table__.insert(), [
+            dict(text=' '.join(rng.choices(VOCABULARY, WEIGHTS, k=12))[:140],
+                 timestamp=start + timedelta(seconds=have + i),
+                 user_id=rng.choice(user_ids))
+            for i in range(batch)
+        ])
+        db.session.commit()
+        have += batch
+        rate = have / (time.perf_counter() - began)
+        print(f"  loaded {have:,} messages ({rate:,.0f}/s)", flush=True)
+
+
+def time_search(term, pages, repeat):
+    """Time each of the first `pages` pages of a search `repeat` times."""
+
+    timings = []
+
+    for _ in range(repeat):
+        before = None
+        for _ in range(pages):
+            began = time.perf_counter()
+            messages, before = search_messages(term, before=before)
+            timings.append(time.perf_counter() - began)
+            db.session.remove()
+            if not before:
+                break
+
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--pages', type=int, default=10,
+                        help="cursor pages to walk per search")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    with app.app_context():
+        print(f"Loading {args.messages:,} messages into "
+              f"{db.engine.url!r}...")
+        load(args.messages, args.users, args.seed)
+
+        print(f"{'term':<24}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+        for term in ["word0", "word10", "word500", "word19999",
+                     "word1 word2", "nosuchword"]:
+            timings = sorted(time_search(term, args.pages, args.repeat))
+            print(f"{term:<24}"
+                  f"{statistics.median(timings) * 1000:>10.2f}"
+                  f"{percentile(timings, 0.95) * 1000:>10.2f}"
+                  f"{timings[-1] * 1000:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
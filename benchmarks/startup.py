@@ -0,0 +1,75 @@
+"""Benchmark how long a fresh Warbler process takes to start serving.
+
+Each run is a new Python process that times importing app.py, building
+the app with `create_app` and serving its first request (GET /login,
+which needs no database), for each config profile. Medians are reported
+along with the modules each profile imported.
+
+Run it from the project root like:
+
+    python -m benchmarks.startup --runs 20 --profiles dev prod
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# run in each child process; prints its timings as JSON
+CHILD = """
+import json, sys, time
+
+began = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app(sys.argv[1])
+created = time.perf_counter()
+application.test_client().get('/login')
+served = time.perf_counter()
+
+print(json.dumps({
+    'import': imported - began,
+    'create_app': created - imported,
+    'first request': served - created,
+    'modules': len(sys.modules),
+    'toolbar': 'flask_debugtoolbar' in sys.modules,
+}))
+"""
+
+STEPS = ['import', 'create_app', 'first request']
+
+
+def start(profile):
+    """Start the app once in a fresh process; return its timings."""
+
+    env = dict(os.environ, SECRET_KEY=os.environ.get('SECRET_KEY', 'bench'))
+    out = subprocess.run([sys.executable, '-c', CHILD, profile], env=env,
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--profiles', nargs='+',
+                        default=['dev', 'test', 'prod', 'bench'])
+    args = parser.parse_args()
+
+    print(f"median of {args.runs} fresh processes, in ms")
+    print(f"{'profile':<8}" + ''.join(f"{step:>15}" for step in STEPS)
+          + f"{'total':>10}{'modules':>9}  toolbar")
+
+    for profile in args.profiles:
+        runs = [start(profile) for _ in range(args.runs)]
+        medians = [statistics.median(run[step] for run in runs) * 1000
+                   for step in STEPS]
+        modules = statistics.median(run['modules'] for run in runs)
+        print(f"{profile:<8}" + ''.join(f"{ms:>15.1f}" for ms in medians)
+              + f"{sum(medians):>10.1f}{modules:>9.0f}"
+              + f"  {'yes' if runs[0]['toolbar'] else 'no'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""Benchmark "who to follow" suggestions from the in-memory follow graph.
+
+By default builds a synthetic graph with power-law popularity (a few
+accounts followed by many, most by few) and reports the time to build the
+arrays, their size, and suggestion latency for randomly picked users:
+
+    python -m benchmarks.who_to_follow --users 200000 --follows 2000000
+
+With --db it loads the graph from the benchmark database instead (load it
+with `python -m benchmarks.routes` first) and also times the same scoring
+done in SQL with self-joins, for comparison:
+
+    DATABASE_URL=postgresql:///warbler-bench \\
+        python -m benchmarks.who_to_follow --db
+"""
+
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from benchmarks import percentile
+from graph import COMMON_FOLLOWER_WEIGHT, FollowGraph
+
+# the same scoring as FollowGraph.suggest, without its sampling
+SUGGEST_SQL = """
+    SELECT candidate, sum(weight) AS score
+    FROM (
+        SELECT f2.user_being_followed_id AS candidate, 1.0 AS weight
+        FROM follows f1
+        JOIN follows f2 ON f2.user_following_id = f1.user_being_followed_id
+        WHERE f1.user_following_id = :user_id
+        UNION ALL
+        SELECT f2.user_being_followed_id, :common_weight
+        FROM follows f1
+        JOIN follows f2 ON f2.user_following_id = f1.user_following_id
+        WHERE f1.user_being_followed_id = :user_id
+    ) paths
+    WHERE candidate != :user_id
+      AND candidate NOT IN (
+          SELECT user_being_followed_id FROM follows
+          WHERE user_following_id = :user_id)
+    GROUP BY candidate
+    ORDER BY score DESC
+    LIMIT 10
+"""
+
+
+def synthetic(users, follows, seed):
+    """(followers, followed) arrays: uniform followers, power-law followees."""
+
+    rng = np.random.default_rng(seed)
+    followers = rng.integers(1, users + 1, follows)
+    # inverse CDF of rank ** -1 over 1..users, then a fixed shuffle of ranks
+    ranks = np.exp(rng.random(follows) * np.log(users + 1)).astype(np.int64)
+    followed = rng.permutation(users)[ranks.clip(1, users) - 1] + 1
+
+    pairs = np.unique(np.stack([followers, followed], axis=1), axis=0)
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    return pairs[:, 0], pairs[:, 1]
+
+
+def time_calls(fn, user_ids):
+    """Per-call seconds of fn(user_id) for each of `user_ids`, sorted."""
+
+    times = []
+    for user_id in user_ids:
+        began = time.perf_counter()
+        fn(int(user_id))
+        times.append(time.perf_counter() - began)
+    return sorted(times)
+
+
+def report(name, times):
+    print(f"{name:<28}{percentile(times, 0.5) * 1000:>9.2f}"
+          f"{percentile(times, 0.95) * 1000:>9.2f}"
+          f"{percentile(times, 0.99) * 1000:>9.2f}"
+          f"{statistics.mean(times) * 1000:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--follows', type=int, default=2000000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--samples', type=int, default=500,
+                        help="users to suggest for")
+    parser.add_argument('--db', action='store_true',
+                        help="load the graph from DATABASE_URL")
+    args = parser.parse_args()
+
+    if args.db:
+        from app import create_app
+        from models import db
+
+        app = create_app('bench')
+        context = app.app_context()
+        context.push()
+
+        began = time.perf_counter()
+        graph = FollowGraph.load()
+        built = time.perf_counter() - began
+    else:
+        followers, followed = synthetic(args.users, args.follows, args.seed)
+        began = time.perf_counter()
+        graph = FollowGraph(followers, followed)
+        built = time.perf_counter() - began
+
+    size = sum(array.nbytes for array in
+               (graph.ids, *graph.following, *graph.followers))
+    print(f"{len(graph.ids):,} users, {len(graph):,} follows: built in "
+          f"{built:.2f}s, {size / 2**20:.1f} MB of arrays")
+
+    rng = np.random.default_rng(args.seed)
+    samples = {
+        'random users': rng.choice(
+            graph.ids, min(args.samples, len(graph.ids)), replace=False),
+        # the biggest neighbourhoods, and the slowest case for the joins
+        'most followed': graph.popular[:min(args.samples, 50)],
+    }
+
+    print(f"{'':<28}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'mean ms':>9}")
+    for name, sample in samples.items():
+        report(f"graph, {name}", time_calls(graph.suggest, sample))
+
+        if args.db:
+            sql = db.text(SUGGEST_SQL)
+            report(f"SQL, {name}", time_calls(
+                lambda user_id: db.session.execute(sql, {
+                    'user_id': user_id,
+                    'common_weight': COMMON_FOLLOWER_WEIGHT,
+                }).fetchall(),
+                sample[:100]))
+
+    if args.db:
+        context.pop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Small in-process caches for Warbler.
+
+These live in one worker's memory, so every entry must be either safe to
+serve a little stale (entries expire after `ttl` seconds) or explicitly
+invalidated by the code that changes what it was built from.
+"""
+
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds.
+
+    Holds at most `maxsize` entries, evicting the least recently used.
+    A `maxsize` or `ttl` of 0 disables the cache.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Return the live value for `key`, or `default`."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return default
+
+            expires, value = entry
+            if expires <= self.clock():
+                del self._entries[key]
+                return default
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Store `value` under `key` for the next `ttl` seconds."""
+
+        if not self.maxsize or not self.ttl:
+            return
+
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """Drop `key` if present."""
+
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Drop everything."""
+
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,104 @@
+"""HTTP caching policy for Warbler pages.
+
+Pages that can be revalidated go through `conditional`: the route gathers
+what the page shows (rows, ids, follow and like state) and passes it in as
+the page's state, which becomes its ETag. A client already holding that
+version gets an empty 304 before the template is rendered at all. There
+is no Last-Modified: rows have no modification time, and nothing else
+dates a profile edit, a follow or the viewer, so a date alone would
+revalidate pages that have changed.
+
+Everything else gets a default from `apply_cache_policy`: `no-cache` (may
+be stored, but must be revalidated), private when someone is logged in.
+Routes showing data that shouldn't be left in a browser cache at all
+are marked `@no_store`. Static files keep the headers Flask gives them.
+"""
+
+import os
+from functools import lru_cache, wraps
+from hashlib import sha1
+
+from flask import current_app, g, make_response, request, session
+from sqlalchemy import inspect
+
+
+def row_state(obj):
+    """The column values of a model instance, for use in page state."""
+
+    return tuple(getattr(obj, attr.key)
+                 for attr in inspect(type(obj)).column_attrs)
+
+
+@lru_cache(maxsize=None)
+def _templates_digest(root):
+    # a deploy that changes any template must change every ETag
+    digest = sha1()
+
+    for directory, subdirs, files in sorted(os.walk(root)):
+        subdirs.sort()
+        for name in sorted(files):
+            with open(os.path.join(directory, name), 'rb') as template:
+                digest.update(template.read())
+
+    return digest.hexdigest()
+
+
+def page_etag(state):
+    """ETag for a page showing `state` to the current viewer."""
+
+    viewer = g.user and (g.user.id, g.user.username, g.user.image_url)
+    templates = _templates_digest(
+        os.path.join(current_app.root_path, current_app.template_folder))
+    assets = current_app.extensions.get('assets')
+    release = (templates, assets and assets.version)
+
+    return sha1(repr((release, viewer, state)).encode()).hexdigest()
+
+
+def conditional(state, render):
+    """Respond with `render()`, or a 304 if the client has this version.
+
+    `state` must capture everything the page shows apart from the viewer's
+    own nav details, the templates and the asset build, which are added
+    here. Pending flash messages would only show on a full render, so they
+    skip the check.
+    """
+
+    if '_flashes' in session:
+        return make_response(render())
+
+    response = current_app.response_class()
+    response.set_etag(page_etag(state), weak=True)
+    response.make_conditional(request)
+
+    if response.status_code != 304:
+        response.set_data(render())
+
+    return response
+
+
+def no_store(view):
+    """Mark a view's responses as never to be cached."""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        response = make_response(view(*args, **kwargs))
+        response.cache_control.no_store = True
+        return response
+
+    return wrapper
+
+
+def apply_cache_policy(response):
+    """Give responses that didn't choose caching headers the default."""
+
+    if request.endpoint == 'static' or response.headers.get('Cache-Control'):
+        return response
+
+    response.cache_control.no_cache = True
+
+    if g.get('user'):
+        response.cache_control.private = True
+        response.vary.add('Cookie')
+
+    return response
@@ -0,0 +1,142 @@
+"""Configuration profiles for Warbler.
+
+`create_app` takes a profile name, or reads WARBLER_CONFIG (default "dev"):
+
+    dev     local development; the debug toolbar (shown in debug mode)
+    test    the test suite, on the warbler-test database, without CSRF
+            and with background jobs run inline
+    prod    production; no debugging extensions, SECRET_KEY required
+    bench   benchmarks; production settings on a scratch database
+
+Most settings can be set through environment variables as noted, and any
+of them passed to `create_app` as keyword arguments.
+"""
+
+import os
+
+
+def _int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def _float(name, default):
+    return float(os.environ.get(name, default))
+
+
+class Config:
+    """Settings shared by every profile."""
+
+    # Get DB_URI from environ variable (useful for production/testing) or,
+    # if not set there, use development local db.
+    SQLALCHEMY_DATABASE_URI = os.environ.get(
+        'DATABASE_URL', 'postgresql:///warbler')
+
+    # Read replicas for GET requests, as comma-separated URLs, and how long
+    # a user who just wrote keeps reading from the primary; see replicas.py.
+    SQLALCHEMY_REPLICA_URIS = [
+        url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+        if url]
+    REPLICA_PIN_SECONDS = _float('REPLICA_PIN_SECONDS', 5)
+
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+    SECRET_KEY = os.environ.get('SECRET_KEY', "it's a secret")
+
+    # How many logged-in users' rows to keep in memory, and for how long;
+    # see load_current_user. A TTL of 0 turns the cache off.
+    CURRENT_USER_CACHE_SIZE = _int('CURRENT_USER_CACHE_SIZE', 10000)
+    CURRENT_USER_CACHE_TTL = _float('CURRENT_USER_CACHE_TTL', 30)
+
+    # How many rendered message list items to keep; see message_fragment.
+    MESSAGE_FRAGMENT_CACHE_SIZE = _int('MESSAGE_FRAGMENT_CACHE_SIZE', 20000)
+    MESSAGE_FRAGMENT_CACHE_TTL = _float('MESSAGE_FRAGMENT_CACHE_TTL', 3600)
+
+    # Followers/following lists longer than this are streamed; see
+    # user_list_page.
+    STREAM_LISTS_OVER = _int('STREAM_LISTS_OVER', 200)
+
+    # bcrypt work factor for new hashes; older hashes are upgraded at login.
+    # Hashing runs on PASSWORD_HASH_WORKERS threads (default: one per CPU)
+    # with at most PASSWORD_HASH_QUEUE waiting before requests are turned
+    # away.
+    BCRYPT_LOG_ROUNDS = _int('BCRYPT_LOG_ROUNDS', 12)
+    if 'PASSWORD_HASH_WORKERS' in os.environ:
+        PASSWORD_HASH_WORKERS = _int('PASSWORD_HASH_WORKERS', 0)
+    if 'PASSWORD_HASH_QUEUE' in os.environ:
+        PASSWORD_HASH_QUEUE = _int('PASSWORD_HASH_QUEUE', 0)
+
+    # /metrics needs METRICS_TOKEN as a bearer token if it's set, and is
+    # open to anyone if not, unless METRICS_PUBLIC is off; requests
+    # running more than METRICS_QUERY_WARNING SQL statements are logged.
+    # See metrics.py.
+    METRICS_ENABLED = True
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    METRICS_PUBLIC = True
+    METRICS_QUERY_WARNING = _int('METRICS_QUERY_WARNING', 50)
+
+    # Timeline fan-out and other deferred work runs on JOBS_WORKERS
+    # threads per process, or only in `flask jobs work` processes if 0.
+    # Failed jobs are retried after JOBS_RETRY_SECONDS, doubling, up to
+    # JOBS_MAX_ATTEMPTS runs. See jobs.py.
+    JOBS_WORKERS = _int('JOBS_WORKERS', 2)
+    JOBS_EAGER = False
+    JOBS_POLL_SECONDS = _float('JOBS_POLL_SECONDS', 1)
+    JOBS_LEASE_SECONDS = _float('JOBS_LEASE_SECONDS', 300)
+    JOBS_RETRY_SECONDS = _float('JOBS_RETRY_SECONDS', 10)
+    JOBS_MAX_ATTEMPTS = _int('JOBS_MAX_ATTEMPTS', 5)
+
+    # "Who to follow" on the home page, from an in-memory copy of the
+    # follow graph (needs NumPy) that each process reloads every
+    # GRAPH_RELOAD_SECONDS; see graph.py.
+    WHO_TO_FOLLOW = True
+    GRAPH_RELOAD_SECONDS = _float('GRAPH_RELOAD_SECONDS', 3600)
+
+    # The JSON API at /api/v1; see api.py.
+    API_ENABLED = True
+
+    # Whether to load Flask-DebugToolbar at all. When loaded it only shows
+    # in debug mode, but it still wraps every request.
+    DEBUG_TOOLBAR = False
+    DEBUG_TB_INTERCEPT_REDIRECTS = True
+
+
+class DevConfig(Config):
+    DEBUG_TOOLBAR = True
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = os.environ.get(
+        'TEST_DATABASE_URL', 'postgresql:///warbler-test')
+    SQLALCHEMY_REPLICA_URIS = []
+
+    # Don't have WTForms use CSRF at all, since it's a pain to test
+    WTF_CSRF_ENABLED = False
+
+    # deferred work happens before the request returns, so tests see it
+    JOBS_EAGER = True
+
+    # a graph kept between tests would hold earlier tests' follows
+    WHO_TO_FOLLOW = False
+
+
+class ProdConfig(Config):
+    # no default: a known key would let anyone forge sessions
+    SECRET_KEY = os.environ.get('SECRET_KEY')
+
+    # /metrics only for scrapers holding METRICS_TOKEN
+    METRICS_PUBLIC = False
+
+
+class BenchConfig(Config):
+    SQLALCHEMY_DATABASE_URI = os.environ.get(
+        'DATABASE_URL', 'sqlite:///warbler-bench.db')
+    WTF_CSRF_ENABLED = False
+
+
+PROFILES = {
+    'dev': DevConfig,
+    'test': TestConfig,
+    'prod': ProdConfig,
+    'bench': BenchConfig,
+}
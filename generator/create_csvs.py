@@ -2,76 +2,214 @@
 
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+tweak the CSV formats or generate fewer/more rows, e.g. for capacity tests:
+
+    python generator/create_csvs.py --users 1000000 --messages 100000000 \\
+        --follows 50000000 --out /data/staging
+
+and then load them with `flask load-data /data/staging --reset`.
+
+Everything is made up locally, without any network access, from `--seed`:
+the same seed, sizes and `--end` give the same files however many
+`--workers` write them. Rows are generated in shards, each by one worker
+process into its own part file, and the parts are joined in order, so
+memory use stays flat whatever the sizes.
+
+Followed accounts, and message authors to a lesser extent, are drawn from
+power laws, so a few celebrity accounts have a large share of followers
+and most users have a handful. Message timestamps rise with the ids, grow
+busier towards `--end`, and follow a daily cycle.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
-from faker import Faker
-from helpers import get_random_datetime
+import os
+import random
+import shutil
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+
+from helpers import (
+    CITIES, FIRST_NAMES, LAST_NAMES, activity_time, midnight_today,
+    power_law, scatter, sentence,
+)
 
 MAX_WARBLER_LENGTH = 140
 
-USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
-MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
+USERS_CSV_HEADERS = ['id', 'email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
+MESSAGES_CSV_HEADERS = ['id', 'text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
 
 NUM_USERS = 300
 NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
+NUM_FOLLOWS = 5000
+
+# rows per shard, the unit of work for one process
+SHARD_ROWS = 100_000
 
-fake = Faker()
+# how steeply popularity falls off with rank; 1 gives celebrities
+FOLLOWED_EXPONENT = 1.0
+AUTHOR_EXPONENT = 0.7
 
-# Generate random profile image URLs to use for users
+# bcrypt of "password"
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
 
-image_urls = [
+IMAGE_URLS = [
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
     for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
-
-header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
+HEADER_IMAGE_URLS = [
+    f"https://picsum.photos/seed/warbler{i}/1200/400" for i in range(1, 46)
 ]
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+
+def shard_rng(options, table, shard):
+    """The random source for one shard, independent of the others."""
+
+    return random.Random(f"{options.seed}:{table}:{shard}")
+
+
+def shards(total):
+    """(shard number, first id, last id + 1) covering ids 1 to `total`."""
+
+    return [(shard, lo, min(lo + SHARD_ROWS, total + 1))
+            for shard, lo in enumerate(range(1, total + 1, SHARD_ROWS))]
+
+
+##############################################################################
+# Shards of each file
+
+
+def users_shard(options, shard, lo, hi, writer):
+    rng = shard_rng(options, 'users', shard)
+
+    for user_id in range(lo, hi):
+        # the id keeps usernames and emails unique at any size
+        username = (f"{rng.choice(FIRST_NAMES)}{rng.choice(LAST_NAMES)}"
+                    f"{user_id}")
+        writer.writerow([
+            user_id,
+            f"{username}@example.com",
+            username,
+            rng.choice(IMAGE_URLS),
+            PASSWORD,
+            sentence(rng, 4, 14),
+            rng.choice(HEADER_IMAGE_URLS),
+            rng.choice(CITIES),
+        ])
+
+
+def messages_shard(options, shard, lo, hi, writer):
+    rng = shard_rng(options, 'messages', shard)
+    author = scatter(options.users, salt=1)
+    end = options.end
+    start = end - timedelta(days=365 * options.years)
+
+    # sorted within the shard, and shards cover increasing ranges, so
+    # timestamps rise with the ids
+    positions = sorted(rng.uniform(lo - 1, hi - 1) / options.messages
+                       for _ in range(lo, hi))
+
+    for message_id, position in zip(range(lo, hi), positions):
+        writer.writerow([
+            message_id,
+            sentence(rng, 3, 24)[:MAX_WARBLER_LENGTH],
+            activity_time(start, end, position),
+            author(power_law(rng, options.users, AUTHOR_EXPONENT)),
+        ])
+
+
+def follows_shard(options, shard, lo, hi, writer):
+    """Follows by the users `lo` to `hi` - 1, their share of the total."""
+
+    rng = shard_rng(options, 'follows', shard)
+    users = options.users
+    followed = scatter(users, salt=0)
+    quota = (options.follows * (hi - 1) // users
+             - options.follows * (lo - 1) // users)
+
+    counts = [0] * (hi - lo)
+    for _ in range(quota):
+        counts[rng.randrange(hi - lo)] += 1
+
+    for follower, count in zip(range(lo, hi), counts):
+        chosen = set()
+        # nobody can follow more than everyone else
+        while len(chosen) < min(count, users - 1):
+            user_id = followed(power_law(rng, users, FOLLOWED_EXPONENT))
+            if user_id != follower:
+                chosen.add(user_id)
+
+        writer.writerows([user_id, follower] for user_id in sorted(chosen))
+
+
+##############################################################################
+# Files
+
+
+def write_shard(task):
+    """Write one shard to its own part file; returns the part's path."""
+
+    options, table, fn, shard, lo, hi = task
+    path = os.path.join(options.out, f".{table}.{shard:06}.part")
+
+    with open(path, 'w', newline='') as part:
+        fn(options, shard, lo, hi, csv.writer(part, lineterminator='\n'))
+
+    return path
+
+
+def write_file(pool, options, table, headers, fn, total):
+    """Write `table`.csv from shards made in `pool`, joining them in order."""
+
+    path = os.path.join(options.out, f"{table}.csv")
+    tasks = [(options, table, fn, shard, lo, hi)
+             for shard, lo, hi in shards(total)]
+
+    with open(path, 'w', newline='') as out:
+        csv.writer(out, lineterminator='\n').writerow(headers)
+        out.flush()
+
+        for done, part_path in enumerate(
+                pool.imap(write_shard, tasks), start=1):
+            with open(part_path, 'rb') as part:
+                shutil.copyfileobj(part, out.buffer)
+            os.remove(part_path)
+            print(f"{table}.csv: {done}/{len(tasks)} shards", flush=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    parser.add_argument('--follows', type=int, default=NUM_FOLLOWS)
+    parser.add_argument('--seed', default='warbler')
+    parser.add_argument('--end', type=datetime.fromisoformat,
+                        default=midnight_today(),
+                        help="Latest message time (default today, UTC).")
+    parser.add_argument('--years', type=float, default=2,
+                        help="How far back messages go.")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--out',
+                        default=os.path.dirname(os.path.abspath(__file__)))
+    return parser.parse_args()
+
+
+def main():
+    options = parse_args()
+    os.makedirs(options.out, exist_ok=True)
+
+    with Pool(options.workers) as pool:
+        write_file(pool, options, 'users', USERS_CSV_HEADERS,
+                   users_shard, options.users)
+        write_file(pool, options, 'messages', MESSAGES_CSV_HEADERS,
+                   messages_shard, options.messages)
+        # follows are sharded by follower
+        write_file(pool, options, 'follows', FOLLOWS_CSV_HEADERS,
+                   follows_shard, options.users)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,106 @@
 """Support functions for CSV generation."""
 
-from datetime import datetime
-from random import uniform
+from bisect import bisect
+from datetime import datetime, timedelta
+from math import exp, gcd, log, sqrt
 
+FIRST_NAMES = """
+    alex amy ben carla dan ella finn gina hugo ivy jack kate leo maya nate
+    olga paul quinn rosa sam tara uma vic wes xena yuri zoe ada bo cy dee
+    eli fay gus hal iris jon kim lou max nia otto pia ray sue ted val
+""".split()
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+LAST_NAMES = """
+    smith jones brown garcia miller davis lopez wilson moore taylor lee
+    white harris clark lewis young walker hall allen king wright scott
+    green baker adams nelson hill campbell mitchell roberts carter
+""".split()
 
-    now = datetime.now()
-    then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+CITIES = """
+    Austin Berlin Boston Cairo Chicago Denver Dublin Houston Lagos Lima
+    Lisbon London Madrid Manila Miami Mumbai Nairobi Oakland Oslo Paris
+    Portland Quito Rome Seattle Seoul Sydney Tokyo Toronto Vienna Warsaw
+""".split()
 
-    return datetime.fromtimestamp(random_timestamp)
+WORDS = """
+    a about after again all also always and any are around as at away back
+    be because been before best better big but by call can city coffee
+    come could day did do dog done down each even every feel few find first
+    for friend from fun game get give go going good got great had happy has
+    have he her here home how i if in into is it just know last let life
+    like little long look lot love make man many me more morning most much
+    music my need never new next night no not now of off old on one only or
+    other our out over people place play pretty really right run said same
+    see she should so some something still stuff such sure take tell than
+    thanks that the their them then there these they thing think this time
+    to today too try two up us use very walk want warble was watch way we
+    weekend well were what when where which while who why will with work
+    world would year yes yet you your
+""".split()
+
+# relative posting activity by hour of day, quietest before dawn
+HOURLY_ACTIVITY = [
+    3, 2, 1, 1, 1, 2, 4, 6, 7, 7, 7, 8,
+    9, 8, 7, 7, 8, 9, 10, 11, 12, 11, 8, 5,
+]
+
+_HOURLY_CDF = [sum(HOURLY_ACTIVITY[:hour + 1]) / sum(HOURLY_ACTIVITY)
+               for hour in range(24)]
+
+
+def power_law(rng, n, exponent):
+    """A rank from 1 to `n`, rank k drawn with weight k ** -exponent."""
+
+    # inverse of the continuous approximation's CDF
+    u = rng.random()
+    if exponent == 1:
+        rank = exp(u * log(n + 1))
+    else:
+        top = (n + 1) ** (1 - exponent)
+        rank = (u * (top - 1) + 1) ** (1 / (1 - exponent))
+
+    return min(int(rank), n)
+
+
+def scatter(n, salt):
+    """fn(rank) -> id, a fixed shuffle of 1..n in O(1) memory.
+
+    Spreads the heaviest ranks of `power_law` over the id range, so the
+    celebrities aren't simply the first users created.
+    """
+
+    step = 1_000_003 + 2 * salt
+    while gcd(step, n) != 1:
+        step += 2
+
+    return lambda rank: (rank - 1) * step % n + 1
+
+
+def activity_time(start, end, position):
+    """The datetime `position` (0 to 1) of the way through all activity.
+
+    Activity grows steadily, so later days are busier than earlier ones,
+    and within a day follows HOURLY_ACTIVITY. Increasing `position` gives
+    increasing times, so ids assigned in position order stay in time order.
+    """
+
+    elapsed = (end - start) * sqrt(position)
+    day = timedelta(days=elapsed.days)
+    of_day = elapsed.seconds / (24 * 60 * 60)
+
+    hour = bisect(_HOURLY_CDF, of_day)
+    previous = _HOURLY_CDF[hour - 1] if hour else 0
+    into_hour = (of_day - previous) / (_HOURLY_CDF[hour] - previous)
+
+    return start + day + timedelta(hours=hour + into_hour)
+
+
+def sentence(rng, low, high):
+    """A random sentence of `low` to `high` words."""
+
+    words = rng.choices(WORDS, k=rng.randint(low, high))
+    return ' '.join(words).capitalize() + rng.choice('.!?')
+
+
+def midnight_today():
+    return datetime.combine(datetime.utcnow().date(), datetime.min.time())
@@ -0,0 +1,449 @@
+"""The follow graph in memory, for "who to follow" suggestions.
+
+Suggestions score every account two hops away at once, which in SQL is a
+self-join of `follows` against itself per page view. Here the whole graph
+is held as NumPy arrays in CSR form (for each user, a slice of one big
+array listing who they follow, and another for who follows them), so a
+user's two-hop neighbourhood is a handful of array gathers:
+
+    friends of friends   accounts followed by the people you follow
+    common followers     accounts followed by the people who follow you
+
+Each counts once per path, common followers at COMMON_FOLLOWER_WEIGHT,
+and ties go to the more followed account. Users following nobody get the
+most followed accounts.
+
+Every process loads its own copy, in the background, on first use; until
+it's ready there are no suggestions. Follows and unfollows
+committed in that process are applied as they happen, kept in a small
+overlay that is folded into the arrays once it passes COMPACT_AFTER
+edges. Changes made by other processes, or by set-based deletes like
+account purges, show up when the graph is reloaded, in the background,
+every GRAPH_RELOAD_SECONDS.
+"""
+
+import threading
+import time
+from itertools import chain
+
+import numpy as np
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import PASSIVE_NO_INITIALIZE, get_history
+
+from models import db, Follows, User
+
+# how much a common follower counts, next to a friend of a friend
+COMMON_FOLLOWER_WEIGHT = 0.5
+
+# neighbours expanded per hop; past this a fixed sample per user is used
+MAX_EXPAND = 2000
+
+# accounts kept for users with nobody to go on
+POPULAR = 100
+
+# overlay size at which it's merged into the arrays
+COMPACT_AFTER = 10000
+
+# follows read per round trip while loading
+LOAD_BATCH = 100000
+
+
+def _keys(sources, targets):
+    """Pack (source, target) user id pairs into single int64 keys."""
+
+    return (np.asarray(sources, dtype=np.int64) << 32) | targets
+
+
+def _csr(rows, columns, size):
+    """Index pointer and column arrays for edges sorted by row."""
+
+    # one sort on a packed key is several times faster than a lexsort
+    order = np.argsort(rows * size + columns)
+    counts = np.bincount(rows, minlength=size)
+    pointers = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(counts, out=pointers[1:])
+    return pointers, columns[order].astype(np.int32)
+
+
+def _gather(pointers, columns, rows):
+    """(row, column) arrays for every edge out of `rows`, in one pass."""
+
+    starts = pointers[rows]
+    lengths = pointers[rows + 1] - starts
+    total = int(lengths.sum())
+
+    # position i of the output reads columns[starts[row] + offset in row]
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return np.repeat(rows, lengths), columns[offsets + np.arange(total)]
+
+
+class FollowGraph:
+    """A snapshot of the follow graph, plus the changes made since.
+
+    Users are numbered by their position in `ids`; `following` and
+    `followers` are CSR pairs of (pointers, columns) over those numbers.
+    Methods take and return user ids. Follower counts, used to break ties
+    and pick popular accounts, are the snapshot's until it's compacted.
+    """
+
+    def __init__(self, followers, followed):
+        followers = np.asarray(followers, dtype=np.int64)
+        followed = np.asarray(followed, dtype=np.int64)
+
+        # ids are serial, so a table indexed by id numbers them in one pass
+        # (sorting or searching every edge's ids is several times slower)
+        top = int(max(followers.max(initial=0), followed.max(initial=0)))
+        seen = np.zeros(top + 1, dtype=bool)
+        seen[followers] = seen[followed] = True
+        self.ids = np.flatnonzero(seen)
+        numbers = np.zeros(top + 1, dtype=np.int64)
+        numbers[self.ids] = np.arange(len(self.ids))
+        sources, targets = numbers[followers], numbers[followed]
+
+        self.following = _csr(sources, targets, len(self.ids))
+        self.followers = _csr(targets, sources, len(self.ids))
+        self.edges = len(followers)
+
+        in_degree = np.diff(self.followers[0])
+        by_followers = np.argsort(-in_degree, kind='stable')
+        self.popular = self.ids[by_followers[:POPULAR]]
+
+        self._added = set()
+        self._removed = set()
+        self._overlay = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls):
+        """Read the whole graph from the `follows` table."""
+
+        rows = (db.session
+                .query(Follows.user_following_id,
+                       Follows.user_being_followed_id)
+                .yield_per(LOAD_BATCH))
+        pairs = np.fromiter(chain.from_iterable(rows), dtype=np.int64)
+        return cls(pairs[0::2], pairs[1::2])
+
+    def __len__(self):
+        return self.edges + len(self._added) - len(self._removed)
+
+    ##########################################################################
+    # Changes
+
+    def _rows(self, user_ids):
+        """Row numbers of those of `user_ids` in the snapshot."""
+
+        if not len(self.ids):
+            return np.zeros(0, dtype=np.int64)
+        rows = np.searchsorted(self.ids, user_ids).clip(0, len(self.ids) - 1)
+        return rows[self.ids[rows] == user_ids]
+
+    def _index(self, user_id):
+        rows = self._rows([user_id])
+        return rows[0] if len(rows) else None
+
+    def _in_snapshot(self, follower_id, followed_id):
+        source = self._index(follower_id)
+        target = self._index(followed_id)
+        if source is None or target is None:
+            return False
+
+        pointers, columns = self.following
+        row = columns[pointers[source]:pointers[source + 1]]
+        i = np.searchsorted(row, target)
+        return i < len(row) and row[i] == target
+
+    def follow(self, follower_id, followed_id):
+        """Record a new follow; repeats are ignored."""
+
+        key = (follower_id, followed_id)
+        with self._lock:
+            self._removed.discard(key)
+            if not self._in_snapshot(*key):
+                self._added.add(key)
+            self._overlay = None
+
+    def unfollow(self, follower_id, followed_id):
+        """Record a follow ending; repeats are ignored."""
+
+        key = (follower_id, followed_id)
+        with self._lock:
+            self._added.discard(key)
+            if self._in_snapshot(*key):
+                self._removed.add(key)
+            self._overlay = None
+
+    def overgrown(self):
+        """Whether the overlay should be merged into the arrays."""
+
+        return len(self._added) + len(self._removed) > COMPACT_AFTER
+
+    def compacted(self):
+        """A new graph with the overlay merged into its arrays."""
+
+        followers, followed = self._edges(self.following, self.ids)
+        added, removed = self._overlay_arrays()
+        keep = ~np.isin(_keys(followers, followed), removed[2])
+        return FollowGraph(np.concatenate([followers[keep], added[0]]),
+                           np.concatenate([followed[keep], added[1]]))
+
+    @staticmethod
+    def _edges(csr, ids):
+        pointers, columns = csr
+        rows = np.repeat(np.arange(len(ids)), np.diff(pointers))
+        return ids[rows], ids[columns]
+
+    def _overlay_arrays(self):
+        """((sources, targets, keys) added, (same) removed), cached."""
+
+        with self._lock:
+            if self._overlay is None:
+                arrays = []
+                for edges in (self._added, self._removed):
+                    pairs = np.array(sorted(edges), dtype=np.int64)
+                    pairs = pairs.reshape(-1, 2)
+                    arrays.append((pairs[:, 0], pairs[:, 1],
+                                   _keys(pairs[:, 0], pairs[:, 1])))
+                self._overlay = tuple(arrays)
+            return self._overlay
+
+    ##########################################################################
+    # Queries
+
+    def _hop(self, csr, user_ids, outgoing):
+        """(from, to) user id arrays for the edges leaving `user_ids`."""
+
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        sources, targets = _gather(*csr, self._rows(user_ids))
+        sources, targets = self.ids[sources], self.ids[targets]
+
+        added, removed = self._overlay_arrays()
+        if not outgoing:
+            # the overlay is keyed follower-first
+            added = (added[1], added[0])
+            keys = _keys(targets, sources)
+        else:
+            keys = _keys(sources, targets)
+
+        keep = ~np.isin(keys, removed[2])
+        mine = np.isin(added[0], user_ids)
+        return (np.concatenate([sources[keep], added[0][mine]]),
+                np.concatenate([targets[keep], added[1][mine]]))
+
+    def following_of(self, user_id):
+        """Ids of the users `user_id` follows."""
+
+        return np.unique(self._hop(self.following, [user_id], True)[1])
+
+    def followers_of(self, user_id):
+        """Ids of the users following `user_id`."""
+
+        return np.unique(self._hop(self.followers, [user_id], False)[1])
+
+    def follower_counts(self, user_ids):
+        """How many followers each of `user_ids` has in the snapshot."""
+
+        counts = np.zeros(len(user_ids), dtype=np.int64)
+        if len(self.ids):
+            rows = np.searchsorted(self.ids, user_ids)
+            rows = rows.clip(0, len(self.ids) - 1)
+            present = self.ids[rows] == user_ids
+            counts[present] = np.diff(self.followers[0])[rows[present]]
+        return counts
+
+    def suggest(self, user_id, limit=10):
+        """Up to `limit` user ids for `user_id` to follow, best first."""
+
+        following = self.following_of(user_id)
+        followers = self.followers_of(user_id)
+        rng = np.random.default_rng(user_id)
+
+        def sample(user_ids):
+            if len(user_ids) <= MAX_EXPAND:
+                return user_ids
+            return rng.choice(user_ids, MAX_EXPAND, replace=False)
+
+        friends_of_friends = self._hop(self.following, sample(following),
+                                       True)[1]
+        followed_with_me = self._hop(self.following, sample(followers),
+                                     True)[1]
+
+        candidates = np.concatenate([friends_of_friends, followed_with_me])
+        weights = np.concatenate([
+            np.ones(len(friends_of_friends)),
+            np.full(len(followed_with_me), COMMON_FOLLOWER_WEIGHT)])
+
+        if not len(candidates):
+            candidates = self.popular
+            weights = np.ones(len(candidates))
+
+        excluded = np.append(following, user_id)
+        keep = ~np.isin(candidates, excluded)
+        ids, paths = np.unique(candidates[keep], return_inverse=True)
+        scores = np.bincount(paths, weights=weights[keep], minlength=len(ids))
+
+        best = np.lexsort((ids, -self.follower_counts(ids), -scores))
+        return [int(user_id) for user_id in ids[best[:limit]]]
+
+
+##############################################################################
+# Keeping each process's copy current
+
+
+class Graph:
+    """Holds the app's FollowGraph, loading and refreshing it as needed.
+
+    Loads happen on a background thread, so no request waits for one;
+    until the first finishes there are simply no suggestions.
+
+    Reads its settings from the app config in `init_app`:
+
+    - GRAPH_RELOAD_SECONDS: age at which the graph is reloaded, to pick
+      up other processes' changes (default 3600)
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._graph = None
+        self._loaded_at = None
+        # changes committed while a load runs, to replay onto its result
+        self._pending = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['graph'] = self
+        app.config.setdefault('GRAPH_RELOAD_SECONDS', 3600)
+        self.app = app
+
+    def get(self):
+        """The current graph, or None before the first load is done.
+
+        Starts a load if there's no graph yet or it's too old.
+        """
+
+        with self._lock:
+            stale = (self._loaded_at is None
+                     or time.monotonic() - self._loaded_at
+                     > self.app.config['GRAPH_RELOAD_SECONDS'])
+            if stale and self._pending is None:
+                self._pending = []
+                threading.Thread(target=self._load_in_background,
+                                 daemon=True, name="graph-load").start()
+
+            return self._graph
+
+    def suggest(self, user_id, limit=10):
+        """See FollowGraph.suggest; empty until the graph is loaded."""
+
+        graph = self.get()
+        return graph.suggest(user_id, limit) if graph else []
+
+    def load(self):
+        """Load the graph from the database now, on this thread."""
+
+        with self._lock:
+            if self._pending is None:
+                self._pending = []
+
+        try:
+            graph = FollowGraph.load()
+        except Exception:
+            with self._lock:
+                self._pending = None
+                # wait out a reload period before trying again
+                self._loaded_at = time.monotonic()
+            raise
+
+        # replay what was committed while it loaded; repeats are harmless
+        with self._lock:
+            for change in self._pending:
+                _apply(graph, change)
+            self._graph = graph
+            self._loaded_at = time.monotonic()
+            self._pending = None
+
+    def _load_in_background(self):
+        try:
+            with self.app.app_context():
+                self.load()
+        except Exception:
+            self.app.logger.exception("Couldn't load the follow graph.")
+
+    def apply(self, changes):
+        """Apply committed (follower_id, followed_id, following?) changes."""
+
+        with self._lock:
+            graph = self._graph
+            if self._pending is not None:
+                self._pending.extend(changes)
+
+        if graph is None:
+            return
+
+        for change in changes:
+            _apply(graph, change)
+
+        if graph.overgrown():
+            compacted = graph.compacted()
+            with self._lock:
+                if self._graph is graph:
+                    self._graph = compacted
+
+
+def _apply(graph, change):
+    follower_id, followed_id, following = change
+    if following:
+        graph.follow(follower_id, followed_id)
+    else:
+        graph.unfollow(follower_id, followed_id)
+
+
+def _follow_changes(session):
+    return session.info.setdefault('follow_changes', [])
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_follow_changes(session, flush_context):
+    changes = _follow_changes(session)
+
+    for obj in session.new:
+        if isinstance(obj, Follows):
+            changes.append((obj.user_following_id,
+                            obj.user_being_followed_id, True))
+    for obj in session.deleted:
+        if isinstance(obj, Follows):
+            changes.append((obj.user_following_id,
+                            obj.user_being_followed_id, False))
+
+    # follows made through User.following / .followers (see _apply_stats)
+    for obj in session.new | session.dirty:
+        if not isinstance(obj, User):
+            continue
+
+        for attr, outgoing in (('following', True), ('followers', False)):
+            history = get_history(obj, attr, passive=PASSIVE_NO_INITIALIZE)
+            for following, items in ((True, history.added or ()),
+                                     (False, history.deleted or ())):
+                for other in items:
+                    if outgoing:
+                        changes.append((obj.id, other.id, following))
+                    else:
+                        changes.append((other.id, obj.id, following))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_follow_changes(session):
+    changes = session.info.pop('follow_changes', None)
+    if changes and has_app_context():
+        graph = current_app.extensions.get('graph')
+        if graph:
+            graph.apply(changes)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_follow_changes(session, previous_transaction):
+    session.info.pop('follow_changes', None)
@@ -0,0 +1,116 @@
+"""Password hashing on a bounded pool of threads.
+
+bcrypt is deliberately slow, and it releases the GIL while it works. Rather
+than let every request thread run it at once, hashes go through a small
+pool sized to the CPUs, with a cap on how many may wait for it. When the
+cap is hit, callers get HashingBusy right away instead of piling up behind
+a login burst and starving every other request.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+
+import bcrypt
+
+
+class HashingBusy(Exception):
+    """Too many passwords are already waiting to be hashed."""
+
+
+class PasswordHasher:
+    """bcrypt hashing and checking through a bounded thread pool.
+
+    Reads its settings from the app config in `init_app`:
+
+    - BCRYPT_LOG_ROUNDS: work factor for new hashes (default 12)
+    - PASSWORD_HASH_WORKERS: threads hashing at once (default: CPU count);
+      0 hashes inline on the calling thread
+    - PASSWORD_HASH_QUEUE: hashes allowed to be running or waiting before
+      HashingBusy is raised (default: 4 per worker)
+    """
+
+    def __init__(self, app=None):
+        self.rounds = 12
+        self.workers = os.cpu_count() or 1
+        self.max_pending = 4 * self.workers
+        self._executor = None
+        self._executor_pid = None
+        self._slots = BoundedSemaphore(self.max_pending)
+        self._lock = Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.rounds = app.config.setdefault('BCRYPT_LOG_ROUNDS', self.rounds)
+        self.workers = app.config.setdefault(
+            'PASSWORD_HASH_WORKERS', self.workers)
+        self.max_pending = app.config.setdefault(
+            'PASSWORD_HASH_QUEUE', 4 * max(self.workers, 1))
+        self._slots = BoundedSemaphore(self.max_pending)
+        self.shutdown()
+
+    def shutdown(self):
+        """Stop the pool's threads; it restarts on next use."""
+
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _pool(self):
+        # threads don't survive a fork, so each worker process starts its own
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers,
+                    thread_name_prefix='password-hash')
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+
+        try:
+            future = self._pool().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def generate_password_hash(self, password):
+        """Hash `password` at the configured work factor; returns a str."""
+
+        if not password:
+            raise ValueError("Password must be non-empty.")
+
+        salt = bcrypt.gensalt(rounds=self.rounds)
+        pw_hash = self._run(bcrypt.hashpw, password.encode('UTF-8'), salt)
+        return pw_hash.decode('UTF-8')
+
+    def check_password_hash(self, pw_hash, password):
+        """Does `password` match `pw_hash`? False for malformed hashes."""
+
+        if not password:
+            return False
+
+        try:
+            return self._run(bcrypt.checkpw, password.encode('UTF-8'),
+                             pw_hash.encode('UTF-8'))
+        except ValueError:
+            return False
+
+    def needs_rehash(self, pw_hash):
+        """Was `pw_hash` made at a different work factor than configured?"""
+
+        try:
+            return int(pw_hash.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return False
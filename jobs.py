@@ -0,0 +1,278 @@
+"""Background jobs for work a request can leave until after its response.
+
+A task is a function registered with `@task`; calling `.delay(**args)` on
+it adds a row to the `jobs` table in the current transaction, so the job
+exists exactly when the write that asked for it commits:
+
+    @task
+    def fan_out(message_id):
+        ...
+
+    fan_out.delay(message_id=msg.id)
+    db.session.commit()
+
+Each web process runs JOBS_WORKERS threads that take ready jobs off the
+table, run them in their own transaction and delete them in it. Setting
+JOBS_WORKERS to 0 leaves jobs to dedicated worker processes:
+
+    flask jobs work --threads 4
+    flask jobs status
+
+A worker claims a job by pushing its `run_at` out by JOBS_LEASE_SECONDS,
+so a job whose worker died is picked up again once the lease runs out.
+Tasks must therefore be safe to run twice. A job that raises is retried
+after JOBS_RETRY_SECONDS, doubling each time, and after JOBS_MAX_ATTEMPTS
+it is kept with its error and `failed_at` set rather than retried.
+
+With JOBS_EAGER set (the test profile) `.delay` runs the task right away,
+in the caller's transaction, as if it had never been deferred.
+"""
+
+import json
+import logging
+import os
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db
+
+log = logging.getLogger(__name__)
+
+# name: function, for every @task
+TASKS = {}
+
+# ready jobs a worker looks at per claim attempt
+CLAIM_BATCH = 10
+
+
+class Job(db.Model):
+    """A task waiting to run (or, with `failed_at` set, given up on)."""
+
+    __tablename__ = 'jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.Text, nullable=False)
+    args = db.Column(db.Text, nullable=False, default='{}')
+
+    # when it may next run; also its lease while a worker has it
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    failed_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_jobs_failed_at_run_at', 'failed_at', 'run_at'),
+    )
+
+    def __repr__(self):
+        return f"<Job #{self.id}: {self.name} {self.args}>"
+
+    @classmethod
+    def ready(cls, now=None):
+        """Query for jobs due to run, oldest first."""
+
+        return (cls.query
+                .filter(cls.failed_at.is_(None),
+                        cls.run_at <= (now or datetime.utcnow()))
+                .order_by(cls.run_at, cls.id))
+
+
+def task(fn):
+    """Register `fn` as a task and give it a `delay` method."""
+
+    name = f"{fn.__module__}.{fn.__name__}"
+
+    def delay(**args):
+        if current_app.config['JOBS_EAGER']:
+            return fn(**args)
+
+        db.session.add(Job(name=name, args=json.dumps(args)))
+        db.session.info['jobs_added'] = True
+
+    fn.delay = delay
+    TASKS[name] = fn
+    return fn
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_workers(session):
+    if session.info.pop('jobs_added', False) and has_app_context():
+        queue = current_app.extensions.get('jobs')
+        if queue:
+            queue.wake()
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_jobs(session, previous_transaction):
+    session.info.pop('jobs_added', None)
+
+
+class JobQueue:
+    """Runs jobs on worker threads in the app's process.
+
+    Reads its settings from the app config in `init_app`:
+
+    - JOBS_WORKERS: threads per process (default 2); 0 runs none
+    - JOBS_EAGER: run tasks inline when they're delayed (default False)
+    - JOBS_POLL_SECONDS: how often idle workers look for jobs (default 1)
+    - JOBS_LEASE_SECONDS: how long a claimed job is kept from other
+      workers (default 300)
+    - JOBS_RETRY_SECONDS: wait before the first retry (default 10)
+    - JOBS_MAX_ATTEMPTS: runs before a job is given up on (default 5)
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._threads = []
+        self._threads_pid = None
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['jobs'] = self
+        app.config.setdefault('JOBS_WORKERS', 2)
+        app.config.setdefault('JOBS_EAGER', False)
+        app.config.setdefault('JOBS_POLL_SECONDS', 1)
+        app.config.setdefault('JOBS_LEASE_SECONDS', 300)
+        app.config.setdefault('JOBS_RETRY_SECONDS', 10)
+        app.config.setdefault('JOBS_MAX_ATTEMPTS', 5)
+        self.app = app
+
+        # started by the first request, so servers that fork their
+        # workers after loading the app get threads in every worker
+        app.before_request(self.start)
+
+    def start(self, threads=None):
+        """Start the worker threads in this process, if not running."""
+
+        threads = (self.app.config['JOBS_WORKERS']
+                   if threads is None else threads)
+        if self.app.config['JOBS_EAGER'] or not threads:
+            return
+
+        with self._lock:
+            if self._threads_pid == os.getpid():
+                return
+
+            self._stopping.clear()
+            self._threads = [
+                threading.Thread(target=self._work, daemon=True,
+                                 name=f"jobs-{n}")
+                for n in range(threads)
+            ]
+            self._threads_pid = os.getpid()
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self):
+        """Stop this process's worker threads once their jobs finish."""
+
+        with self._lock:
+            self._stopping.set()
+            self._wakeup.set()
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+            self._threads_pid = None
+
+    def wake(self):
+        """Have an idle worker look for jobs now."""
+
+        self._wakeup.set()
+
+    def _work(self):
+        poll = self.app.config['JOBS_POLL_SECONDS']
+
+        while not self._stopping.is_set():
+            try:
+                with self.app.app_context():
+                    ran = self.run_next()
+            except Exception:
+                log.exception("Job worker failed to reach the database.")
+                ran = False
+
+            if not ran and not self._stopping.is_set():
+                self._wakeup.wait(poll)
+                self._wakeup.clear()
+
+    def claim(self):
+        """Take the next ready job for this worker; None if there is none."""
+
+        now = datetime.utcnow()
+        lease = timedelta(seconds=self.app.config['JOBS_LEASE_SECONDS'])
+        jobs = Job.__table__
+
+        candidates = Job.ready(now).limit(CLAIM_BATCH)
+        if db.engine.dialect.name == 'postgresql':
+            candidates = candidates.with_for_update(skip_locked=True)
+        candidates = candidates.with_entities(Job.id, Job.run_at).all()
+
+        for job_id, run_at in candidates:
+            # only one worker's update finds run_at unchanged
+            claimed = db.session.execute(
+                jobs.update()
+                .where(jobs.c.id == job_id)
+                .where(jobs.c.run_at == run_at)
+                .values(run_at=now + lease, attempts=jobs.c.attempts + 1)
+            ).rowcount
+            if claimed:
+                db.session.commit()
+                return Job.query.get(job_id)
+
+        db.session.commit()
+        return None
+
+    def run_next(self):
+        """Claim and run one job; returns whether there was one."""
+
+        job = self.claim()
+        if job is None:
+            return False
+
+        job_id, name, attempts = job.id, job.name, job.attempts
+
+        try:
+            TASKS[name](**json.loads(job.args))
+            Job.query.filter_by(id=job_id).delete()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            self._retry(job_id, name, attempts, traceback.format_exc())
+
+        return True
+
+    def run_pending(self):
+        """Run jobs until none are ready; returns how many ran."""
+
+        ran = 0
+        while self.run_next():
+            ran += 1
+        return ran
+
+    def _retry(self, job_id, name, attempts, error):
+        config = self.app.config
+        job = Job.query.get(job_id)
+
+        job.last_error = error
+        if attempts >= config['JOBS_MAX_ATTEMPTS']:
+            job.failed_at = datetime.utcnow()
+            log.error("Job %s (%s) failed %s times; giving up:\n%s",
+                      job_id, name, attempts, error)
+        else:
+            delay = config['JOBS_RETRY_SECONDS'] * 2 ** (attempts - 1)
+            job.run_at = datetime.utcnow() + timedelta(seconds=delay)
+            log.warning("Job %s (%s) failed; retrying in %ss:\n%s",
+                        job_id, name, delay, error)
+
+        db.session.commit()
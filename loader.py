@@ -0,0 +1,407 @@
+"""Bulk loading of CSV datasets into the Warbler database.
+
+    flask load-data generator --reset
+    flask load-data /data/staging --workers 16 --resume
+
+Loads users.csv, messages.csv, follows.csv and likes.csv (whichever the
+directory has), in that order, with the column names in each file's header.
+Each file is split into chunks of whole records, which worker threads load
+over their own connections: on Postgres with `COPY ... FROM STDIN`, the
+bytes passed through as they are, and elsewhere (SQLite, for local runs)
+with batched INSERTs on a single worker.
+
+Users and messages files without an `id` column are numbered from 1 in
+file order, which is how the files after them refer to their rows.
+
+Secondary indexes (and SQLite's search triggers) are dropped before the
+load and rebuilt once the data is in. Timelines and the stat counters are
+rebuilt from the loaded rows, sequences moved past the loaded ids, and the
+tables analyzed.
+
+Every chunk is recorded in `load_chunks` in the same transaction as its
+rows, and dropped indexes in `load_deferred`, so an interrupted load can
+be finished with `resume` (and the same chunk size); both tables are
+removed once a load completes.
+"""
+
+import csv
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from models import db, Timeline, User
+
+# (table, file) in load order; files the directory doesn't have are skipped
+SOURCES = [
+    ('users', 'users.csv'),
+    ('messages', 'messages.csv'),
+    ('follows', 'follows.csv'),
+    ('likes', 'likes.csv'),
+]
+
+# later files refer to these tables' rows by their position in the file
+NUMBERED = {'users', 'messages'}
+
+# secondary indexes (and triggers) on these are built after the load
+DEFERRED_TABLES = ['users', 'messages', 'follows', 'likes', 'timelines']
+
+CHUNK_SIZE = 16 * 1024 * 1024
+
+# read size when looking for chunk boundaries
+BLOCK_SIZE = 1024 * 1024
+
+# per index build on Postgres; the default makes large sorts spill to disk
+INDEX_WORK_MEM = '512MB'
+
+progress = db.MetaData()
+
+load_chunks = db.Table(
+    'load_chunks', progress,
+    db.Column('source', db.Text, primary_key=True),
+    db.Column('start', db.BigInteger, primary_key=True),
+    db.Column('stop', db.BigInteger, nullable=False),
+    db.Column('row_count', db.BigInteger, nullable=False),
+)
+
+load_deferred = db.Table(
+    'load_deferred', progress,
+    db.Column('name', db.Text, primary_key=True),
+    db.Column('definition', db.Text, nullable=False),
+)
+
+
+class LoadError(Exception):
+    """A load can't start or resume as asked."""
+
+
+def load(directory, workers=None, chunk_size=CHUNK_SIZE, reset=False,
+         resume=False, timelines=True, report=print):
+    """Load the CSV files in `directory`; returns {table: rows loaded}.
+
+    `reset` drops and recreates every table first. An unfinished earlier
+    load must be either resumed or reset. `report` is called with each
+    line of progress.
+    """
+
+    engine = db.engine
+    postgres = engine.dialect.name == 'postgresql'
+    workers = (workers or os.cpu_count() or 1) if postgres else 1
+
+    if reset:
+        db.drop_all()
+        progress.drop_all(bind=engine)
+        db.create_all()
+    else:
+        with engine.connect() as connection:
+            unfinished = engine.dialect.has_table(connection,
+                                                  load_chunks.name)
+        if unfinished and not resume:
+            raise LoadError("An earlier load didn't finish; resume it, "
+                            "or reset to start over.")
+        if resume and not unfinished:
+            raise LoadError("There's no interrupted load to resume.")
+
+    progress.create_all(bind=engine)
+    _defer_indexes(engine)
+
+    loaded = {}
+
+    for table, filename in SOURCES:
+        path = os.path.join(directory, filename)
+        if os.path.exists(path):
+            loaded[table] = _load_file(engine, table, path, workers,
+                                       chunk_size, report)
+
+    if timelines:
+        report("Building timelines...")
+        Timeline.rebuild()
+        db.session.commit()
+
+    report("Building indexes...")
+    _restore_indexes(engine, workers)
+
+    report("Counting stats...")
+    User.recount_stats()
+    db.session.commit()
+
+    with engine.begin() as connection:
+        if postgres:
+            _reset_sequences(connection)
+        connection.execute("ANALYZE")
+
+    progress.drop_all(bind=engine)
+    report("Done.")
+
+    return loaded
+
+
+##############################################################################
+# Chunks
+
+
+def _read_header(path):
+    """(column names, offset of the first record) for a CSV file."""
+
+    with open(path, 'rb') as source:
+        header = source.readline()
+        return next(csv.reader([header.decode('UTF-8')])), source.tell()
+
+
+def _split(path, start, size):
+    """Yield (start, stop) byte ranges of about `size`, each whole records.
+
+    A newline only ends a record outside quotes, so quotes are counted
+    along the way; the bytes in between are only counted, not parsed.
+    """
+
+    with open(path, 'rb') as source:
+        source.seek(start)
+        base = chunk_start = start
+        next_at = start + size
+        quoted = 0
+
+        while True:
+            block = source.read(BLOCK_SIZE)
+            if not block:
+                break
+
+            offset = 0
+            while True:
+                target = max(offset, next_at - base)
+                newline = (block.find(b'\n', target)
+                           if target < len(block) else -1)
+                if newline < 0:
+                    quoted ^= block.count(b'"', offset) & 1
+                    break
+
+                quoted ^= block.count(b'"', offset, newline) & 1
+                offset = newline + 1
+
+                if quoted:
+                    next_at = base + offset
+                else:
+                    yield chunk_start, base + offset
+                    chunk_start = base + offset
+                    next_at = chunk_start + size
+
+            base += len(block)
+
+        if base > chunk_start:
+            yield chunk_start, base
+
+
+def _read(path, start, stop):
+    with open(path, 'rb') as source:
+        source.seek(start)
+        return source.read(stop - start)
+
+
+def _parse(data):
+    return list(csv.reader(io.StringIO(data.decode('UTF-8'), newline='')))
+
+
+def _count_records(data):
+    if b'"' in data:
+        return len(_parse(data))
+
+    return data.count(b'\n') + (not data.endswith(b'\n'))
+
+
+##############################################################################
+# Loading
+
+
+def _load_file(engine, table, path, workers, chunk_size, report):
+    source = os.path.basename(path)
+    columns, body_start = _read_header(path)
+    numbered = table in NUMBERED and 'id' not in columns
+
+    with engine.connect() as connection:
+        done = {row.start: row for row in connection.execute(
+            load_chunks.select().where(load_chunks.c.source == source))}
+
+    ranges = list(_split(path, body_start, chunk_size))
+
+    if set(done) - {start for start, stop in ranges}:
+        raise LoadError(f"{source} was partly loaded with a different "
+                        f"chunk size; resume with that one, or reset.")
+
+    # numbering needs every chunk's record count up front
+    tasks = []
+    next_id = 1
+
+    for start, stop in ranges:
+        if start in done:
+            next_id += done[start].row_count
+            continue
+
+        first_id = None
+        if numbered:
+            first_id = next_id
+            next_id += _count_records(_read(path, start, stop))
+
+        tasks.append((engine, table, source, columns, path,
+                      start, stop, first_id))
+
+    total = sum(stop - start for start, stop in ranges)
+    loaded_bytes = sum(row.stop - row.start for row in done.values())
+    rows = 0
+    started = time.monotonic()
+
+    def progressed(task, count):
+        nonlocal loaded_bytes, rows
+        loaded_bytes += task[6] - task[5]
+        rows += count
+        rate = rows / max(time.monotonic() - started, 1e-6)
+        report(f"{source}: {loaded_bytes / max(total, 1):>4.0%}  "
+               f"{rows:,} rows  {rate:,.0f} rows/s")
+
+    if workers == 1:
+        for task in tasks:
+            progressed(task, _load_chunk(*task))
+    else:
+        with ThreadPoolExecutor(workers) as pool:
+            futures = {pool.submit(_load_chunk, *task): task
+                       for task in tasks}
+            for future in as_completed(futures):
+                progressed(futures[future], future.result())
+
+    return rows
+
+
+def _load_chunk(engine, table, source, columns, path, start, stop, first_id):
+    """Load one chunk and record it, in one transaction; returns its rows."""
+
+    data = _read(path, start, stop)
+    quote = engine.dialect.identifier_preparer.quote
+
+    if first_id is not None:
+        columns = ['id', *columns]
+
+    column_list = ', '.join(quote(column) for column in columns)
+
+    with engine.connect() as connection, connection.begin():
+        cursor = connection.connection.cursor()
+
+        if engine.dialect.name == 'postgresql':
+            if first_id is not None:
+                data = _numbered(data, first_id)
+            # a crash loses at most the last few chunks, which resume reloads
+            cursor.execute("SET LOCAL synchronous_commit = off")
+            cursor.copy_expert(
+                f"COPY {quote(table)} ({column_list}) FROM STDIN "
+                f"WITH (FORMAT csv)", io.BytesIO(data))
+            count = cursor.rowcount
+        else:
+            rows = [[value if value != '' else None for value in row]
+                    for row in _parse(data)]
+            if first_id is not None:
+                rows = [[first_id + i, *row] for i, row in enumerate(rows)]
+            placeholders = ', '.join('?' for column in columns)
+            cursor.executemany(
+                f"INSERT INTO {quote(table)} ({column_list}) "
+                f"VALUES ({placeholders})", rows)
+            count = len(rows)
+
+        connection.execute(load_chunks.insert(), source=source, start=start,
+                           stop=stop, row_count=count)
+
+    return count
+
+
+def _numbered(data, first_id):
+    """`data` as CSV with ids from `first_id` before each record."""
+
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator='\n')
+
+    for i, row in enumerate(_parse(data)):
+        writer.writerow([first_id + i, *row])
+
+    return out.getvalue().encode('UTF-8')
+
+
+##############################################################################
+# Indexes and sequences
+
+
+_DEFERRABLE = {
+    # indexes that don't back a constraint
+    'postgresql': """
+        SELECT i.indexname, i.indexdef FROM pg_indexes i
+        WHERE i.schemaname = current_schema()
+          AND i.tablename IN :tables
+          AND NOT EXISTS (
+              SELECT 1 FROM pg_constraint c
+              WHERE c.conindid = to_regclass(
+                  quote_ident(i.schemaname) || '.'
+                  || quote_ident(i.indexname)))
+    """,
+    # sql is null for the indexes behind constraints
+    'sqlite': """
+        SELECT name, sql FROM sqlite_master
+        WHERE type IN ('index', 'trigger')
+          AND tbl_name IN :tables
+          AND sql IS NOT NULL
+    """,
+}
+
+
+def _defer_indexes(engine):
+    """Drop the indexes and triggers to rebuild after the load."""
+
+    query = (db.text(_DEFERRABLE[engine.dialect.name])
+             .bindparams(db.bindparam('tables', expanding=True)))
+    quote = engine.dialect.identifier_preparer.quote
+
+    with engine.begin() as connection:
+        for name, definition in connection.execute(
+                query, tables=DEFERRED_TABLES).fetchall():
+            trigger = definition.upper().startswith('CREATE TRIGGER')
+            kind = 'TRIGGER' if trigger else 'INDEX'
+            connection.execute(load_deferred.insert(), name=name,
+                               definition=definition)
+            connection.execute(f"DROP {kind} {quote(name)}")
+
+
+def _restore_indexes(engine, workers):
+    """Rebuild what `_defer_indexes` dropped, several at a time."""
+
+    with engine.connect() as connection:
+        deferred = connection.execute(load_deferred.select()).fetchall()
+
+    def restore(row):
+        with engine.begin() as connection:
+            if engine.dialect.name == 'postgresql':
+                connection.execute(
+                    f"SET LOCAL maintenance_work_mem = '{INDEX_WORK_MEM}'")
+            connection.execute(db.text(row.definition))
+            connection.execute(load_deferred.delete()
+                               .where(load_deferred.c.name == row.name))
+
+    if workers == 1:
+        for row in deferred:
+            restore(row)
+    else:
+        with ThreadPoolExecutor(workers) as pool:
+            for future in [pool.submit(restore, row) for row in deferred]:
+                future.result()
+
+    if engine.dialect.name == 'sqlite':
+        with engine.begin() as connection:
+            # the search tables were skipped along with their triggers
+            for (name,) in connection.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table' "
+                    "AND sql LIKE 'CREATE VIRTUAL TABLE%fts5%'").fetchall():
+                connection.execute(
+                    f"INSERT INTO {name} ({name}) VALUES ('rebuild')")
+
+
+def _reset_sequences(connection):
+    # ids came from the files, so the sequences never moved
+    for table, filename in SOURCES:
+        if 'id' in db.metadata.tables[table].c:
+            connection.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f"coalesce(max(id), 0) + 1, false) FROM {table}")
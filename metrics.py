@@ -0,0 +1,294 @@
+"""Always-on request metrics for Warbler.
+
+For each request this counts the SQL statements run and the time spent in
+the database and in rendering templates, next to the total time and the
+response size. Each response carries the numbers in a `Server-Timing`
+header, which browser dev tools show under the request's timing:
+
+    Server-Timing: db;dur=3.1;desc="4 queries", render;dur=5.2, app;dur=9.8
+
+They also go into histograms per endpoint, which `/metrics` serves in
+the Prometheus text format. Every process keeps its own, so with several
+workers each one must be scraped (the counts are since it started).
+With METRICS_TOKEN set, `/metrics` needs `Authorization: Bearer <token>`;
+without one it's open, unless METRICS_PUBLIC is off (as in production),
+in which case it isn't served at all.
+
+Requests that run more than METRICS_QUERY_WARNING statements are logged,
+to catch N+1 queries as they happen.
+"""
+
+import hmac
+import time
+from threading import Lock
+
+from flask import (
+    abort, before_render_template, current_app, g, has_request_context,
+    request, template_rendered,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _labels(names, values):
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"')
+               .replace('\n', r'\n') for value in values)
+    return ','.join(f'{name}="{value}"'
+                    for name, value in zip(names, escaped))
+
+
+class Counter:
+    """A Prometheus counter with labels."""
+
+    kind = 'counter'
+
+    def __init__(self, name, description, labels):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values = {}
+        self._lock = Lock()
+
+    def inc(self, *values):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + 1
+
+    def samples(self):
+        with self._lock:
+            for values, count in sorted(self._values.items()):
+                yield f"{self.name}{{{_labels(self.labels, values)}}} {count}"
+
+
+class Histogram:
+    """A Prometheus histogram with labels and fixed buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels, buckets):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [count per bucket, sum, count]
+        self._series = {}
+        self._lock = Lock()
+
+    def observe(self, value, *values):
+        with self._lock:
+            series = self._series.get(values)
+            if series is None:
+                series = self._series[values] = [[0] * len(self.buckets),
+                                                  0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            for values, (counts, total, count) in sorted(
+                    self._series.items()):
+                labels = _labels(self.labels, values)
+                for bound, bucket_count in zip(self.buckets, counts):
+                    yield (f'{self.name}_bucket{{{labels},le="{bound}"}} '
+                           f'{bucket_count}')
+                yield f'{self.name}_bucket{{{labels},le="+Inf"}} {count}'
+                yield f"{self.name}_sum{{{labels}}} {total}"
+                yield f"{self.name}_count{{{labels}}} {count}"
+
+
+class RequestStats:
+    """What one request has spent so far."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0
+        self.render_time = 0
+        self.render_depth = 0
+        self.render_started = None
+
+
+class Metrics:
+    """Collects per-request metrics and serves them at /metrics."""
+
+    def __init__(self, app=None):
+        endpoint = ('endpoint',)
+        self.requests = Counter(
+            'warbler_requests_total', "Requests handled.",
+            ('endpoint', 'status'))
+        self.duration = Histogram(
+            'warbler_request_duration_seconds',
+            "Time from the request arriving to the response being ready.",
+            endpoint, TIME_BUCKETS)
+        self.queries = Histogram(
+            'warbler_request_queries', "SQL statements run per request.",
+            endpoint, QUERY_BUCKETS)
+        self.db_time = Histogram(
+            'warbler_request_db_seconds', "Time spent in SQL per request.",
+            endpoint, TIME_BUCKETS)
+        self.render_time = Histogram(
+            'warbler_request_render_seconds',
+            "Time spent rendering templates per request.",
+            endpoint, TIME_BUCKETS)
+        self.size = Histogram(
+            'warbler_response_size_bytes', "Response body sizes.",
+            endpoint, SIZE_BUCKETS)
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['metrics'] = self
+        app.config.setdefault('METRICS_TOKEN', None)
+        app.config.setdefault('METRICS_PUBLIC', True)
+        app.config.setdefault('METRICS_QUERY_WARNING', 50)
+
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.add_url_rule('/metrics', 'metrics', self.serve)
+
+        # every engine, including any added later
+        if not event.contains(Engine, 'before_cursor_execute',
+                              _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute',
+                         _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute',
+                         _after_cursor_execute)
+            event.listen(Engine, 'handle_error', _handle_error)
+
+        before_render_template.connect(_before_render, app, weak=False)
+        template_rendered.connect(_after_render, app, weak=False)
+
+    def _start(self):
+        g._request_stats = RequestStats()
+
+    def _finish(self, response):
+        stats = g.get('_request_stats')
+        if stats is None or request.endpoint == 'metrics':
+            return response
+
+        app = current_app._get_current_object()
+        endpoint = request.endpoint or 'none'
+
+        if response.is_streamed:
+            # the body (and its queries) comes after the headers are sent
+            response.call_on_close(lambda: self._record(
+                app, endpoint, stats, response.status_code, None))
+        else:
+            self._record(app, endpoint, stats, response.status_code,
+                         response.calculate_content_length())
+            response.headers['Server-Timing'] = server_timing(stats)
+
+        return response
+
+    def _record(self, app, endpoint, stats, status, size):
+        elapsed = time.perf_counter() - stats.started
+
+        self.requests.inc(endpoint, status)
+        self.duration.observe(elapsed, endpoint)
+        self.queries.observe(stats.queries, endpoint)
+        self.db_time.observe(stats.db_time, endpoint)
+        self.render_time.observe(stats.render_time, endpoint)
+        if size is not None:
+            self.size.observe(size, endpoint)
+
+        limit = app.config['METRICS_QUERY_WARNING']
+        if limit and stats.queries > limit:
+            app.logger.warning("%s ran %d SQL statements (%.1f ms)",
+                               endpoint, stats.queries, stats.db_time * 1000)
+
+    def render(self):
+        """Every metric in the Prometheus text format."""
+
+        lines = []
+
+        for metric in (self.requests, self.duration, self.queries,
+                       self.db_time, self.render_time, self.size):
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+
+        return '\n'.join(lines) + '\n'
+
+    def serve(self):
+        token = current_app.config['METRICS_TOKEN']
+        if not token and not current_app.config['METRICS_PUBLIC']:
+            abort(404)
+        if token and not hmac.compare_digest(
+                request.headers.get('Authorization', ''),
+                f"Bearer {token}"):
+            abort(401)
+
+        response = current_app.response_class(
+            self.render(), mimetype='text/plain; version=0.0.4')
+        response.cache_control.no_store = True
+        return response
+
+
+def server_timing(stats):
+    """The Server-Timing header value for `stats`."""
+
+    elapsed = time.perf_counter() - stats.started
+
+    return (f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} '
+            f'queries", render;dur={stats.render_time * 1000:.1f}, '
+            f'app;dur={elapsed * 1000:.1f}')
+
+
+def _current_stats():
+    if has_request_context():
+        return g.get('_request_stats')
+    return None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    # kept on the statement's own context, not the pooled connection, so
+    # nothing outlives the statement however it ends
+    if context is not None:
+        context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    _count_statement(context)
+
+
+def _handle_error(exception_context):
+    # a statement that raises never gets to after_cursor_execute
+    _count_statement(exception_context.execution_context)
+
+
+def _count_statement(context):
+    started = context and context.__dict__.pop('_metrics_started', None)
+    stats = _current_stats()
+
+    if started is not None and stats is not None:
+        stats.queries += 1
+        stats.db_time += time.perf_counter() - started
+
+
+def _before_render(sender, template, context, **extra):
+    stats = _current_stats()
+
+    if stats is not None:
+        # partials rendered inside a page count as part of the page
+        if not stats.render_depth:
+            stats.render_started = time.perf_counter()
+        stats.render_depth += 1
+
+
+def _after_render(sender, template, context, **extra):
+    stats = _current_stats()
+
+    if stats is not None and stats.render_depth:
+        stats.render_depth -= 1
+        if not stats.render_depth:
+            stats.render_time += time.perf_counter() - stats.render_started
@@ -0,0 +1,412 @@
+"""Versioned schema migrations for Warbler.
+
+`db.create_all()` builds a new database at the latest schema and records it
+as such. A database made before a schema change needs that change's
+migration; `upgrade` applies whatever is pending, in order and each in its
+own transaction, and records every version reached in `schema_version`.
+Commands act on whichever database DATABASE_URL names:
+
+    flask schema status
+    flask schema upgrade
+    DATABASE_URL=postgresql:///warbler-test flask schema upgrade
+    flask schema verify
+
+`verify` EXPLAINs the queries behind the busiest pages and checks that each
+one can use the index meant for it.
+
+Migrations are frozen SQL rather than built from the models, so later model
+changes can't alter what an old migration does.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import event
+
+from models import db, Follows, Likes, Message, Timeline
+from pagination import PAGE_SIZE
+
+schema_version = db.Table(
+    'schema_version',
+    db.Column('version', db.Integer, primary_key=True),
+    db.Column('name', db.Text, nullable=False),
+    db.Column('applied_at', db.DateTime, nullable=False,
+              default=datetime.utcnow),
+)
+
+# (version, name, fn(connection)), in version order
+MIGRATIONS = []
+
+
+def migration(version, name):
+    """Register the decorated `fn(connection)` as migration `version`."""
+
+    def register(fn):
+        if version != head() + 1:
+            raise ValueError(f"Migration {version} is out of sequence.")
+        MIGRATIONS.append((version, name, fn))
+        return fn
+
+    return register
+
+
+def head():
+    """The version a fully migrated database is at."""
+
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def current_version(connection):
+    """The version `connection`'s database is at; 0 if never migrated."""
+
+    if not connection.dialect.has_table(connection, schema_version.name):
+        return 0
+
+    return connection.execute(
+        db.select([db.func.max(schema_version.c.version)])).scalar() or 0
+
+
+def pending(connection):
+    """Migrations not yet applied to `connection`'s database."""
+
+    version = current_version(connection)
+    return [m for m in MIGRATIONS if m[0] > version]
+
+
+def upgrade():
+    """Apply every pending migration; returns the ones applied."""
+
+    with db.engine.begin() as connection:
+        schema_version.create(connection, checkfirst=True)
+
+    applied = []
+
+    for version, name, fn in MIGRATIONS:
+        with db.engine.begin() as connection:
+            if version <= current_version(connection):
+                continue
+
+            fn(connection)
+            connection.execute(schema_version.insert(),
+                               version=version, name=name)
+
+        applied.append((version, name, fn))
+
+    return applied
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _stamp_new_database(target, connection, tables=(), **kw):
+    # created whole from the models, it already has every migration's
+    # changes; if some tables predated this create_all, leave it to upgrade
+    if len(tables) == len(target.tables) and MIGRATIONS:
+        connection.execute(schema_version.insert(), [
+            dict(version=version, name=name)
+            for version, name, fn in MIGRATIONS
+        ])
+
+
+##############################################################################
+# Migrations
+
+
+@migration(1, "Index hot query paths; one like per user per message")
+def index_hot_paths(connection):
+    # likes.message_id was unique, so only one user could ever like a
+    # given message; the rule meant is one like per (user, message)
+    if connection.dialect.name == 'postgresql':
+        connection.execute(
+            "ALTER TABLE likes DROP CONSTRAINT IF EXISTS likes_message_id_key")
+    elif connection.dialect.name == 'sqlite':
+        _drop_sqlite_likes_message_unique(connection)
+
+    for ddl in [
+        # profile pages: one user's messages, newest first
+        "CREATE INDEX IF NOT EXISTS ix_messages_user_id_timestamp "
+        "ON messages (user_id, timestamp, id)",
+        # who a user follows; the primary key only serves who follows them
+        "CREATE INDEX IF NOT EXISTS ix_follows_user_following_id "
+        "ON follows (user_following_id, user_being_followed_id)",
+        # which messages on a page the viewer likes, and the new rule
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_likes_user_id_message_id "
+        "ON likes (user_id, message_id)",
+        # like counts, and cascades when a message is deleted
+        "CREATE INDEX IF NOT EXISTS ix_likes_message_id "
+        "ON likes (message_id)",
+    ]:
+        connection.execute(ddl)
+
+
+def _drop_sqlite_likes_message_unique(connection):
+    # SQLite can't drop a constraint, so copy the table without it
+    for index in connection.execute("PRAGMA index_list(likes)").fetchall():
+        columns = [row[2] for row in connection.execute(
+            f"PRAGMA index_info('{index[1]}')")]
+        if index[2] and index[3] == 'u' and columns == ['message_id']:
+            break
+    else:
+        return
+
+    connection.execute("ALTER TABLE likes RENAME TO likes_old")
+    connection.execute("""
+        CREATE TABLE likes (
+            id INTEGER NOT NULL,
+            user_id INTEGER,
+            message_id INTEGER,
+            PRIMARY KEY (id),
+            FOREIGN KEY(user_id) REFERENCES users (id) ON DELETE cascade,
+            FOREIGN KEY(message_id) REFERENCES messages (id) ON DELETE cascade
+        )
+    """)
+    connection.execute("INSERT INTO likes (id, user_id, message_id) "
+                       "SELECT id, user_id, message_id FROM likes_old")
+    connection.execute("DROP TABLE likes_old")
+
+
+
+@migration(2, "Add the background jobs table")
+def add_jobs(connection):
+    if connection.dialect.name == 'postgresql':
+        key = "id SERIAL PRIMARY KEY"
+        timestamp = "TIMESTAMP WITHOUT TIME ZONE"
+    else:
+        key = "id INTEGER NOT NULL PRIMARY KEY"
+        timestamp = "DATETIME"
+
+    connection.execute(f"""
+        CREATE TABLE IF NOT EXISTS jobs (
+            {key},
+            name TEXT NOT NULL,
+            args TEXT NOT NULL,
+            run_at {timestamp} NOT NULL,
+            attempts INTEGER NOT NULL,
+            last_error TEXT,
+            failed_at {timestamp},
+            created_at {timestamp} NOT NULL
+        )
+    """)
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS ix_jobs_failed_at_run_at "
+        "ON jobs (failed_at, run_at)")
+
+
+@migration(3, "Soft-delete users")
+def add_users_deleted_at(connection):
+    timestamp = ("TIMESTAMP WITHOUT TIME ZONE"
+                 if connection.dialect.name == 'postgresql' else "DATETIME")
+
+    columns = [column['name'] for column in
+               db.inspect(connection).get_columns('users')]
+    if 'deleted_at' not in columns:
+        connection.execute(
+            f"ALTER TABLE users ADD COLUMN deleted_at {timestamp}")
+
+
+# The home timeline, stat counter and search schema predate this module,
+# so databases made before them only get them from these three.
+
+
+@migration(4, "Materialize home timelines")
+def add_timelines(connection):
+    if connection.dialect.has_table(connection, 'timelines'):
+        return
+
+    timestamp = ("TIMESTAMP WITHOUT TIME ZONE"
+                 if connection.dialect.name == 'postgresql' else "DATETIME")
+
+    connection.execute(f"""
+        CREATE TABLE timelines (
+            user_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            author_id INTEGER NOT NULL,
+            timestamp {timestamp} NOT NULL,
+            PRIMARY KEY (user_id, message_id),
+            FOREIGN KEY(user_id) REFERENCES users (id) ON DELETE cascade,
+            FOREIGN KEY(message_id) REFERENCES messages (id) ON DELETE cascade,
+            FOREIGN KEY(author_id) REFERENCES users (id) ON DELETE cascade
+        )
+    """)
+    connection.execute(
+        "CREATE INDEX ix_timelines_user_id_timestamp "
+        "ON timelines (user_id, timestamp, message_id)")
+    connection.execute(
+        "CREATE INDEX ix_timelines_author_id ON timelines (author_id)")
+
+    # every user's own messages, then their followees'
+    connection.execute("""
+        INSERT INTO timelines (user_id, message_id, author_id, timestamp)
+        SELECT user_id, id, user_id, timestamp FROM messages
+    """)
+    connection.execute("""
+        INSERT INTO timelines (user_id, message_id, author_id, timestamp)
+        SELECT follows.user_following_id, messages.id, messages.user_id,
+               messages.timestamp
+        FROM follows
+        JOIN messages ON messages.user_id = follows.user_being_followed_id
+        WHERE follows.user_following_id != follows.user_being_followed_id
+    """)
+
+
+@migration(5, "Keep message, follow and like counts on users")
+def add_user_counters(connection):
+    columns = [column['name'] for column in
+               db.inspect(connection).get_columns('users')]
+    counters = ['messages_count', 'following_count', 'followers_count',
+                'likes_count']
+    if all(counter in columns for counter in counters):
+        return
+
+    for counter in counters:
+        if counter not in columns:
+            connection.execute(f"ALTER TABLE users ADD COLUMN {counter} "
+                               "INTEGER NOT NULL DEFAULT 0")
+
+    connection.execute("""
+        UPDATE users SET
+            messages_count = (SELECT count(*) FROM messages
+                              WHERE messages.user_id = users.id),
+            following_count = (SELECT count(*) FROM follows
+                               WHERE follows.user_following_id = users.id),
+            followers_count = (SELECT count(*) FROM follows
+                               WHERE follows.user_being_followed_id = users.id),
+            likes_count = (SELECT count(*) FROM likes
+                           JOIN messages ON messages.id = likes.message_id
+                           WHERE likes.user_id = users.id)
+    """)
+
+
+_SEARCH_DDL = {
+    'postgresql': [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX IF NOT EXISTS ix_users_username_trgm "
+        "ON users USING gin (username gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS ix_users_bio_trgm "
+        "ON users USING gin (bio gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS ix_users_location_trgm "
+        "ON users USING gin (location gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS ix_messages_text_tsv ON messages "
+        "USING gin (to_tsvector('english', text))",
+    ],
+    'sqlite': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5("
+        "username, bio, location, "
+        "content='users', content_rowid='id', tokenize='trigram')",
+        "CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users "
+        "BEGIN "
+        "INSERT INTO users_fts (rowid, username, bio, location) "
+        "VALUES (new.id, new.username, new.bio, new.location); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users "
+        "BEGIN "
+        "INSERT INTO users_fts (users_fts, rowid, username, bio, location) "
+        "VALUES ('delete', old.id, old.username, old.bio, old.location); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE ON users "
+        "BEGIN "
+        "INSERT INTO users_fts (users_fts, rowid, username, bio, location) "
+        "VALUES ('delete', old.id, old.username, old.bio, old.location); "
+        "INSERT INTO users_fts (rowid, username, bio, location) "
+        "VALUES (new.id, new.username, new.bio, new.location); "
+        "END",
+        "INSERT INTO users_fts (users_fts) VALUES ('rebuild')",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+        "text, content='messages', content_rowid='id')",
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_insert "
+        "AFTER INSERT ON messages "
+        "BEGIN "
+        "INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_delete "
+        "AFTER DELETE ON messages "
+        "BEGIN "
+        "INSERT INTO messages_fts (messages_fts, rowid, text) "
+        "VALUES ('delete', old.id, old.text); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_update "
+        "AFTER UPDATE OF text ON messages "
+        "BEGIN "
+        "INSERT INTO messages_fts (messages_fts, rowid, text) "
+        "VALUES ('delete', old.id, old.text); "
+        "INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text); "
+        "END",
+        "INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')",
+    ],
+}
+
+
+@migration(6, "Index user and message search")
+def add_search_indexes(connection):
+    # as models.py makes them for new databases; the rebuilds index the
+    # rows already there
+    for ddl in _SEARCH_DDL.get(connection.dialect.name, []):
+        connection.execute(ddl)
+
+##############################################################################
+# Index verification
+
+
+def hot_queries():
+    """(description, query, index its plan should use) for busy pages."""
+
+    return [
+        ("profile messages",
+         Message.query
+         .filter(Message.user_id == 1)
+         .order_by(Message.timestamp.desc(), Message.id.desc())
+         .limit(PAGE_SIZE),
+         'ix_messages_user_id_timestamp'),
+        ("home timeline",
+         Timeline.query
+         .filter(Timeline.user_id == 1)
+         .order_by(Timeline.timestamp.desc(), Timeline.message_id.desc())
+         .limit(PAGE_SIZE),
+         'ix_timelines_user_id_timestamp'),
+        ("followed user ids",
+         db.session.query(Follows.user_being_followed_id)
+         .filter(Follows.user_following_id == 1),
+         'ix_follows_user_following_id'),
+        ("likes on a message",
+         db.session.query(db.func.count(Likes.id))
+         .filter(Likes.message_id == 1),
+         'ix_likes_message_id'),
+        ("viewer's likes on a page",
+         db.session.query(Likes.message_id)
+         .filter(Likes.user_id == 1)
+         .filter(Likes.message_id.in_([1, 2, 3])),
+         'uq_likes_user_id_message_id'),
+    ]
+
+
+def explain(query):
+    """Return the database's plan for `query` as text."""
+
+    sql = str(query.statement.compile(
+        dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+
+    if db.engine.dialect.name == 'sqlite':
+        sql = 'EXPLAIN QUERY PLAN ' + sql
+    else:
+        sql = 'EXPLAIN ' + sql
+
+    # the plan text is the last column for both SQLite and Postgres
+    return '\n'.join(row[-1] for row in db.session.execute(db.text(sql)))
+
+
+def verify():
+    """EXPLAIN each hot query; returns `(description, index, ok, plan)`s."""
+
+    results = []
+
+    try:
+        if db.engine.dialect.name == 'postgresql':
+            # on small dev and test tables a sequential scan really is
+            # cheaper; rule it out so the plan shows whether the index
+            # is usable at all
+            db.session.execute("SET LOCAL enable_seqscan = off")
+
+        for description, query, index in hot_queries():
+            plan = explain(query)
+            results.append((description, index, index in plan, plan))
+    finally:
+        db.session.rollback()
+
+    return results
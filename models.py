@@ -1,12 +1,19 @@
 """SQLAlchemy models for Warbler."""
 
+from collections import Counter
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+from flask import abort
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import (
+    PASSIVE_NO_INITIALIZE, get_history, set_committed_value)
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+from hashing import PasswordHasher
+from replicas import ReplicatedSQLAlchemy
+
+hasher = PasswordHasher()
+db = ReplicatedSQLAlchemy()
 
 
 class Follows(db.Model):
@@ -26,6 +33,13 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # the primary key serves lookups by followed user; this serves the
+    # reverse, "who does this user follow"
+    __table_args__ = (
+        db.Index('ix_follows_user_following_id',
+                 'user_following_id', 'user_being_followed_id'),
+    )
+
 
 class Likes(db.Model):
     """Mapping user likes to warbles."""
@@ -45,9 +59,106 @@ class Likes(db.Model):
     message_id = db.Column(
         db.Integer,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
     )
 
+    __table_args__ = (
+        db.Index('uq_likes_user_id_message_id',
+                 'user_id', 'message_id', unique=True),
+        db.Index('ix_likes_message_id', 'message_id'),
+    )
+
+    # Postgres toggles in one statement: the DELETE and the conditional
+    # INSERT run as CTEs over the same snapshot, so exactly one of them
+    # can take effect, and the liker's counter moves with them. A like
+    # committed by a concurrent toggle after that snapshot is invisible to
+    # the DELETE, so the INSERT skips it on conflict rather than failing.
+    _TOGGLE_SQL = db.text("""
+        WITH removed AS (
+            DELETE FROM likes
+            WHERE user_id = :user_id AND message_id = :message_id
+            RETURNING id
+        ), added AS (
+            INSERT INTO likes (user_id, message_id)
+            SELECT :user_id, messages.id
+            FROM messages JOIN users ON users.id = messages.user_id
+            WHERE messages.id = :message_id AND messages.user_id != :user_id
+              AND users.deleted_at IS NULL
+              AND NOT EXISTS (SELECT 1 FROM removed)
+            ON CONFLICT (user_id, message_id) DO NOTHING
+            RETURNING id
+        ), delta AS (
+            SELECT (SELECT count(*) FROM added)
+                 - (SELECT count(*) FROM removed) AS n
+        ), counted AS (
+            UPDATE users SET likes_count = likes_count + delta.n
+            FROM delta
+            WHERE users.id = :user_id AND delta.n != 0
+        )
+        SELECT (SELECT count(*) FROM added) AS added,
+               (SELECT count(*) FROM removed) AS removed,
+               (SELECT count(*) FROM likes WHERE message_id = :message_id)
+                   + (SELECT n FROM delta) AS likes
+    """)
+
+    @classmethod
+    def toggle(cls, user_id, message_id):
+        """Like a message for a user, or unlike it if they already do.
+
+        Returns `(liked, likes)`: whether the message is now liked by the
+        user (None if nothing changed because the message doesn't exist, is
+        their own or is a deleted account's) and its like count afterwards.
+        Works below the ORM, so it keeps the user's `likes_count` itself.
+        """
+
+        params = dict(user_id=user_id, message_id=message_id)
+
+        if db.engine.dialect.name == 'postgresql':
+            # nothing changing can mean a concurrent toggle's like was
+            # skipped; a second statement sees it, and removes it, so two
+            # toggles cancel out as they would one after the other
+            for _ in range(2):
+                added, removed, likes = db.session.execute(
+                    cls._TOGGLE_SQL, params).first()
+                if added or removed:
+                    break
+        else:
+            # SQLite takes the database's write lock at the DELETE, so no
+            # other toggle can insert between it and the INSERT
+            table = cls.__table__
+            removed = db.session.execute(
+                table.delete()
+                .where(table.c.user_id == user_id)
+                .where(table.c.message_id == message_id)
+            ).rowcount
+
+            added = 0
+            if not removed:
+                added = db.session.execute(
+                    table.insert().from_select(
+                        ['user_id', 'message_id'],
+                        db.select([db.literal(user_id), Message.id])
+                        .select_from(Message.__table__.join(
+                            User.__table__, User.id == Message.user_id))
+                        .where(Message.id == message_id)
+                        .where(Message.user_id != user_id)
+                        .where(User.deleted_at.is_(None)))
+                ).rowcount
+
+            if added or removed:
+                users = User.__table__
+                db.session.execute(
+                    users.update()
+                    .where(users.c.id == user_id)
+                    .values(likes_count=users.c.likes_count + added - removed))
+
+            likes = (db.session
+                     .query(db.func.count(cls.id))
+                     .filter(cls.message_id == message_id)
+                     .scalar())
+
+        liked = True if added else False if removed else None
+        return liked, likes
+
 
 class User(db.Model):
     """User in the system."""
@@ -94,6 +205,44 @@ class User(db.Model):
         nullable=False,
     )
 
+    # set when the account is deleted; it's gone from the site at once,
+    # and its data is purged in the background (see tasks.purge_user)
+    deleted_at = db.Column(
+        db.DateTime,
+    )
+
+    # denormalized counts shown on profile and home pages; kept current by
+    # the flush listeners at the bottom of this module and rebuilt in bulk
+    # by `recount_stats`
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
     messages = db.relationship('Message')
 
     followers = db.relationship(
@@ -121,14 +270,67 @@ class User(db.Model):
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return other_user.id in self.follower_ids()
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return other_user.id in self.following_ids()
+
+    def following_ids(self):
+        """Set of ids of the users this user follows.
+
+        Built once per instance (so once per request for `g.user`) from a
+        single id-only query, letting pages check every listed user with a
+        set lookup. Dropped when this user's follows change or it expires.
+        """
+
+        if self.__dict__.get('_following_ids') is None:
+            self._following_ids = self._follow_ids(
+                'following',
+                Follows.user_being_followed_id,
+                Follows.user_following_id)
+
+        return self._following_ids
+
+    def follower_ids(self):
+        """Set of ids of the users following this user; see following_ids."""
+
+        if self.__dict__.get('_follower_ids') is None:
+            self._follower_ids = self._follow_ids(
+                'followers',
+                Follows.user_following_id,
+                Follows.user_being_followed_id)
+
+        return self._follower_ids
+
+    def _follow_ids(self, relationship, id_column, owner_column):
+        # reuse the relationship if something already loaded it
+        if relationship in self.__dict__:
+            return {user.id for user in getattr(self, relationship)}
+
+        rows = db.session.query(id_column).filter(owner_column == self.id)
+        return {user_id for (user_id,) in rows}
+
+    @classmethod
+    def followed_by(cls, user_id):
+        """Query for the users `user_id` follows, in follow-index order."""
+
+        return (cls.query
+                .join(Follows, Follows.user_being_followed_id == cls.id)
+                .filter(Follows.user_following_id == user_id)
+                .filter(cls.deleted_at.is_(None))
+                .order_by(Follows.user_being_followed_id))
+
+    @classmethod
+    def followers_of(cls, user_id):
+        """Query for the users following `user_id`, in primary key order."""
+
+        return (cls.query
+                .join(Follows, Follows.user_following_id == cls.id)
+                .filter(Follows.user_being_followed_id == user_id)
+                .filter(cls.deleted_at.is_(None))
+                .order_by(Follows.user_following_id))
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -137,7 +339,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.generate_password_hash(password)
 
         user = User(
             username=username,
@@ -158,17 +360,64 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the stored hash was made at a different work factor than is now
+        configured, it's replaced with a fresh one; the caller commits it.
         """
 
-        user = cls.query.filter_by(username=username).first()
+        user = cls.query.filter_by(username=username, deleted_at=None).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hasher.check_password_hash(user.password, password)
             if is_auth:
+                if hasher.needs_rehash(user.password):
+                    user.password = hasher.generate_password_hash(password)
                 return user
 
         return False
 
+    @classmethod
+    def get_active_or_404(cls, user_id):
+        """Get a user by id, aborting with 404 if missing or deleted."""
+
+        user = cls.query.get_or_404(user_id)
+        if user.deleted_at:
+            abort(404)
+        return user
+
+    @classmethod
+    def recount_stats(cls, user_ids=None):
+        """Recompute the stat counters from the underlying tables.
+
+        Repairs every user, or only those in `user_ids`, in one UPDATE.
+        Needed after bulk loads, which skip the flush listeners.
+        """
+
+        def count(column, *criteria):
+            return (db.select([db.func.count(column)])
+                    .where(db.and_(*criteria))
+                    .as_scalar())
+
+        users = cls.__table__
+        stmt = users.update().values(
+            messages_count=count(Message.id, Message.user_id == users.c.id),
+            following_count=count(
+                Follows.user_being_followed_id,
+                Follows.user_following_id == users.c.id),
+            followers_count=count(
+                Follows.user_following_id,
+                Follows.user_being_followed_id == users.c.id),
+            likes_count=count(
+                Likes.id,
+                Likes.user_id == users.c.id,
+                Likes.message_id == Message.id),
+        )
+
+        if user_ids is not None:
+            stmt = stmt.where(users.c.id.in_(user_ids))
+
+        db.session.execute(stmt)
+
 
 class Message(db.Model):
     """An individual message ("warble")."""
@@ -188,7 +437,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -199,6 +448,469 @@ class Message(db.Model):
 
     user = db.relationship('User')
 
+    # profile pages and timeline backfills read one user's messages newest
+    # first
+    __table_args__ = (
+        db.Index('ix_messages_user_id_timestamp',
+                 'user_id', 'timestamp', 'id'),
+    )
+
+    @classmethod
+    def by_active_users(cls):
+        """Query for messages, leaving out deleted accounts' messages.
+
+        Those stay in the tables until the account's purge job reaches
+        them, but are gone from the site as soon as it's deleted.
+        """
+
+        return (cls.query
+                .join(User, User.id == cls.user_id)
+                .filter(User.deleted_at.is_(None)))
+
+    @classmethod
+    def hydrate(cls, messages, viewer=None):
+        """Bulk-load what a page of messages needs to render.
+
+        Loads every author in one query and attaches them, so `msg.user`
+        doesn't issue a query per row, then returns the set of ids of
+        these messages that `viewer` has liked (empty if no viewer).
+        """
+
+        author_ids = {msg.user_id for msg in messages}
+        authors = {}
+
+        if author_ids:
+            authors = {user.id: user for user in
+                       User.query.filter(User.id.in_(author_ids))}
+
+        for msg in messages:
+            set_committed_value(msg, 'user', authors.get(msg.user_id))
+
+        if not viewer or not messages:
+            return set()
+
+        liked = (db.session
+                 .query(Likes.message_id)
+                 .filter(Likes.user_id == viewer.id)
+                 .filter(Likes.message_id.in_([msg.id for msg in messages])))
+
+        return {message_id for (message_id,) in liked}
+
+
+class Timeline(db.Model):
+    """Materialized home timeline: one row per message in a user's feed.
+
+    Rows are written when a message is posted (fan-out on write) and when
+    a follow starts or stops, so reading a feed is a single range scan
+    over (user_id, timestamp) instead of an IN-list over all messages.
+    """
+
+    __tablename__ = 'timelines'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    author_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timelines_user_id_timestamp',
+                 'user_id', 'timestamp', 'message_id'),
+        db.Index('ix_timelines_author_id', 'author_id'),
+    )
+
+    @classmethod
+    def messages_for(cls, user_id):
+        """Query for the messages on `user_id`'s home timeline.
+
+        Page it with `paginate` on `Timeline.timestamp, Timeline.message_id`
+        so it's a range scan on the timeline index.
+        """
+
+        return (Message.by_active_users()
+                .join(cls, cls.message_id == Message.id)
+                .filter(cls.user_id == user_id))
+
+    @classmethod
+    def fan_out(cls, message, author=True, followers=True):
+        """Add `message` to its author's timeline and to every follower's.
+
+        The message must already be flushed so it has an id. Followers who
+        already have it are skipped, so this can be run again safely.
+        """
+
+        if author:
+            db.session.execute(
+                cls.__table__.insert(),
+                dict(user_id=message.user_id,
+                     message_id=message.id,
+                     author_id=message.user_id,
+                     timestamp=message.timestamp)
+            )
+
+        if not followers:
+            return
+
+        db.session.execute(
+            cls.__table__.insert().from_select(
+                ['user_id', 'message_id', 'author_id', 'timestamp'],
+                db.session.query(
+                    Follows.user_following_id,
+                    db.literal(message.id),
+                    db.literal(message.user_id),
+                    db.literal(message.timestamp),
+                )
+                .filter(Follows.user_being_followed_id == message.user_id)
+                .filter(Follows.user_following_id != message.user_id)
+                .filter(~db.exists().where(db.and_(
+                    cls.user_id == Follows.user_following_id,
+                    cls.message_id == message.id)))
+            )
+        )
+
+    @classmethod
+    def backfill(cls, follower_id, followed_id):
+        """Copy `followed_id`'s messages into `follower_id`'s timeline.
+
+        Messages already there are skipped, so this can be run again.
+        """
+
+        if follower_id == followed_id:
+            return
+
+        db.session.execute(
+            cls.__table__.insert().from_select(
+                ['user_id', 'message_id', 'author_id', 'timestamp'],
+                db.session.query(
+                    db.literal(follower_id),
+                    Message.id,
+                    Message.user_id,
+                    Message.timestamp,
+                )
+                .filter(Message.user_id == followed_id)
+                .filter(~db.exists().where(db.and_(
+                    cls.user_id == follower_id,
+                    cls.message_id == Message.id)))
+            )
+        )
+
+    @classmethod
+    def prune(cls, follower_id, followed_id):
+        """Remove `followed_id`'s messages from `follower_id`'s timeline."""
+
+        if follower_id == followed_id:
+            return
+
+        (cls.query
+         .filter(cls.user_id == follower_id, cls.author_id == followed_id)
+         .delete(synchronize_session=False))
+
+    @classmethod
+    def remove_message(cls, message_id):
+        """Remove a message from every timeline it was fanned out to."""
+
+        (cls.query
+         .filter(cls.message_id == message_id)
+         .delete(synchronize_session=False))
+
+    @classmethod
+    def rebuild(cls):
+        """Rebuild every timeline from messages and follows.
+
+        Used after bulk loads (see seed.py) that bypass `fan_out`.
+        """
+
+        cls.query.delete(synchronize_session=False)
+
+        columns = ['user_id', 'message_id', 'author_id', 'timestamp']
+
+        db.session.execute(
+            cls.__table__.insert().from_select(
+                columns,
+                # labelled, or the repeated column is selected only once
+                db.session.query(
+                    Message.user_id, Message.id,
+                    Message.user_id.label('author_id'), Message.timestamp,
+                )
+            )
+        )
+
+        db.session.execute(
+            cls.__table__.insert().from_select(
+                columns,
+                db.session.query(
+                    Follows.user_following_id, Message.id, Message.user_id,
+                    Message.timestamp,
+                )
+                .join(Message, Message.user_id == Follows.user_being_followed_id)
+                .filter(Follows.user_following_id != Follows.user_being_followed_id)
+            )
+        )
+
+
+##############################################################################
+# Follow membership caches (see User.following_ids)
+
+
+@event.listens_for(User.following, 'append')
+@event.listens_for(User.following, 'remove')
+def _forget_following_ids(target, value, initiator):
+    target.__dict__.pop('_following_ids', None)
+    value.__dict__.pop('_follower_ids', None)
+
+
+@event.listens_for(User.followers, 'append')
+@event.listens_for(User.followers, 'remove')
+def _forget_follower_ids(target, value, initiator):
+    target.__dict__.pop('_follower_ids', None)
+    value.__dict__.pop('_following_ids', None)
+
+
+@event.listens_for(User, 'expire')
+def _forget_follow_ids(target, attrs):
+    # target is None if the instance was already garbage collected
+    if target is not None and attrs is None:
+        target.__dict__.pop('_following_ids', None)
+        target.__dict__.pop('_follower_ids', None)
+
+
+##############################################################################
+# Stat counter maintenance
+#
+# Changes are tallied per (user id, counter) while a flush runs and then
+# applied as `counter = counter + n` UPDATEs in the same transaction.
+# Deletes are tallied before the flush, while the rows they take with them
+# (likes on a deleted message, a deleted user's follows) can still be
+# queried; inserts and collection changes after it, once ids are assigned.
+
+
+def _stat_deltas(session):
+    return session.info.setdefault('stat_deltas', Counter())
+
+
+@event.listens_for(Session, 'before_flush')
+def _tally_deleted_stats(session, flush_context, instances):
+    deltas = _stat_deltas(session)
+    deleted_like_ids = [obj.id for obj in session.deleted
+                        if isinstance(obj, Likes)]
+
+    for obj in session.deleted:
+        if isinstance(obj, Message):
+            deltas[obj.user_id, 'messages_count'] -= 1
+            likers = (session
+                      .query(Likes.user_id)
+                      .filter(Likes.message_id == obj.id)
+                      .filter(~Likes.id.in_(deleted_like_ids)))
+            for (liker_id,) in likers:
+                deltas[liker_id, 'likes_count'] -= 1
+
+        elif isinstance(obj, Likes):
+            deltas[obj.user_id, 'likes_count'] -= 1
+
+        elif isinstance(obj, Follows):
+            deltas[obj.user_following_id, 'following_count'] -= 1
+            deltas[obj.user_being_followed_id, 'followers_count'] -= 1
+
+        elif isinstance(obj, User):
+            followed = (session
+                        .query(Follows.user_being_followed_id)
+                        .filter(Follows.user_following_id == obj.id))
+            for (followed_id,) in followed:
+                deltas[followed_id, 'followers_count'] -= 1
+
+            followers = (session
+                         .query(Follows.user_following_id)
+                         .filter(Follows.user_being_followed_id == obj.id))
+            for (follower_id,) in followers:
+                deltas[follower_id, 'following_count'] -= 1
+
+            likers = (session
+                      .query(Likes.user_id)
+                      .join(Message, Message.id == Likes.message_id)
+                      .filter(Message.user_id == obj.id))
+            for (liker_id,) in likers:
+                deltas[liker_id, 'likes_count'] -= 1
+
+
+@event.listens_for(Session, 'after_flush')
+def _apply_stats(session, flush_context):
+    deltas = session.info.pop('stat_deltas', Counter())
+
+    for obj in session.new:
+        if isinstance(obj, Message):
+            deltas[obj.user_id, 'messages_count'] += 1
+
+        elif isinstance(obj, Likes):
+            deltas[obj.user_id, 'likes_count'] += 1
+
+        elif isinstance(obj, Follows):
+            deltas[obj.user_following_id, 'following_count'] += 1
+            deltas[obj.user_being_followed_id, 'followers_count'] += 1
+
+    # follows and likes made through User.following / .followers / .likes
+    # never become Follows or Likes objects, so read them off the history
+    collections = [
+        ('following', 'following_count', 'followers_count'),
+        ('followers', 'followers_count', 'following_count'),
+        ('likes', 'likes_count', None),
+    ]
+
+    for obj in session.new | session.dirty:
+        if not isinstance(obj, User):
+            continue
+
+        for attr, own_stat, other_stat in collections:
+            history = get_history(obj, attr, passive=PASSIVE_NO_INITIALIZE)
+            for change, items in ((1, history.added or ()),
+                                  (-1, history.deleted or ())):
+                for other in items:
+                    deltas[obj.id, own_stat] += change
+                    if other_stat:
+                        deltas[other.id, other_stat] += change
+
+    changes = {}
+    for (user_id, stat), delta in deltas.items():
+        if user_id is not None and delta:
+            changes.setdefault(user_id, {})[stat] = delta
+
+    users = User.__table__
+    for user_id, stats in changes.items():
+        session.execute(
+            users.update()
+            .where(users.c.id == user_id)
+            .values({stat: users.c[stat] + delta
+                     for stat, delta in stats.items()})
+        )
+
+    session.info['stale_stats'] = changes
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def _expire_stale_stats(session, flush_context):
+    changes = session.info.pop('stale_stats', {})
+
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, User) and obj.id in changes:
+            session.expire(obj, list(changes[obj.id]))
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_stats(session, previous_transaction):
+    session.info.pop('stat_deltas', None)
+    session.info.pop('stale_stats', None)
+
+
+##############################################################################
+# Search indexes (see search.py)
+#
+# For users, Postgres gets trigram GIN indexes, which serve the substring
+# ILIKEs the user search runs. SQLite gets an FTS5 trigram table over the
+# same columns, kept in step with `users` by triggers.
+
+_USER_SEARCH_DDL = {
+    'postgresql': [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX IF NOT EXISTS ix_users_username_trgm "
+        "ON users USING gin (username gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS ix_users_bio_trgm "
+        "ON users USING gin (bio gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS ix_users_location_trgm "
+        "ON users USING gin (location gin_trgm_ops)",
+    ],
+    'sqlite': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5("
+        "username, bio, location, "
+        "content='users', content_rowid='id', tokenize='trigram')",
+        "CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users "
+        "BEGIN "
+        "INSERT INTO users_fts (rowid, username, bio, location) "
+        "VALUES (new.id, new.username, new.bio, new.location); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users "
+        "BEGIN "
+        "INSERT INTO users_fts (users_fts, rowid, username, bio, location) "
+        "VALUES ('delete', old.id, old.username, old.bio, old.location); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE ON users "
+        "BEGIN "
+        "INSERT INTO users_fts (users_fts, rowid, username, bio, location) "
+        "VALUES ('delete', old.id, old.username, old.bio, old.location); "
+        "INSERT INTO users_fts (rowid, username, bio, location) "
+        "VALUES (new.id, new.username, new.bio, new.location); "
+        "END",
+        "INSERT INTO users_fts (users_fts) VALUES ('rebuild')",
+    ],
+}
+
+for _dialect, _statements in _USER_SEARCH_DDL.items():
+    for _statement in _statements:
+        event.listen(User.__table__, 'after_create',
+                     db.DDL(_statement).execute_if(dialect=_dialect))
+
+event.listen(User.__table__, 'before_drop',
+             db.DDL("DROP TABLE IF EXISTS users_fts").execute_if(dialect='sqlite'))
+
+# Message text is searched by word rather than substring: a tsvector GIN
+# index on Postgres, an FTS5 table with the default word tokenizer on
+# SQLite. Both are maintained by the database as messages come and go.
+
+TEXT_SEARCH_CONFIG = 'english'
+
+_MESSAGE_SEARCH_DDL = {
+    'postgresql': [
+        "CREATE INDEX IF NOT EXISTS ix_messages_text_tsv ON messages "
+        f"USING gin (to_tsvector('{TEXT_SEARCH_CONFIG}', text))",
+    ],
+    'sqlite': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+        "text, content='messages', content_rowid='id')",
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_insert "
+        "AFTER INSERT ON messages "
+        "BEGIN "
+        "INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_delete "
+        "AFTER DELETE ON messages "
+        "BEGIN "
+        "INSERT INTO messages_fts (messages_fts, rowid, text) "
+        "VALUES ('delete', old.id, old.text); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_update "
+        "AFTER UPDATE OF text ON messages "
+        "BEGIN "
+        "INSERT INTO messages_fts (messages_fts, rowid, text) "
+        "VALUES ('delete', old.id, old.text); "
+        "INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text); "
+        "END",
+        "INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')",
+    ],
+}
+
+for _dialect, _statements in _MESSAGE_SEARCH_DDL.items():
+    for _statement in _statements:
+        event.listen(Message.__table__, 'after_create',
+                     db.DDL(_statement).execute_if(dialect=_dialect))
+
+event.listen(Message.__table__, 'before_drop',
+             db.DDL("DROP TABLE IF EXISTS messages_fts").execute_if(dialect='sqlite'))
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
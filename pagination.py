@@ -0,0 +1,58 @@
+"""Keyset (cursor) pagination for message lists.
+
+Pages are addressed by the `(timestamp, id)` of the last message shown, so
+fetching an older page seeks straight to it on the index instead of
+counting past every newer row like OFFSET does.
+"""
+
+from datetime import datetime
+
+from flask import abort
+from sqlalchemy import tuple_
+
+PAGE_SIZE = 100
+
+
+def encode_cursor(timestamp, id):
+    """Make the `?before=` value pointing just past this message."""
+
+    return f"{timestamp.isoformat()},{id}"
+
+
+def decode_cursor(value):
+    """Split a `?before=` value back into `(timestamp, id)`.
+
+    Raises ValueError if it isn't one we made.
+    """
+
+    timestamp, _, id = value.rpartition(',')
+    return datetime.fromisoformat(timestamp), int(id)
+
+
+def paginate(query, timestamp_col, id_col, before=None, per_page=PAGE_SIZE):
+    """Return one page of `query` and the cursor for the page after it.
+
+    `query` must yield messages; it is ordered newest first on
+    `(timestamp_col, id_col)` and, if `before` is given, starts just past
+    that cursor. The next cursor is None on the last page. A malformed
+    cursor is a 400.
+    """
+
+    if before:
+        try:
+            cursor = decode_cursor(before)
+        except ValueError:
+            abort(400)
+        query = query.filter(tuple_(timestamp_col, id_col) < tuple_(*cursor))
+
+    items = (query
+             .order_by(timestamp_col.desc(), id_col.desc())
+             .limit(per_page + 1)
+             .all())
+
+    if len(items) > per_page:
+        items = items[:per_page]
+        last = items[-1]
+        return items, encode_cursor(last.timestamp, last.id)
+
+    return items, None
@@ -0,0 +1,102 @@
+"""Read replica routing for Warbler's database session.
+
+With SQLALCHEMY_REPLICA_URIS set, GET and HEAD requests read from one of
+those databases (the same one for a whole request), and everything else
+uses the primary at SQLALCHEMY_DATABASE_URI:
+
+    DATABASE_URL=postgresql://primary/warbler \\
+    DATABASE_REPLICA_URLS=postgresql://replica1/warbler,postgresql://replica2/warbler \\
+        flask run
+
+Writes always go to the primary, and once a request has written, the rest
+of its queries do too. Replicas lag a little behind, so the writer's
+browser session is also pinned to the primary for REPLICA_PIN_SECONDS
+afterwards; their own new message, like or follow shows up on the very
+next page even before it reaches the replicas.
+
+Commands, tests and anything else outside a request use the primary. To
+try replication locally, point the replica URL at a second database
+(e.g. a copy of a SQLite file) and watch which one a page reads from.
+"""
+
+import random
+import time
+
+from flask import g, has_request_context, request, session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy, get_state
+from sqlalchemy import create_engine, orm
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import TextClause
+
+READ_METHODS = frozenset(['GET', 'HEAD'])
+
+# flask session key: time until which this browser reads from the primary
+PIN_KEY = '_primary_until'
+
+
+def _is_write(clause):
+    # raw SQL could be anything, so it's treated as a write
+    return (isinstance(clause, (UpdateBase, TextClause))
+            or getattr(clause, '_for_update_arg', None) is not None)
+
+
+class RoutingSession(SignallingSession):
+    """A session that sends a request's reads to a replica when it can."""
+
+    def get_bind(self, mapper=None, clause=None):
+        primary = super().get_bind(mapper, clause)
+
+        if not has_request_context():
+            return primary
+
+        if self._flushing or _is_write(clause):
+            self._wrote()
+            return primary
+
+        if g.get('_wrote') or not self._may_read_replica():
+            return primary
+
+        if '_replica' not in g:
+            engines = get_state(self.app).db.replica_engines(self.app)
+            g._replica = random.choice(engines)
+
+        return g._replica
+
+    def _may_read_replica(self):
+        return (request.method in READ_METHODS
+                and self.app.config['SQLALCHEMY_REPLICA_URIS']
+                and session.get(PIN_KEY, 0) <= time.time())
+
+    def _wrote(self):
+        g._wrote = True
+        if self.app.config['SQLALCHEMY_REPLICA_URIS']:
+            session[PIN_KEY] = (time.time()
+                                + self.app.config['REPLICA_PIN_SECONDS'])
+
+
+class ReplicatedSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with read replicas; see the module docstring."""
+
+    def __init__(self, *args, **kwargs):
+        self._replicas = {}
+        super().__init__(*args, **kwargs)
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+        app.config.setdefault('REPLICA_PIN_SECONDS', 5)
+        super().init_app(app)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def replica_engines(self, app):
+        """An engine for each of `app`'s replicas, made on first use."""
+
+        uris = tuple(app.config['SQLALCHEMY_REPLICA_URIS'])
+
+        if uris not in self._replicas:
+            options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {}
+            self._replicas[uris] = [create_engine(uri, **options)
+                                    for uri in uris]
+
+        return self._replicas[uris]
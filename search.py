@@ -0,0 +1,118 @@
+"""Ranked, paginated search for Warbler.
+
+Matching runs against the search indexes set up in models.py: GIN indexes
+on Postgres and FTS5 tables on SQLite (used for local runs), so neither
+search scans a whole table.
+"""
+
+import re
+
+from sqlalchemy import case, column, func, or_, table, text
+
+from models import db, User, Message, TEXT_SEARCH_CONFIG
+from pagination import paginate
+
+USERS_PER_PAGE = 24
+
+# trigram indexes can't help with terms shorter than one trigram
+MIN_INDEXED_TERM = 3
+
+users_fts = table('users_fts', column('rowid'))
+messages_fts = table('messages_fts', column('rowid'))
+
+
+# `!` rather than backslash, which dialects quote differently
+LIKE_ESCAPE = '!'
+
+
+def escape_like(term):
+    """Escape LIKE wildcards in `term` so it matches literally."""
+
+    return (term
+            .replace(LIKE_ESCAPE, LIKE_ESCAPE * 2)
+            .replace('%', LIKE_ESCAPE + '%')
+            .replace('_', LIKE_ESCAPE + '_'))
+
+
+def page_of(query, page, per_page):
+    """Return the `page`th (from 1) slice of `query` and whether more follow."""
+
+    items = query.limit(per_page + 1).offset((page - 1) * per_page).all()
+    return items[:per_page], len(items) > per_page
+
+
+def search_users(term=None, page=1, per_page=USERS_PER_PAGE):
+    """Find users whose username, bio or location contains `term`.
+
+    Best matches come first: exact and then prefix username matches, then
+    by the index's own relevance score. With no term, lists everyone in
+    signup order. Returns `(users, has_next)`.
+    """
+
+    users = User.query.filter(User.deleted_at.is_(None))
+
+    if not term:
+        return page_of(users.order_by(User.id), page, per_page)
+
+    prefix = f"{escape_like(term)}%"
+    pattern = f"%{prefix}"
+    username_rank = case(
+        [(func.lower(User.username) == term.lower(), 0),
+         (User.username.ilike(prefix, escape=LIKE_ESCAPE), 1)],
+        else_=2)
+
+    if db.engine.dialect.name == 'sqlite' and len(term) >= MIN_INDEXED_TERM:
+        # a quoted FTS5 string is a plain substring match under trigram
+        phrase = '"' + term.replace('"', '""') + '"'
+        query = (users
+                 .join(users_fts, users_fts.c.rowid == User.id)
+                 .filter(text("users_fts MATCH :phrase"))
+                 .params(phrase=phrase)
+                 .order_by(username_rank,
+                           text("bm25(users_fts, 10.0, 1.0, 1.0)"),
+                           User.id))
+        return page_of(query, page, per_page)
+
+    query = users.filter(or_(
+        User.username.ilike(pattern, escape=LIKE_ESCAPE),
+        User.bio.ilike(pattern, escape=LIKE_ESCAPE),
+        User.location.ilike(pattern, escape=LIKE_ESCAPE),
+    ))
+
+    if db.engine.dialect.name == 'postgresql':
+        query = query.order_by(username_rank,
+                               func.similarity(User.username, term).desc(),
+                               User.id)
+    else:
+        query = query.order_by(username_rank, User.id)
+
+    return page_of(query, page, per_page)
+
+
+def search_messages(term, before=None):
+    """Find messages containing every word in `term`, newest first.
+
+    Words are matched after stemming (Postgres) or case folding (SQLite),
+    not as raw substrings. Results are ordered by recency rather than
+    relevance so they can be paged with the same `(timestamp, id)` cursor
+    as the timelines. Returns `(messages, next_cursor)`.
+    """
+
+    words = re.findall(r"\w+", term or '')
+
+    if not words:
+        return [], None
+
+    if db.engine.dialect.name == 'postgresql':
+        document = func.to_tsvector(TEXT_SEARCH_CONFIG, Message.text)
+        tsquery = func.plainto_tsquery(TEXT_SEARCH_CONFIG, ' '.join(words))
+        query = Message.by_active_users().filter(document.op('@@')(tsquery))
+    else:
+        # each word quoted so FTS5 reads none of them as operators
+        match = ' '.join('"' + word + '"' for word in words)
+        query = (Message.by_active_users()
+                 .join(messages_fts, messages_fts.c.rowid == Message.id)
+                 .filter(text("messages_fts MATCH :match"))
+                 .params(match=match))
+
+    return paginate(query, Message.timestamp, Message.id, before=before)
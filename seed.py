@@ -1,20 +1,10 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
 
-from csv import DictReader
-from app import db
-from models import User, Message, Follows
+A shortcut for `flask load-data generator --reset`; see loader.py.
+"""
 
+from app import create_app
+from loader import load
 
-db.drop_all()
-db.create_all()
-
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
-
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
-
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follows, DictReader(follows))
-
-db.session.commit()
+with create_app().app_context():
+    load('generator', reset=True)
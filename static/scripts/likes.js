@@ -0,0 +1,27 @@
+// Toggle likes in place instead of posting the form and reloading the
+// page. Without JavaScript the like forms still work as plain POSTs.
+
+$(document).on("submit", ".like-form", function (evt) {
+  evt.preventDefault();
+
+  var $form = $(this);
+  var $button = $form.find("button");
+
+  $button.prop("disabled", true);
+
+  $.post($form.data("like-url"))
+    .done(function (data) {
+      $button
+        .toggleClass("btn-primary", data.liked)
+        .toggleClass("btn-secondary", !data.liked)
+        .attr("title", data.likes + (data.likes === 1 ? " like" : " likes"));
+    })
+    .fail(function () {
+      // fall back to the full-page version, which reports errors;
+      // a native submit() doesn't re-trigger this handler
+      $form[0].submit();
+    })
+    .always(function () {
+      $button.prop("disabled", false);
+    });
+});
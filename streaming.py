@@ -0,0 +1,38 @@
+"""Streamed rendering for pages with unbounded lists.
+
+A streamed page is sent to the client as the template produces it, so the
+first bytes go out before the list's query has finished and nothing holds
+the whole list or the whole page. Pass queries in with `yield_per` so
+rows are fetched from a server-side cursor a batch at a time too.
+
+Streamed responses can't carry an ETag (it would need the whole page) and
+are skipped by the debug toolbar.
+"""
+
+from flask import (
+    Response, current_app, get_flashed_messages, stream_with_context)
+
+# template output pieces to collect before each write; Jinja yields one
+# per expression, which would make for tiny writes
+BUFFER_SIZE = 100
+
+# rows to fetch from the database at a time
+YIELD_PER = 500
+
+
+def stream_template(template_name, **context):
+    """Render `template_name` to the client in chunks."""
+
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+
+    # the session cookie is written before the body, so take any flashed
+    # messages out of it now; the template's own call gets the same ones
+    get_flashed_messages(with_categories=True)
+
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(BUFFER_SIZE)
+
+    # keeps the request context (g.user, the db session) alive while the
+    # generator runs after the view has returned
+    return Response(stream_with_context(stream), mimetype='text/html')
@@ -0,0 +1,208 @@
+"""Warbler's deferred work; see jobs.py for how tasks run.
+
+These are the writes whose cost grows with other users' data: a new
+message goes into every follower's timeline, a follow copies or removes
+a whole account's messages, and a deleted account takes everything it
+ever wrote with it. The request does the part its own user will look at
+next and leaves the rest to a job.
+
+Jobs can run late, twice, or after the user has changed their mind, so
+each task checks the current state before acting and skips rows that are
+already there.
+"""
+
+import logging
+
+from jobs import task
+from models import db, Follows, Likes, Message, Timeline, User
+
+log = logging.getLogger(__name__)
+
+# rows a purge_user job deletes from one table before handing on to the
+# next job, so no transaction holds many locks or runs for long
+PURGE_BATCH = 1000
+
+
+def _following(follower_id, followed_id):
+    return db.session.query(
+        Follows.query
+        .filter_by(user_following_id=follower_id,
+                   user_being_followed_id=followed_id)
+        .exists()
+    ).scalar()
+
+
+@task
+def fan_out(message_id):
+    """Add a message to its author's followers' timelines."""
+
+    message = Message.query.get(message_id)
+    if message:
+        Timeline.fan_out(message, author=False)
+
+
+@task
+def backfill(follower_id, followed_id):
+    """Copy a newly followed user's messages into the follower's timeline."""
+
+    if _following(follower_id, followed_id):
+        Timeline.backfill(follower_id, followed_id)
+
+
+@task
+def prune(follower_id, followed_id):
+    """Take an unfollowed user's messages off the follower's timeline."""
+
+    if not _following(follower_id, followed_id):
+        Timeline.prune(follower_id, followed_id)
+
+
+##############################################################################
+# Account deletion
+#
+# Each purge step deletes up to PURGE_BATCH rows by key and returns how
+# many it found, then fixes the counters of the other users involved.
+# Timelines go first: they're the most rows, and messages' deletes
+# would otherwise cascade to them unindexed.
+
+
+def _purge_own_timeline(user_id):
+    message_ids = [message_id for (message_id,) in
+                   db.session.query(Timeline.message_id)
+                   .filter(Timeline.user_id == user_id)
+                   .limit(PURGE_BATCH)]
+
+    if message_ids:
+        (Timeline.query
+         .filter(Timeline.user_id == user_id,
+                 Timeline.message_id.in_(message_ids))
+         .delete(synchronize_session=False))
+
+    return len(message_ids)
+
+
+def _purge_authored_timelines(user_id):
+    rows = (db.session.query(Timeline.user_id, Timeline.message_id)
+            .filter(Timeline.author_id == user_id)
+            .limit(PURGE_BATCH)
+            .all())
+
+    if rows:
+        (Timeline.query
+         .filter(db.tuple_(Timeline.user_id, Timeline.message_id).in_(rows))
+         .delete(synchronize_session=False))
+
+    return len(rows)
+
+
+def _purge_likes_given(user_id):
+    like_ids = [like_id for (like_id,) in
+                db.session.query(Likes.id)
+                .filter(Likes.user_id == user_id)
+                .limit(PURGE_BATCH)]
+
+    if like_ids:
+        (Likes.query
+         .filter(Likes.id.in_(like_ids))
+         .delete(synchronize_session=False))
+
+    return len(like_ids)
+
+
+def _purge_likes_received(user_id):
+    likes = (db.session.query(Likes.id, Likes.user_id)
+             .join(Message, Message.id == Likes.message_id)
+             .filter(Message.user_id == user_id)
+             .limit(PURGE_BATCH)
+             .all())
+
+    if likes:
+        (Likes.query
+         .filter(Likes.id.in_([like_id for like_id, liker_id in likes]))
+         .delete(synchronize_session=False))
+        User.recount_stats(list({liker_id for like_id, liker_id in likes}))
+
+    return len(likes)
+
+
+def _purge_followers(user_id):
+    follower_ids = [follower_id for (follower_id,) in
+                    db.session.query(Follows.user_following_id)
+                    .filter(Follows.user_being_followed_id == user_id)
+                    .limit(PURGE_BATCH)]
+
+    if follower_ids:
+        (Follows.query
+         .filter(Follows.user_being_followed_id == user_id,
+                 Follows.user_following_id.in_(follower_ids))
+         .delete(synchronize_session=False))
+        User.recount_stats(follower_ids)
+
+    return len(follower_ids)
+
+
+def _purge_following(user_id):
+    followed_ids = [followed_id for (followed_id,) in
+                    db.session.query(Follows.user_being_followed_id)
+                    .filter(Follows.user_following_id == user_id)
+                    .limit(PURGE_BATCH)]
+
+    if followed_ids:
+        (Follows.query
+         .filter(Follows.user_following_id == user_id,
+                 Follows.user_being_followed_id.in_(followed_ids))
+         .delete(synchronize_session=False))
+        User.recount_stats(followed_ids)
+
+    return len(followed_ids)
+
+
+def _purge_messages(user_id):
+    message_ids = [message_id for (message_id,) in
+                   db.session.query(Message.id)
+                   .filter(Message.user_id == user_id)
+                   .limit(PURGE_BATCH)]
+
+    if message_ids:
+        (Message.query
+         .filter(Message.id.in_(message_ids))
+         .delete(synchronize_session=False))
+
+    return len(message_ids)
+
+
+PURGE_STEPS = [
+    ('own timeline', _purge_own_timeline),
+    ('timeline entries', _purge_authored_timelines),
+    ('likes given', _purge_likes_given),
+    ('likes received', _purge_likes_received),
+    ('followers', _purge_followers),
+    ('following', _purge_following),
+    ('messages', _purge_messages),
+]
+
+
+@task
+def purge_user(user_id, purged=None):
+    """Delete a deleted account's data a batch at a time, then the account.
+
+    Each run deletes one batch and queues the next run, carrying the
+    running totals in `purged`, which `flask jobs status` shows.
+    """
+
+    purged = purged or {}
+    user = User.query.get(user_id)
+    if user is None or user.deleted_at is None:
+        return
+
+    for name, step in PURGE_STEPS:
+        found = step(user_id)
+        if found:
+            purged[name] = purged.get(name, 0) + found
+            purge_user.delay(user_id=user_id, purged=purged)
+            return
+
+    users = User.__table__
+    db.session.execute(users.delete().where(users.c.id == user_id))
+    db.session.expunge(user)
+    log.info("Purged user %s: %s", user_id, purged or "nothing to remove")
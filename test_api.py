@@ -0,0 +1,118 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_api.py
+
+
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, Message, User, Likes, Follows, Timeline
+
+from pagination import PAGE_SIZE
+from app import create_app
+from views import CURR_USER_KEY
+
+app = create_app('test')
+
+db.create_all()
+
+
+class ApiTestCase(TestCase):
+    """Test the read-only JSON API."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        self.reader = User(id=601, username="reader", email="reader@test.com", password="x")
+        self.writer = User(id=602, username="writer", email="writer@test.com", password="x")
+        db.session.add_all([self.reader, self.writer])
+        db.session.add(Follows(user_being_followed_id=602, user_following_id=601))
+
+        start = datetime(2020, 1, 1)
+        db.session.add_all([
+            Message(id=7000 + i, text=f"warble {i}", user_id=602,
+                    timestamp=start + timedelta(minutes=i))
+            for i in range(PAGE_SIZE + 5)
+        ])
+        db.session.add(Likes(user_id=601, message_id=7003))
+        db.session.commit()
+        Timeline.rebuild()
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self, client):
+        with client.session_transaction() as session:
+            session[CURR_USER_KEY] = 601
+
+    def test_timeline(self):
+        """Test that the timeline pages with cursors and marks likes"""
+
+        with self.client as client:
+            res = client.get("/api/v1/timeline")
+            self.assertEqual(res.status_code, 401)
+            self.assertEqual(res.get_json(), {"error": "Access unauthorized."})
+
+            self.login(client)
+            page = client.get("/api/v1/timeline").get_json()
+
+            self.assertEqual(len(page["messages"]), PAGE_SIZE)
+            newest = page["messages"][0]
+            self.assertEqual(newest["id"], 7000 + PAGE_SIZE + 4)
+            self.assertEqual(newest["user"], {"id": 602, "username": "writer",
+                                              "image_url": "/static/images/default-pic.png"})
+            self.assertEqual(newest["timestamp"], "2020-01-01T01:44:00")
+
+            rest = client.get("/api/v1/timeline", query_string={"before": page["next"]}).get_json()
+            self.assertEqual([m["id"] for m in rest["messages"]], [7004, 7003, 7002, 7001, 7000])
+            self.assertEqual([m["liked"] for m in rest["messages"]], [False, True, False, False, False])
+            self.assertIsNone(rest["next"])
+
+    def test_fields(self):
+        """Test that ?fields= trims items and rejects unknown fields"""
+
+        res = self.client.get("/api/v1/users/602/messages?fields=id,text")
+        self.assertEqual(res.get_json()["messages"][0], {"id": 7104, "text": "warble 104"})
+        self.assertNotIn(b" ", res.data.replace(b"warble ", b""))
+
+        res = self.client.get("/api/v1/users/602?fields=username,messages_count,following")
+        self.assertEqual(res.get_json(), {"username": "writer", "messages_count": PAGE_SIZE + 5,
+                                          "following": False})
+
+        res = self.client.get("/api/v1/messages/7001?fields=id,password")
+        self.assertEqual(res.status_code, 400)
+        self.assertIn("password", res.get_json()["error"])
+
+    def test_likes_and_message(self):
+        """Test the likes list, single messages and 404s"""
+
+        likes = self.client.get("/api/v1/users/601/likes").get_json()
+        self.assertEqual([m["id"] for m in likes["messages"]], [7003])
+
+        msg = self.client.get("/api/v1/messages/7003").get_json()
+        self.assertEqual(msg["text"], "warble 3")
+
+        res = self.client.get("/api/v1/messages/1")
+        self.assertEqual(res.status_code, 404)
+        self.assertIn("error", res.get_json())
+
+    def test_not_modified(self):
+        """Test that polling an unchanged resource gets a 304"""
+
+        res = self.client.get("/api/v1/users/602")
+        etag = res.headers["ETag"]
+
+        res = self.client.get("/api/v1/users/602", headers={"If-None-Match": etag})
+        self.assertEqual(res.status_code, 304)
+
+        User.query.get(602).bio = "now with a bio"
+        db.session.commit()
+
+        res = self.client.get("/api/v1/users/602", headers={"If-None-Match": etag})
+        self.assertEqual(res.status_code, 200)
@@ -0,0 +1,107 @@
+"""Static asset pipeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_assets.py
+
+
+import gzip
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+import brotli
+
+from app import create_app
+from assets import build
+
+app = create_app('test')
+assets = app.extensions['assets']
+
+
+class AssetsTestCase(TestCase):
+    """Test building and serving fingerprinted assets."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.static = self.tmp.name
+
+        os.makedirs(os.path.join(self.static, 'images'))
+        os.makedirs(os.path.join(self.static, 'stylesheets'))
+        with open(os.path.join(self.static, 'images', 'bg.png'), 'wb') as f:
+            f.write(b'\x89PNG not really')
+        with open(os.path.join(self.static, 'stylesheets', 'site.css'), 'w') as f:
+            f.write('body { background: url("/static/images/bg.png"); }\n' * 50)
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        assets.load(os.path.join(app.static_folder, 'dist'))
+        self.tmp.cleanup()
+
+    def test_build(self):
+        """Test that assets get hashed names, compressed copies and rewritten urls"""
+
+        manifest = build(self.static)
+        dist = os.path.join(self.static, 'dist')
+
+        self.assertRegex(manifest['images/bg.png'], r'^images/bg\.[0-9a-f]{12}\.png$')
+        self.assertRegex(manifest['stylesheets/site.css'], r'^stylesheets/site\.[0-9a-f]{12}\.css$')
+
+        with open(os.path.join(dist, 'manifest.json')) as f:
+            self.assertEqual(json.load(f), manifest)
+
+        css = os.path.join(dist, manifest['stylesheets/site.css'])
+        with gzip.open(css + '.gz') as f:
+            self.assertIn(f'/assets/{manifest["images/bg.png"]}', f.read().decode())
+
+        with open(css + '.br', 'rb') as f:
+            self.assertIn(b'background', brotli.decompress(f.read()))
+
+        # too small to be worth compressing
+        self.assertFalse(os.path.exists(os.path.join(dist, manifest['images/bg.png']) + '.gz'))
+        self.assertFalse(os.path.exists(os.path.join(dist, manifest['images/bg.png']) + '.br'))
+
+        # rebuilding unchanged files gives the same names
+        self.assertEqual(build(self.static), manifest)
+
+    def test_serve(self):
+        """Test that built assets are served immutable, compressed when accepted"""
+
+        manifest = build(self.static)
+        assets.load(os.path.join(self.static, 'dist'))
+
+        with app.test_request_context():
+            url = assets.url('stylesheets/site.css')
+            self.assertEqual(url, f'/assets/{manifest["stylesheets/site.css"]}')
+            self.assertEqual(assets.url('/static/images/bg.png'), f'/assets/{manifest["images/bg.png"]}')
+            self.assertEqual(assets.url('http://example.com/me.png'), 'http://example.com/me.png')
+
+        res = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertIn('immutable', res.headers['Cache-Control'])
+        self.assertEqual(res.mimetype, 'text/css')
+        self.assertIn(b'background', gzip.decompress(res.data))
+
+        res = self.client.get(url, headers={'Accept-Encoding': 'gzip, br'})
+        self.assertEqual(res.headers['Content-Encoding'], 'br')
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+        self.assertIn(b'background', brotli.decompress(res.data))
+
+        res = self.client.get(url)
+        self.assertNotIn('Content-Encoding', res.headers)
+        self.assertIn(b'background', res.data)
+
+        res = self.client.get('/assets/stylesheets/site.css')
+        self.assertEqual(res.status_code, 404)
+
+    def test_unbuilt(self):
+        """Test that without a build, assets come from /static"""
+
+        assets.load(os.path.join(self.static, 'dist'))
+
+        with app.test_request_context():
+            self.assertEqual(assets.url('stylesheets/site.css'), '/static/stylesheets/site.css')
+            self.assertEqual(assets.url('/static/images/bg.png'), '/static/images/bg.png')
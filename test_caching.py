@@ -0,0 +1,68 @@
+"""Cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_caching.py
+
+
+from unittest import TestCase
+
+from caching import TTLCache
+
+
+class FakeClock:
+    """Clock the tests can move forward by hand."""
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TTLCacheTestCase(TestCase):
+    """Test the LRU + TTL cache."""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = TTLCache(maxsize=2, ttl=10, clock=self.clock)
+
+    def test_get_set(self):
+        """Test that stored values come back until deleted"""
+
+        self.cache.set("a", 1)
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertIsNone(self.cache.get("b"))
+
+        self.cache.delete("a")
+        self.assertIsNone(self.cache.get("a"))
+
+    def test_expiry(self):
+        """Test that values expire after the ttl"""
+
+        self.cache.set("a", 1)
+        self.clock.now = 9
+        self.assertEqual(self.cache.get("a"), 1)
+
+        self.clock.now = 10
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_lru_eviction(self):
+        """Test that the least recently used entry is evicted first"""
+
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("c"), 3)
+
+    def test_disabled(self):
+        """Test that a zero ttl caches nothing"""
+
+        cache = TTLCache(maxsize=2, ttl=0)
+        cache.set("a", 1)
+        self.assertIsNone(cache.get("a"))
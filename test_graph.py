@@ -0,0 +1,130 @@
+"""Follow graph and who-to-follow tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_graph.py
+
+
+from unittest import TestCase
+
+from models import db, Follows, User
+
+from app import create_app
+from graph import FollowGraph
+from views import CURR_USER_KEY
+
+app = create_app('test', WHO_TO_FOLLOW=True)
+
+db.create_all()
+
+# 1 follows 2 and 3; 2 and 3 both follow 4; 5 follows 1 and 6
+EDGES = [(1, 2), (1, 3), (2, 4), (3, 4), (3, 6), (5, 1), (5, 6), (6, 4)]
+
+
+class FollowGraphTestCase(TestCase):
+    """Test the arrays, their overlay and the suggestions they give."""
+
+    def setUp(self):
+        self.graph = FollowGraph(*zip(*EDGES))
+
+    def test_neighbours(self):
+        """Test reading who follows whom back out of the arrays"""
+
+        self.assertEqual(list(self.graph.following_of(1)), [2, 3])
+        self.assertEqual(list(self.graph.followers_of(4)), [2, 3, 6])
+        self.assertEqual(list(self.graph.following_of(99)), [])
+
+    def test_suggest(self):
+        """Test scoring friends of friends above common followers"""
+
+        # 4 through 2 and 3; 6 through 3, and as followed by follower 5
+        self.assertEqual(self.graph.suggest(1), [4, 6])
+        # following nobody: the most followed accounts
+        self.assertEqual(self.graph.suggest(99, limit=2), [4, 6])
+
+    def test_changes(self):
+        """Test that follows and unfollows apply at once, and compact"""
+
+        self.graph.follow(1, 4)
+        self.graph.follow(1, 4)
+        self.graph.unfollow(1, 2)
+        self.graph.follow(7, 1)
+
+        self.assertEqual(list(self.graph.following_of(1)), [3, 4])
+        self.assertEqual(list(self.graph.followers_of(1)), [5, 7])
+        self.assertEqual(self.graph.suggest(1), [6])
+        self.assertEqual(len(self.graph), len(EDGES) + 1)
+
+        compacted = self.graph.compacted()
+        self.assertEqual(len(compacted), len(self.graph))
+        for user_id in range(1, 8):
+            self.assertEqual(list(compacted.following_of(user_id)),
+                             list(self.graph.following_of(user_id)))
+            self.assertEqual(list(compacted.followers_of(user_id)),
+                             list(self.graph.followers_of(user_id)))
+        self.assertEqual(compacted.suggest(1), [6])
+
+
+class WhoToFollowTestCase(TestCase):
+    """Test suggestions on the home page."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        db.session.add_all([
+            User(id=user_id, username=f"user{user_id}",
+                 email=f"user{user_id}@test.com", password="x")
+            for user_id in range(1, 7)
+        ])
+        db.session.flush()
+        db.session.add_all([
+            Follows(user_following_id=follower, user_being_followed_id=followed)
+            for follower, followed in EDGES
+        ])
+        db.session.commit()
+        # the next session is made for (and bound to) this module's app
+        db.session.remove()
+
+        with app.app_context():
+            app.extensions['graph'].load()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = 1
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def suggested(self):
+        html = self.client.get('/').get_data(as_text=True)
+        section = html.partition('id="who-to-follow"')[2]
+        return [user_id for user_id in range(1, 7)
+                if f'action="/users/follow/{user_id}"' in section]
+
+    def test_home_page(self):
+        """Test that the home page suggests, and follows update the graph"""
+
+        self.assertEqual(self.suggested(), [4, 6])
+
+        self.client.post('/users/follow/4')
+        self.assertEqual(self.suggested(), [6])
+
+        with app.app_context():
+            User.query.get(6).deleted_at = db.func.now()
+            db.session.commit()
+        self.assertEqual(self.suggested(), [])
+
+    def test_followed_elsewhere(self):
+        """Test that follows the graph hasn't seen yet still hide suggestions"""
+
+        self.assertEqual(self.suggested(), [4, 6])
+
+        # as another process would, unseen by this one's graph
+        with app.app_context():
+            db.session.execute(Follows.__table__.insert(),
+                               dict(user_following_id=1,
+                                    user_being_followed_id=4))
+            db.session.commit()
+
+        self.assertEqual(self.suggested(), [6])
@@ -0,0 +1,70 @@
+"""Password hashing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_hashing.py
+
+
+from threading import Event, Thread
+from unittest import TestCase
+
+from flask import Flask
+
+from hashing import PasswordHasher, HashingBusy
+
+
+class PasswordHasherTestCase(TestCase):
+    """Test the bounded bcrypt pool."""
+
+    def make_hasher(self, **config):
+        app = Flask(__name__)
+        app.config['BCRYPT_LOG_ROUNDS'] = 4
+        app.config.update(config)
+        hasher = PasswordHasher(app)
+        self.addCleanup(hasher.shutdown)
+        return hasher
+
+    def test_hash_and_check(self):
+        """Test that hashes are made at the configured cost and verify"""
+
+        hasher = self.make_hasher(PASSWORD_HASH_WORKERS=2)
+        pw_hash = hasher.generate_password_hash("hunter22")
+
+        self.assertTrue(pw_hash.startswith("$2b$04$"))
+        self.assertTrue(hasher.check_password_hash(pw_hash, "hunter22"))
+        self.assertFalse(hasher.check_password_hash(pw_hash, "hunter23"))
+        self.assertFalse(hasher.check_password_hash("HASHED_PASSWORD", "hunter22"))
+        self.assertFalse(hasher.needs_rehash(pw_hash))
+
+        hasher.rounds = 5
+        self.assertTrue(hasher.needs_rehash(pw_hash))
+
+    def test_inline(self):
+        """Test that zero workers hashes on the calling thread"""
+
+        hasher = self.make_hasher(PASSWORD_HASH_WORKERS=0)
+        pw_hash = hasher.generate_password_hash("hunter22")
+
+        self.assertIsNone(hasher._executor)
+        self.assertTrue(hasher.check_password_hash(pw_hash, "hunter22"))
+
+    def test_busy(self):
+        """Test that callers are turned away once the queue is full"""
+
+        hasher = self.make_hasher(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_QUEUE=1)
+        started, release = Event(), Event()
+
+        def block():
+            started.set()
+            release.wait()
+
+        waiting = Thread(target=hasher._run, args=(block,))
+        waiting.start()
+        started.wait()
+
+        with self.assertRaises(HashingBusy):
+            hasher.generate_password_hash("hunter22")
+
+        release.set()
+        waiting.join()
+        self.assertTrue(hasher.generate_password_hash("hunter22").startswith("$2b$04$"))
@@ -0,0 +1,234 @@
+"""Background job tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_jobs.py
+
+
+import json
+import time
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, Follows, Likes, Message, Timeline, User
+
+from app import create_app
+from jobs import Job, task
+import tasks
+from views import CURR_USER_KEY
+
+# jobs wait in the table here, unlike the rest of the suite's
+app = create_app('test', JOBS_EAGER=False, JOBS_WORKERS=0,
+                 JOBS_RETRY_SECONDS=60, JOBS_MAX_ATTEMPTS=2)
+queue = app.extensions['jobs']
+
+db.create_all()
+
+CALLS = []
+
+
+@task
+def flaky(fail):
+    CALLS.append(fail)
+    if fail:
+        raise ValueError("not this time")
+
+
+class JobQueueTestCase(TestCase):
+    """Test deferring work, retrying it and handing it out to workers."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        db.session.add_all([
+            User(id=901, username="poster", email="poster@test.com",
+                 password="x"),
+            User(id=902, username="reader", email="reader@test.com",
+                 password="x"),
+        ])
+        db.session.flush()
+        db.session.add(Follows(user_being_followed_id=901,
+                               user_following_id=902))
+        db.session.commit()
+        # the next session is made for (and bound to) this module's app
+        db.session.remove()
+
+        CALLS.clear()
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = 901
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def timeline(self, user_id):
+        return {row.message_id
+                for row in Timeline.query.filter_by(user_id=user_id)}
+
+    def test_fan_out_after_response(self):
+        """Test that followers get a new message once its job runs"""
+
+        resp = self.client.post('/messages/new', data={"text": "later"})
+        self.assertEqual(resp.status_code, 302)
+
+        with app.app_context():
+            msg = Message.query.filter_by(text="later").one()
+            self.assertEqual(self.timeline(901), {msg.id})
+            self.assertEqual(self.timeline(902), set())
+            self.assertEqual(Job.query.count(), 1)
+
+            self.assertEqual(queue.run_pending(), 1)
+            self.assertEqual(self.timeline(902), {msg.id})
+            self.assertEqual(Job.query.count(), 0)
+
+            # a second run (say, after a lost lease) changes nothing
+            tasks.fan_out(message_id=msg.id)
+            self.assertEqual(Timeline.query.filter_by(user_id=902).count(), 1)
+
+    def test_unfollow_before_backfill(self):
+        """Test that a backfill for a follow since undone does nothing"""
+
+        with app.app_context():
+            db.session.add(Message(id=91, text="old", user_id=902))
+            db.session.commit()
+
+        self.client.post('/users/follow/902')
+        self.client.post('/users/stop-following/902')
+
+        with app.app_context():
+            self.assertEqual(queue.run_pending(), 2)
+            self.assertEqual(self.timeline(901), set())
+
+    def test_purge_in_batches(self):
+        """Test that a deleted account is purged a batch per job"""
+
+        with app.app_context():
+            db.session.add_all([Message(id=9100 + i, text=f"m{i}", user_id=901)
+                                for i in range(5)])
+            db.session.add_all([Likes(user_id=902, message_id=9100 + i)
+                                for i in range(3)])
+            db.session.commit()
+            db.session.add(Message(id=9200, text="reply", user_id=902))
+            db.session.add(Likes(user_id=901, message_id=9200))
+            db.session.commit()
+
+        batch, tasks.PURGE_BATCH = tasks.PURGE_BATCH, 2
+        try:
+            self.client.post('/users/delete')
+
+            with app.app_context():
+                self.assertIsNotNone(User.query.get(901).deleted_at)
+                self.assertEqual(Message.query.filter_by(user_id=901).count(), 5)
+
+                self.assertEqual(queue.run_next(), True)
+                job = Job.query.one()
+                self.assertEqual(json.loads(job.args)["purged"],
+                                 {"likes given": 1})
+
+                queue.run_pending()
+                self.assertIsNone(User.query.get(901))
+                self.assertEqual(Message.query.count(), 1)
+                self.assertEqual(Likes.query.count(), 0)
+                self.assertEqual(Follows.query.count(), 0)
+
+                reader = User.query.get(902)
+                self.assertEqual(
+                    (reader.following_count, reader.likes_count), (0, 0))
+        finally:
+            tasks.PURGE_BATCH = batch
+
+    def test_hidden_before_purge(self):
+        """Test that a deleted account is gone from every page at once"""
+
+        with app.app_context():
+            db.session.add(Message(id=9300, text="hidden warble", user_id=901))
+            db.session.commit()
+            Timeline.rebuild()
+            db.session.commit()
+
+        self.client.post('/users/delete')
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = 902
+
+        # the purge hasn't run; 902 still follows 901's rows
+        with app.app_context():
+            self.assertEqual(Message.query.filter_by(user_id=901).count(), 1)
+            self.assertEqual(Follows.query.count(), 1)
+
+        self.assertEqual(
+            self.client.get('/api/v1/messages/9300').status_code, 404)
+        timeline = self.client.get('/api/v1/timeline').get_json()
+        self.assertEqual(timeline["messages"], [])
+        self.assertNotIn("hidden warble",
+                         self.client.get('/').get_data(as_text=True))
+        self.assertNotIn("hidden warble", self.client.get(
+            '/messages/search?q=hidden').get_data(as_text=True))
+        self.assertNotIn("@poster", self.client.get(
+            '/users/902/following').get_data(as_text=True))
+        self.assertEqual(
+            self.client.post('/messages/9300/like').status_code, 404)
+
+    def test_retry_then_give_up(self):
+        """Test that failing jobs back off, then are kept as failed"""
+
+        with app.app_context():
+            flaky.delay(fail=True)
+            db.session.commit()
+
+            self.assertEqual(queue.run_pending(), 1)
+            job = Job.query.one()
+            self.assertEqual(job.attempts, 1)
+            self.assertIn("not this time", job.last_error)
+            self.assertGreater(job.run_at,
+                               datetime.utcnow() + timedelta(seconds=50))
+            self.assertIsNone(queue.claim())
+
+            job.run_at = datetime.utcnow()
+            db.session.commit()
+
+            self.assertEqual(queue.run_pending(), 1)
+            job = Job.query.one()
+            self.assertEqual(job.attempts, 2)
+            self.assertIsNotNone(job.failed_at)
+            self.assertEqual(queue.run_pending(), 0)
+            self.assertEqual(CALLS, [True, True])
+
+    def test_lease(self):
+        """Test that a claimed job is only handed out again if its lease ends"""
+
+        with app.app_context():
+            flaky.delay(fail=False)
+            db.session.commit()
+
+            job = queue.claim()
+            self.assertEqual(json.loads(job.args), {"fail": False})
+            self.assertIsNone(queue.claim())
+
+            # its worker died without finishing it
+            job.run_at = datetime.utcnow() - timedelta(seconds=1)
+            db.session.commit()
+
+            self.assertEqual(queue.run_pending(), 1)
+            self.assertEqual(CALLS, [False])
+            self.assertEqual(Job.query.count(), 0)
+
+    def test_worker_threads(self):
+        """Test that worker threads pick up jobs as they're committed"""
+
+        app.config['JOBS_WORKERS'] = 1
+        try:
+            queue.start()
+
+            self.client.post('/messages/new', data={"text": "soon"})
+
+            with app.app_context():
+                for _ in range(50):
+                    if self.timeline(902):
+                        break
+                    db.session.rollback()
+                    time.sleep(0.1)
+                self.assertEqual(len(self.timeline(902)), 1)
+        finally:
+            queue.stop()
+            app.config['JOBS_WORKERS'] = 0
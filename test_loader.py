@@ -0,0 +1,107 @@
+"""Bulk loader tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_loader.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Timeline
+
+from app import create_app
+import loader
+import migrations
+
+app = create_app('test')
+
+db.create_all()
+
+USERS = 'email,username,image_url,password,bio,header_image_url,location\n' + (
+    ''.join(f'u{i}@test.com,user{i},/static/images/default-pic.png,x,'
+            f'"bio, line one\nline two",,Here\n' for i in range(1, 21)))
+
+MESSAGES = 'text,timestamp,user_id\n' + ''.join(
+    f'warble {i},2020-01-{i % 28 + 1:02} 10:00:00,{i % 20 + 1}\n'
+    for i in range(1, 101))
+
+FOLLOWS = 'user_being_followed_id,user_following_id\n' + ''.join(
+    f'{i},{i % 20 + 1}\n' for i in range(1, 21))
+
+
+class Interrupted(Exception):
+    pass
+
+
+class LoaderTestCase(TestCase):
+    """Test loading CSV datasets."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+        for name, contents in [('users.csv', USERS),
+                               ('messages.csv', MESSAGES),
+                               ('follows.csv', FOLLOWS)]:
+            with open(os.path.join(self.directory.name, name), 'w') as out:
+                out.write(contents)
+
+    def tearDown(self):
+        db.session.rollback()
+        self.directory.cleanup()
+
+    def check_loaded(self):
+        self.assertEqual(User.query.count(), 20)
+        self.assertEqual(Message.query.count(), 100)
+        self.assertEqual(Follows.query.count(), 20)
+
+        # numbered in file order, quoted newlines kept
+        user = User.query.get(3)
+        self.assertEqual(user.username, 'user3')
+        self.assertEqual(user.bio, 'bio, line one\nline two')
+        self.assertEqual(user.messages_count, 5)
+        self.assertEqual(user.followers_count, 1)
+
+        # user 3 sees their own 5 messages and user 2's
+        self.assertEqual(Timeline.query.filter_by(user_id=3).count(), 10)
+
+        # indexes rebuilt, progress tables gone
+        ok = [result[2] for result in migrations.verify()]
+        self.assertTrue(all(ok))
+        with db.engine.connect() as connection:
+            self.assertFalse(db.engine.dialect.has_table(
+                connection, loader.load_chunks.name))
+
+    def test_load(self):
+        """Test loading a dataset in many small chunks"""
+
+        loaded = loader.load(self.directory.name, chunk_size=200,
+                             reset=True, report=lambda line: None)
+
+        self.assertEqual(loaded, {'users': 20, 'messages': 100,
+                                  'follows': 20})
+        self.check_loaded()
+
+    def test_resume(self):
+        """Test finishing an interrupted load without duplicating rows"""
+
+        lines = []
+
+        def interrupt(line):
+            lines.append(line)
+            if line.startswith('messages.csv') and len(lines) > 5:
+                raise Interrupted()
+
+        with self.assertRaises(Interrupted):
+            loader.load(self.directory.name, chunk_size=200, reset=True,
+                        report=interrupt)
+
+        with self.assertRaises(loader.LoadError):
+            loader.load(self.directory.name, chunk_size=200,
+                        report=lambda line: None)
+
+        loader.load(self.directory.name, chunk_size=200, resume=True,
+                    report=lambda line: None)
+
+        self.check_loaded()
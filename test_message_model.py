@@ -4,19 +4,12 @@
 #
 #    FLASK_ENV=production python -m unittest test_message_views.py
 
-import os
 from unittest import TestCase
 from models import db, connect_db, Message, User, Follows, Likes
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
+from app import create_app
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
-
-# Now we can import app
-from app import app, CURR_USER_KEY
+app = create_app('test')
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
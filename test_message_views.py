@@ -5,22 +5,15 @@
 #    FLASK_ENV=production python -m unittest test_message_views.py
 
 
-import os
+from datetime import datetime
 from unittest import TestCase
 
-from models import db, connect_db, Message, User
+from models import db, connect_db, Message, User, Follows, Timeline
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
+from app import create_app
+from views import CURR_USER_KEY, message_fragments
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
-
-
-# Now we can import app
-
-from app import app, CURR_USER_KEY
+app = create_app('test')
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -28,10 +21,6 @@ from app import app, CURR_USER_KEY
 
 db.create_all()
 
-# Don't have WTForms use CSRF at all, since it's a pain to test
-
-app.config['WTF_CSRF_ENABLED'] = False
-
 
 class MessageViewTestCase(TestCase):
     """Test views for messages."""
@@ -188,4 +177,146 @@ class MessageViewTestCase(TestCase):
         with self.client as client:
             res = client.post("/messages/7546342/delete", follow_redirects=True)
             self.assertEqual(res.status_code, 200)
-            self.assertIn("Access unauthorized", str(res.data))
\ No newline at end of file
+            self.assertIn("Access unauthorized", str(res.data))
+
+
+    def test_add_message_fans_out(self):
+        """Test that a new message lands on the author's and followers' timelines"""
+
+        follower = User.signup(username="follower", email="follower@test.com", password="followerpass", image_url=None)
+        follower.id = 9182
+        db.session.add(Follows(user_being_followed_id=self.testuser_id, user_following_id=9182))
+        db.session.commit()
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser_id
+
+            client.post("/messages/new", data={"text": "fanned out warble"})
+
+            msg = Message.query.one()
+            owners = {entry.user_id for entry in Timeline.query.filter_by(message_id=msg.id)}
+            self.assertEqual(owners, {self.testuser_id, 9182})
+
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = 9182
+
+            res = client.get("/")
+            self.assertIn("fanned out warble", str(res.data))
+
+
+    def test_message_delete_removes_from_timelines(self):
+        """Test that deleting a message also removes it from timelines"""
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser_id
+
+            client.post("/messages/new", data={"text": "short lived"})
+            msg = Message.query.one()
+
+            client.post(f"/messages/{msg.id}/delete")
+
+            self.assertEqual(Timeline.query.count(), 0)
+
+
+    def test_search_messages(self):
+        """Test that message search finds every word, newest first"""
+
+        db.session.add_all([
+            Message(id=1001, text="Morning coffee on the porch", user_id=self.testuser_id),
+            Message(id=1002, text="Coffee again, the porch is sunny", user_id=self.testuser_id),
+            Message(id=1003, text="Tea this time", user_id=self.testuser_id),
+        ])
+        db.session.commit()
+
+        with self.client as client:
+            res = client.get("/messages/search?q=porch+coffee")
+            html = res.get_data(as_text=True)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertIn("Morning coffee", html)
+            self.assertIn("Coffee again", html)
+            self.assertNotIn("Tea this time", html)
+            self.assertLess(html.index("Coffee again"), html.index("Morning coffee"))
+
+            res = client.get("/messages/search?q=lemonade")
+            self.assertIn("no warbles found", res.get_data(as_text=True))
+
+
+    def test_message_fragments_cached(self):
+        """Test that message items are cached until their author changes"""
+
+        author = User.signup(username="author", email="author@test.com", password="authorpass", image_url=None)
+        author.id = 9300
+        msg = Message(id=9301, text="cache me", user_id=9300)
+        db.session.add_all([author, msg, Follows(user_being_followed_id=9300, user_following_id=self.testuser_id)])
+        db.session.commit()
+        Timeline.rebuild()
+        db.session.commit()
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser_id
+
+            self.assertIn("@author", client.get("/").get_data(as_text=True))
+            self.assertIsNotNone(message_fragments.get(9301))
+
+            # the like button stays per viewer
+            client.post("/messages/9301/like")
+            html = client.get("/").get_data(as_text=True)
+            self.assertIn("btn-primary", html)
+
+            User.query.get(9300).username = "renamed"
+            db.session.commit()
+
+            html = client.get("/").get_data(as_text=True)
+            self.assertIn("@renamed", html)
+            self.assertNotIn("@author", html)
+
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = 9300
+
+            client.post("/messages/9301/delete")
+            self.assertIsNone(message_fragments.get(9301))
+
+
+    def test_show_message_conditional_get(self):
+        """Test that a message page revalidates with its ETag"""
+
+        db.session.add(Message(id=9401, text="etag me", user_id=self.testuser_id))
+        db.session.commit()
+
+        with self.client as client:
+            res = client.get("/messages/9401")
+            etag = res.headers["ETag"]
+
+            res = client.get("/messages/9401", headers={"If-None-Match": etag})
+            self.assertEqual(res.status_code, 304)
+
+            User.query.get(self.testuser_id).username = "renamed"
+            db.session.commit()
+
+            res = client.get("/messages/9401", headers={"If-None-Match": etag})
+            self.assertEqual(res.status_code, 200)
+            self.assertIn("@renamed", res.get_data(as_text=True))
+
+    def test_show_message_ignores_if_modified_since(self):
+        """Test that a message page can't be revalidated by date alone"""
+
+        db.session.add(Message(id=9402, text="dated", user_id=self.testuser_id,
+                               timestamp=datetime(2021, 3, 4, 5, 6, 7)))
+        db.session.commit()
+
+        with self.client as client:
+            res = client.get("/messages/9402")
+            self.assertNotIn("Last-Modified", res.headers)
+
+            # the author's name is on the page, but dates nothing
+            User.query.get(self.testuser_id).username = "renamed"
+            db.session.commit()
+
+            res = client.get("/messages/9402", headers={
+                "If-Modified-Since": "Thu, 04 Mar 2021 05:06:07 GMT"})
+            self.assertEqual(res.status_code, 200)
+            self.assertIn("@renamed", res.get_data(as_text=True))
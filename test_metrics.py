@@ -0,0 +1,125 @@
+"""Request metrics tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_metrics.py
+
+
+import re
+from unittest import TestCase
+
+from flask import g
+from sqlalchemy import exc
+
+from models import db, Message, User
+
+from app import create_app
+from views import CURR_USER_KEY
+
+app = create_app('test')
+metrics = app.extensions['metrics']
+
+db.create_all()
+
+
+class MetricsTestCase(TestCase):
+    """Test Server-Timing headers and the /metrics endpoint."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        user = User(id=701, username="timed", email="timed@test.com",
+                    password="x")
+        db.session.add(user)
+        db.session.add_all([Message(text=f"warble {i}", user_id=701)
+                            for i in range(3)])
+        db.session.commit()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = 701
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['METRICS_TOKEN'] = None
+        app.config['METRICS_PUBLIC'] = True
+
+    def sample(self, text, name, **labels):
+        selector = ','.join(f'{key}="{value}"'
+                            for key, value in labels.items())
+        series = re.escape(f'{name}{{{selector}}}')
+        match = re.search(rf'^{series} (\S+)$', text, re.M)
+        return match and float(match[1])
+
+    def test_server_timing(self):
+        """Test that responses report their queries and timings"""
+
+        resp = self.client.get('/users/701')
+        timing = resp.headers['Server-Timing']
+
+        queries = int(re.search(r'desc="(\d+) queries"', timing)[1])
+        self.assertGreater(queries, 0)
+        self.assertIn('render;dur=', timing)
+        self.assertIn('app;dur=', timing)
+
+    def test_histograms(self):
+        """Test that /metrics counts requests and their queries per endpoint"""
+
+        before = metrics.render()
+        labels = dict(endpoint='views.users_show')
+        queries_before = self.sample(
+            before, 'warbler_request_queries_count', **labels) or 0
+        requests_before = self.sample(
+            before, 'warbler_requests_total', **labels, status=200) or 0
+
+        for _ in range(2):
+            self.client.get('/users/701')
+
+        text = self.client.get('/metrics').get_data(as_text=True)
+
+        self.assertIn('# TYPE warbler_request_queries histogram', text)
+        self.assertEqual(self.sample(
+            text, 'warbler_request_queries_count', **labels),
+            queries_before + 2)
+        self.assertEqual(self.sample(
+            text, 'warbler_requests_total', **labels, status=200),
+            requests_before + 2)
+        self.assertIsNotNone(self.sample(
+            text, 'warbler_request_db_seconds_bucket',
+            endpoint='views.users_show', le='+Inf'))
+
+    def test_token(self):
+        """Test that /metrics needs the token when one is set"""
+
+        app.config['METRICS_TOKEN'] = "s3cret"
+
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        resp = self.client.get(
+            '/metrics', headers={'Authorization': 'Bearer s3cret'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Cache-Control'], 'no-store')
+
+    def test_private(self):
+        """Test that /metrics isn't served without a token unless public"""
+
+        app.config['METRICS_PUBLIC'] = False
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+        app.config['METRICS_TOKEN'] = "s3cret"
+        resp = self.client.get(
+            '/metrics', headers={'Authorization': 'Bearer s3cret'})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_failed_statement(self):
+        """Test that a statement that raises is counted and cleaned up"""
+
+        with app.test_request_context():
+            metrics._start()
+
+            with self.assertRaises(exc.DBAPIError):
+                db.session.execute("SELECT * FROM no_such_table")
+            db.session.rollback()
+            db.session.execute("SELECT 1")
+
+            self.assertEqual(g._request_stats.queries, 2)
@@ -0,0 +1,151 @@
+"""Schema migration tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_migrations.py
+
+
+from unittest import TestCase
+
+from models import db, User, Message, Likes
+from sqlalchemy import exc
+
+from app import create_app
+import migrations
+from views import CURR_USER_KEY
+
+app = create_app('test')
+
+db.create_all()
+
+NEW_INDEXES = ['ix_messages_user_id_timestamp', 'ix_follows_user_following_id',
+               'uq_likes_user_id_message_id', 'ix_likes_message_id']
+
+# the tables as they were before any migration
+BASELINE_SCHEMA = [
+    """CREATE TABLE users (
+        id INTEGER NOT NULL PRIMARY KEY,
+        email TEXT NOT NULL UNIQUE,
+        username TEXT NOT NULL UNIQUE,
+        image_url TEXT,
+        header_image_url TEXT,
+        bio TEXT,
+        location TEXT,
+        password TEXT NOT NULL
+    )""",
+    """CREATE TABLE follows (
+        user_being_followed_id INTEGER NOT NULL
+            REFERENCES users (id) ON DELETE cascade,
+        user_following_id INTEGER NOT NULL
+            REFERENCES users (id) ON DELETE cascade,
+        PRIMARY KEY (user_being_followed_id, user_following_id)
+    )""",
+    """CREATE TABLE messages (
+        id INTEGER NOT NULL PRIMARY KEY,
+        text VARCHAR(140) NOT NULL,
+        timestamp DATETIME NOT NULL,
+        user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE
+    )""",
+    """CREATE TABLE likes (
+        id INTEGER NOT NULL PRIMARY KEY,
+        user_id INTEGER REFERENCES users (id) ON DELETE cascade,
+        message_id INTEGER UNIQUE REFERENCES messages (id) ON DELETE cascade
+    )""",
+]
+
+
+class MigrationsTestCase(TestCase):
+    """Test versioned migrations and index verification."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_new_database_is_current(self):
+        """Test that create_all records the latest version"""
+
+        with db.engine.connect() as connection:
+            self.assertEqual(migrations.current_version(connection),
+                             migrations.head())
+            self.assertEqual(migrations.pending(connection), [])
+
+        self.assertEqual(migrations.upgrade(), [])
+
+    def test_upgrade_old_database(self):
+        """Test that upgrade brings an unversioned database up to date"""
+
+        with db.engine.begin() as connection:
+            connection.execute(migrations.schema_version.delete())
+            for index in NEW_INDEXES:
+                connection.execute(f"DROP INDEX {index}")
+
+        self.assertFalse(all(ok for _, _, ok, _ in migrations.verify()))
+
+        applied = migrations.upgrade()
+
+        self.assertEqual([version for version, _, _ in applied],
+                         [version for version, _, _ in migrations.MIGRATIONS])
+        with db.engine.connect() as connection:
+            self.assertEqual(migrations.current_version(connection),
+                             migrations.head())
+
+        for description, index, ok, plan in migrations.verify():
+            self.assertTrue(ok, f"{description} doesn't use {index}:\n{plan}")
+
+    def test_upgrade_baseline_database(self):
+        """Test that upgrade builds the whole schema from the original one"""
+
+        db.drop_all()
+        with db.engine.begin() as connection:
+            for ddl in BASELINE_SCHEMA:
+                connection.execute(ddl)
+            connection.execute(
+                "INSERT INTO users (id, email, username, password) VALUES "
+                "(1, 'reader@test.com', 'reader', 'x'), "
+                "(2, 'writer@test.com', 'writer', 'x')")
+            connection.execute(
+                "INSERT INTO follows VALUES (2, 1)")
+            connection.execute(
+                "INSERT INTO messages VALUES "
+                "(1, 'written before migrations', '2020-01-01 00:00:00', 2)")
+            connection.execute("INSERT INTO likes VALUES (1, 1, 1)")
+
+        migrations.upgrade()
+
+        writer = User.query.get(2)
+        self.assertEqual((writer.messages_count, writer.followers_count),
+                         (1, 1))
+        self.assertEqual(User.query.get(1).likes_count, 1)
+        db.session.rollback()
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session[CURR_USER_KEY] = 1
+
+        for url in ['/', '/users?q=writ', '/messages/search?q=migrations']:
+            resp = client.get(url)
+            self.assertEqual(resp.status_code, 200, url)
+            self.assertIn(b'writer', resp.data, url)
+        self.assertIn(b'written before migrations', client.get('/').data)
+
+    def test_likes_per_user(self):
+        """Test that a message can be liked by many users, once each"""
+
+        author = User(username="author", email="a@test.com", password="x")
+        fans = [User(username=f"fan{i}", email=f"fan{i}@test.com",
+                     password="x") for i in range(2)]
+        msg = Message(text="likeable", user=author)
+        db.session.add_all([author, msg, *fans])
+        db.session.commit()
+
+        db.session.add_all([Likes(user_id=fan.id, message_id=msg.id)
+                            for fan in fans])
+        db.session.commit()
+        self.assertEqual(Likes.query.filter_by(message_id=msg.id).count(), 2)
+
+        db.session.add(Likes(user_id=fans[0].id, message_id=msg.id))
+        with self.assertRaises(exc.IntegrityError):
+            db.session.commit()
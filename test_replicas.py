@@ -0,0 +1,94 @@
+"""Read replica routing tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_replicas.py
+
+
+import time
+from unittest import TestCase
+
+from flask import session
+
+from models import db, Message, User
+
+from replicas import PIN_KEY
+from app import create_app
+from views import CURR_USER_KEY
+
+app = create_app('test')
+
+db.create_all()
+
+
+class ReplicaRoutingTestCase(TestCase):
+    """Test which database each query goes to."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        db.session.add(User(id=801, username="writer",
+                            email="writer@test.com", password="x"))
+        db.session.commit()
+        # the next session is made for (and bound to) this module's app
+        db.session.remove()
+
+        # the test database stands in for a replica of itself; what
+        # matters is which engine is picked
+        app.config['SQLALCHEMY_REPLICA_URIS'] = [
+            app.config['SQLALCHEMY_DATABASE_URI']]
+        self.replica = db.replica_engines(app)[0]
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['SQLALCHEMY_REPLICA_URIS'] = []
+
+    def test_reads_and_writes(self):
+        """Test that GET reads use the replica and writes the primary"""
+
+        with app.test_request_context('/users/801'):
+            self.assertIs(db.session.get_bind(User.__mapper__), self.replica)
+            self.assertEqual(User.query.get(801).username, "writer")
+
+            db.session.add(Message(text="new", user_id=801))
+            db.session.flush()
+
+            # the rest of the request stays with its writes
+            self.assertIs(db.session.get_bind(User.__mapper__), db.engine)
+            self.assertGreater(session[PIN_KEY], time.time())
+            db.session.rollback()
+
+        with app.test_request_context('/messages/new', method='POST'):
+            self.assertIs(db.session.get_bind(User.__mapper__), db.engine)
+
+    def test_outside_requests(self):
+        """Test that commands and scripts use the primary"""
+
+        with app.app_context():
+            self.assertIs(db.session.get_bind(User.__mapper__), db.engine)
+
+    def test_pinned_after_write(self):
+        """Test that a user who just posted reads from the primary"""
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 801
+
+        resp = client.post('/messages/new', data={"text": "read me back"})
+        self.assertEqual(resp.status_code, 302)
+
+        with client.session_transaction() as sess:
+            pinned_until = sess[PIN_KEY]
+        self.assertGreater(pinned_until, time.time())
+
+        with app.test_request_context('/users/801'):
+            session[PIN_KEY] = pinned_until
+            self.assertIs(db.session.get_bind(User.__mapper__), db.engine)
+
+        with app.test_request_context('/users/801'):
+            session[PIN_KEY] = time.time() - 1
+            self.assertIs(db.session.get_bind(User.__mapper__), self.replica)
+
+        resp = client.get('/users/801')
+        self.assertIn("read me back", resp.get_data(as_text=True))
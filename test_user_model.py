@@ -5,23 +5,14 @@
 #    python -m unittest test_user_model.py
 
 
-import os
 from unittest import TestCase
 
-from models import db, User, Message, Follows
+from models import db, hasher, User, Message, Follows, Likes
 from sqlalchemy import exc
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
+from app import create_app
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
-
-
-# Now we can import app
-
-from app import app
+app = create_app('test')
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -110,6 +101,25 @@ class UserModelTestCase(TestCase):
         self.assertTrue(self.user2.is_following(self.user1))
 
 
+    def test_user_following_ids(self):
+        """Test that follow membership is answered from one cached id set"""
+
+        self.assertEqual(self.user2.following_ids(), set())
+        self.assertFalse(self.user2.is_following(self.user1))
+
+        # changing the follows drops the cached set without a commit
+        self.user2.following.append(self.user1)
+        self.assertEqual(self.user2.following_ids(), {self.uid1})
+        self.assertTrue(self.user2.is_following(self.user1))
+
+        db.session.commit()
+        self.assertEqual(self.user1.follower_ids(), {self.uid2})
+
+        self.user2.following.remove(self.user1)
+        self.assertFalse(self.user2.is_following(self.user1))
+        self.assertFalse(self.user1.is_followed_by(self.user2))
+
+
     def test_user_is_followed_by(self):
         """Test the is_followed_by instance method"""
 
@@ -181,6 +191,22 @@ class UserModelTestCase(TestCase):
         self.assertEqual(user.id, self.uid1)
 
 
+    def test_authentication_rehashes(self):
+        """Test that logging in upgrades a hash made at an old work factor"""
+
+        self.assertTrue(self.user1.password.startswith("$2b$12$"))
+
+        hasher.rounds = 4
+        try:
+            user = User.authenticate(self.user1.username, "SUPERSECRETPASSWORD746")
+            db.session.commit()
+        finally:
+            hasher.rounds = 12
+
+        self.assertTrue(User.query.get(self.uid1).password.startswith("$2b$04$"))
+        self.assertEqual(User.authenticate(self.user1.username, "SUPERSECRETPASSWORD746"), user)
+
+
     def test_user_invalid_username(self):
         """Test that false is returned from authenticate method"""
 
@@ -190,4 +216,60 @@ class UserModelTestCase(TestCase):
     def test_user_invalid_password(self):
         """Test that false is reutrned from authenticate"""
 
-        self.assertFalse(User.authenticate(self.user1.username, "wiurnfierfrfe4"))
\ No newline at end of file
+        self.assertFalse(User.authenticate(self.user1.username, "wiurnfierfrfe4"))
+
+
+    def test_user_stat_counters(self):
+        """Test that stat counters follow messages, follows and likes"""
+
+        self.user2.following.append(self.user1)
+        msg = Message(text="counted warble", user_id=self.uid1)
+        db.session.add(msg)
+        db.session.commit()
+
+        db.session.add(Likes(user_id=self.uid2, message_id=msg.id))
+        db.session.commit()
+
+        user1 = User.query.get(self.uid1)
+        user2 = User.query.get(self.uid2)
+        self.assertEqual(user1.messages_count, 1)
+        self.assertEqual(user1.followers_count, 1)
+        self.assertEqual(user2.following_count, 1)
+        self.assertEqual(user2.likes_count, 1)
+
+        # deleting the message takes its like with it
+        db.session.delete(msg)
+        user2.following.remove(user1)
+        db.session.commit()
+
+        user1 = User.query.get(self.uid1)
+        user2 = User.query.get(self.uid2)
+        self.assertEqual(user1.messages_count, 0)
+        self.assertEqual(user1.followers_count, 0)
+        self.assertEqual(user2.following_count, 0)
+        self.assertEqual(user2.likes_count, 0)
+
+
+    def test_recount_stats(self):
+        """Test that recount_stats repairs counters left stale by bulk inserts"""
+
+        db.session.bulk_insert_mappings(Message, [
+            dict(text="bulk one", user_id=self.uid1),
+            dict(text="bulk two", user_id=self.uid1),
+        ])
+        db.session.bulk_insert_mappings(Follows, [
+            dict(user_being_followed_id=self.uid1, user_following_id=self.uid2),
+        ])
+        db.session.commit()
+
+        self.assertEqual(User.query.get(self.uid1).messages_count, 0)
+
+        User.recount_stats()
+        db.session.commit()
+
+        user1 = User.query.get(self.uid1)
+        user2 = User.query.get(self.uid2)
+        self.assertEqual(user1.messages_count, 2)
+        self.assertEqual(user1.followers_count, 1)
+        self.assertEqual(user2.following_count, 1)
+        self.assertEqual(user2.likes_count, 0)
@@ -5,23 +5,17 @@
 #    FLASK_ENV=production python -m unittest test_user_views.py
 
 
-import os
+from datetime import datetime, timedelta
 from unittest import TestCase
 
-from models import db, connect_db, Message, User, Likes, Follows
+from models import db, connect_db, Message, User, Likes, Follows, Timeline
 from bs4 import BeautifulSoup
+from sqlalchemy import event
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
+from app import create_app
+from views import CURR_USER_KEY, current_users
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
-
-
-# Now we can import app
-
-from app import app, CURR_USER_KEY
+app = create_app('test')
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -29,10 +23,6 @@ from app import app, CURR_USER_KEY
 
 db.create_all()
 
-# Don't have WTForms use CSRF at all, since it's a pain to test
-
-app.config['WTF_CSRF_ENABLED'] = False
-
 
 class UserViewTestCase(TestCase):
     """Test views for users."""
@@ -118,6 +108,47 @@ class UserViewTestCase(TestCase):
             self.assertNotIn("@emily", str(res2.data))
             self.assertNotIn("@patricia", str(res2.data))
 
+    def test_users_search_ranking(self):
+        """Test that search covers bio and location and ranks username matches first"""
+
+        self.user4.bio = "best friends with carl"
+        self.user3.location = "Carlsbad"
+        db.session.commit()
+
+        with self.client as client:
+            res = client.get("/users?q=carl")
+            bs = BeautifulSoup(res.get_data(as_text=True), 'html.parser')
+
+            usernames = [p.text for p in bs.select(".card-link p")]
+            self.assertEqual(usernames[0], "@carl")
+            self.assertEqual(set(usernames), {"@carl", "@patricia", "@emily"})
+
+    def test_users_list_pagination(self):
+        """Test that the user directory is split into pages"""
+
+        db.session.bulk_insert_mappings(User, [
+            dict(username=f"pager{i}", email=f"pager{i}@test.com", password="HASHED")
+            for i in range(30)
+        ])
+        db.session.commit()
+
+        with self.client as client:
+            res = client.get("/users")
+            bs = BeautifulSoup(res.get_data(as_text=True), 'html.parser')
+
+            self.assertEqual(len(bs.select(".user-card")), 24)
+            self.assertIsNone(bs.find(id="users-prev"))
+            next_link = bs.find(id="users-next")
+            self.assertIsNotNone(next_link)
+
+            res2 = client.get(next_link["href"])
+            bs2 = BeautifulSoup(res2.get_data(as_text=True), 'html.parser')
+
+            # 5 users from setUp plus 30 more
+            self.assertEqual(len(bs2.select(".user-card")), 11)
+            self.assertIsNotNone(bs2.find(id="users-prev"))
+            self.assertIsNone(bs2.find(id="users-next"))
+
     def test_user_show(self):
         """Test that user details are displayed"""
 
@@ -326,4 +357,289 @@ class UserViewTestCase(TestCase):
 
 
 
-            
\ No newline at end of file
+            
+
+    def test_follow_updates_timeline(self):
+        """Test that following backfills the home timeline and unfollowing prunes it"""
+
+        message = Message(text="carl's old warble", user_id=self.user1_id)
+        db.session.add(message)
+        db.session.commit()
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser_id
+
+            res = client.get("/")
+            self.assertNotIn("carl&#39;s old warble", res.get_data(as_text=True))
+
+            client.post(f"/users/follow/{self.user1_id}")
+            res = client.get("/")
+            self.assertIn("carl&#39;s old warble", res.get_data(as_text=True))
+
+            client.post(f"/users/stop-following/{self.user1_id}")
+            res = client.get("/")
+            self.assertNotIn("carl&#39;s old warble", res.get_data(as_text=True))
+            self.assertEqual(Timeline.query.filter_by(user_id=self.testuser_id).count(), 0)
+
+    def test_delete_user(self):
+        """Test that deleting an account removes it and everything it made"""
+
+        db.session.add(Message(id=4001, text="soon gone", user_id=self.testuser_id))
+        db.session.add(Message(id=4002, text="carl's", user_id=self.user1_id))
+        db.session.add(Follows(user_being_followed_id=self.testuser_id,
+                               user_following_id=self.user1_id))
+        db.session.add(Likes(user_id=self.user1_id, message_id=4001))
+        db.session.add(Likes(user_id=self.testuser_id, message_id=4002))
+        db.session.commit()
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser_id
+
+            res = client.post("/users/delete")
+            self.assertEqual(res.location, "http://localhost/signup")
+
+            res = client.get(f"/users/{self.testuser_id}")
+            self.assertEqual(res.status_code, 404)
+            self.assertFalse(User.authenticate("testuser", "testuser"))
+
+        # tests run jobs eagerly, so the purge is done too
+        self.assertIsNone(User.query.get(self.testuser_id))
+        self.assertEqual(Message.query.filter_by(user_id=self.testuser_id).count(), 0)
+        self.assertEqual(Likes.query.count(), 0)
+        self.assertEqual(Follows.query.count(), 0)
+
+        carl = User.query.get(self.user1_id)
+        self.assertEqual((carl.following_count, carl.likes_count), (0, 0))
+
+    def test_user_show_pagination(self):
+        """Test that profile messages page backwards through a cursor"""
+
+        start = datetime(2020, 1, 1)
+        db.session.add_all([
+            Message(text=f"warble number {i}", user_id=self.testuser_id,
+                    timestamp=start + timedelta(minutes=i))
+            for i in range(105)
+        ])
+        db.session.commit()
+
+        with self.client as client:
+            res = client.get(f"/users/{self.testuser_id}")
+            bs = BeautifulSoup(res.get_data(as_text=True), 'html.parser')
+
+            self.assertEqual(len(bs.select("#messages li")), 100)
+            self.assertIn("warble number 104", res.get_data(as_text=True))
+            older = bs.find(id="older-messages")
+            self.assertIsNotNone(older)
+
+            res2 = client.get(f"/users/{self.testuser_id}{older['href']}")
+            bs2 = BeautifulSoup(res2.get_data(as_text=True), 'html.parser')
+
+            texts = [li.p.text for li in bs2.select("#messages li")]
+            self.assertEqual(texts, [f"warble number {i}" for i in range(4, -1, -1)])
+            self.assertIsNone(bs2.find(id="older-messages"))
+
+    def test_user_show_bad_cursor(self):
+        """Test that a malformed cursor is rejected"""
+
+        with self.client as client:
+            res = client.get(f"/users/{self.testuser_id}?before=yesterday")
+            self.assertEqual(res.status_code, 400)
+
+    def count_queries(self, client, url):
+        """Return how many SQL statements rendering `url` runs"""
+
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        # start from an empty identity map, as a real request would
+        db.session.remove()
+
+        engine = db.get_engine(app)
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            res = client.get(url)
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+
+        self.assertEqual(res.status_code, 200)
+        return len(statements)
+
+    def test_home_queries_do_not_grow_with_page(self):
+        """Test that authors and likes on the homepage are loaded in bulk"""
+
+        authors = [self.user1_id, self.user2_id, self.user3.id, self.user4.id]
+
+        def post_messages(count):
+            # put them straight on testuser's timeline so the authors
+            # aren't already loaded through testuser's following list
+            for i in range(count):
+                msg = Message(text=f"warble {i}", user_id=authors[i % len(authors)])
+                db.session.add(msg)
+                db.session.flush()
+                db.session.add(Timeline(user_id=self.testuser_id, message_id=msg.id,
+                                        author_id=msg.user_id, timestamp=msg.timestamp))
+                db.session.add(Likes(user_id=self.testuser_id, message_id=msg.id))
+            db.session.commit()
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser_id
+
+            post_messages(2)
+            few = self.count_queries(client, "/")
+
+            post_messages(20)
+            many = self.count_queries(client, "/")
+
+            self.assertEqual(few, many)
+
+    def test_current_user_cache(self):
+        """Test that the logged-in user is served from cache until they change"""
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser_id
+
+            client.get("/users")
+            self.assertIsNotNone(current_users.get(self.testuser_id))
+            self.assertEqual(self.count_queries(client, "/messages/new"), 0)
+
+            client.post(f"/users/follow/{self.user1_id}")
+            self.assertIsNone(current_users.get(self.testuser_id))
+
+            res = client.get("/")
+            bs = BeautifulSoup(res.get_data(as_text=True), 'html.parser')
+            self.assertIn("1", bs.find("a", href=f"/users/{self.testuser_id}/following").text)
+
+    def test_current_user_cache_deleted(self):
+        """Test that a cached user who has since been deleted is logged out"""
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser_id
+
+            client.get("/users")
+            current_users.get(self.testuser_id)["deleted_at"] = datetime.utcnow()
+
+            res = client.get("/messages/new")
+            self.assertEqual(res.status_code, 302)
+            self.assertIsNone(current_users.get(self.testuser_id))
+
+    def test_current_user_cache_writes(self):
+        """Test that writes check the user's row, not a cached copy"""
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser_id
+
+            client.get("/users")
+            # deleted through another worker, whose forget can't reach here
+            User.query.get(self.testuser_id).deleted_at = datetime.utcnow()
+            db.session.commit()
+            self.assertIsNotNone(current_users.get(self.testuser_id))
+
+            res = client.post("/messages/new", data={"text": "too late"})
+            self.assertEqual(res.location, "http://localhost/")
+            self.assertEqual(Message.query.filter_by(text="too late").count(), 0)
+
+    def test_toggle_like_json(self):
+        """Test that the XHR like endpoint toggles and reports the count"""
+
+        message = Message(id=372837, text="Cats are great", user_id=self.user1_id)
+        own = Message(id=372838, text="My own warble", user_id=self.testuser_id)
+        db.session.add_all([message, own])
+        db.session.commit()
+
+        with self.client as client:
+            res = client.post("/messages/372837/like")
+            self.assertEqual(res.status_code, 401)
+
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser_id
+
+            res = client.post("/messages/372837/like")
+            self.assertEqual(res.get_json(), {"message_id": 372837, "liked": True, "likes": 1})
+            self.assertEqual(User.query.get(self.testuser_id).likes_count, 1)
+
+            res = client.post("/messages/372837/like")
+            self.assertEqual(res.get_json(), {"message_id": 372837, "liked": False, "likes": 0})
+            self.assertEqual(Likes.query.count(), 0)
+            self.assertEqual(User.query.get(self.testuser_id).likes_count, 0)
+
+            res = client.post("/messages/372838/like")
+            self.assertEqual(res.status_code, 403)
+
+            res = client.post("/messages/999999/like")
+            self.assertEqual(res.status_code, 404)
+
+    def test_user_show_conditional_get(self):
+        """Test that an unchanged profile is answered with a bare 304"""
+
+        db.session.add(Message(id=51001, text="First warble", user_id=self.user1_id))
+        db.session.commit()
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser_id
+
+            res = client.get(f"/users/{self.user1_id}")
+            etag = res.headers["ETag"]
+            self.assertIn("no-cache", res.headers["Cache-Control"])
+            self.assertNotIn("no-store", res.headers["Cache-Control"])
+
+            res = client.get(f"/users/{self.user1_id}", headers={"If-None-Match": etag})
+            self.assertEqual(res.status_code, 304)
+            self.assertEqual(res.data, b"")
+
+            # following them changes the button, so the page too
+            client.post(f"/users/follow/{self.user1_id}")
+            res = client.get(f"/users/{self.user1_id}", headers={"If-None-Match": etag})
+            self.assertEqual(res.status_code, 200)
+            etag = res.headers["ETag"]
+
+            db.session.add(Message(id=51002, text="Second warble", user_id=self.user1_id))
+            db.session.commit()
+            res = client.get(f"/users/{self.user1_id}", headers={"If-None-Match": etag})
+            self.assertEqual(res.status_code, 200)
+            self.assertIn("Second warble", res.get_data(as_text=True))
+
+            res = client.get("/users/profile")
+            self.assertIn("no-store", res.headers["Cache-Control"])
+
+    def test_long_follow_lists_stream(self):
+        """Test that follow lists over the threshold are streamed"""
+
+        self.followers_setup()
+        threshold = app.config['STREAM_LISTS_OVER']
+        app.config['STREAM_LISTS_OVER'] = 1
+
+        try:
+            with self.client as client:
+                with client.session_transaction() as session:
+                    session[CURR_USER_KEY] = self.testuser_id
+                    session['_flashes'] = [("success", "Streamed flash")]
+
+                res = client.get(f"/users/{self.testuser_id}/following")
+                html = res.get_data(as_text=True)
+
+                # a whole render would carry an ETag
+                self.assertNotIn("ETag", res.headers)
+                self.assertIn("@carl", html)
+                self.assertIn("@owen", html)
+                self.assertNotIn("@emily", html)
+                self.assertIn("Streamed flash", html)
+
+                # shown once, even though the cookie went out before the body
+                res = client.get(f"/users/{self.testuser_id}/following")
+                self.assertNotIn("Streamed flash", res.get_data(as_text=True))
+
+                # one follower is under the threshold
+                res = client.get(f"/users/{self.testuser_id}/followers")
+                self.assertIn("ETag", res.headers)
+                self.assertIn("@owen", res.get_data(as_text=True))
+        finally:
+            app.config['STREAM_LISTS_OVER'] = threshold
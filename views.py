@@ -0,0 +1,617 @@
+"""Warbler's pages and form actions."""
+
+from datetime import datetime
+
+from flask import (
+    Blueprint, abort, current_app, render_template, request, flash,
+    redirect, session, g, jsonify)
+from markupsafe import Markup
+from sqlalchemy import inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import make_transient_to_detached
+
+from caching import TTLCache
+from conditional import conditional, no_store, row_state
+from forms import UserAddForm, UserEditForm, LoginForm, MessageForm
+from hashing import HashingBusy
+from models import db, User, Message, Likes, Timeline
+from pagination import paginate
+from search import search_users, search_messages
+from streaming import YIELD_PER, stream_template
+import tasks
+
+CURR_USER_KEY = "curr_user"
+
+# accounts suggested on the home page
+WHO_TO_FOLLOW_LIMIT = 5
+
+views = Blueprint('views', __name__)
+
+# sized from the app's config when the blueprint is registered
+current_users = TTLCache()
+message_fragments = TTLCache()
+
+
+@views.record_once
+def configure_caches(state):
+    config = state.app.config
+    current_users.maxsize = config['CURRENT_USER_CACHE_SIZE']
+    current_users.ttl = config['CURRENT_USER_CACHE_TTL']
+    message_fragments.maxsize = config['MESSAGE_FRAGMENT_CACHE_SIZE']
+    message_fragments.ttl = config['MESSAGE_FRAGMENT_CACHE_TTL']
+
+
+##############################################################################
+# User signup/login/logout
+
+
+@views.before_app_request
+def add_user_to_g():
+    """If we're logged in, add curr user to Flask global."""
+
+    if CURR_USER_KEY in session:
+        # writes check the row itself, so an account deleted through
+        # another worker can't act on a copy that worker still caches
+        g.user = load_current_user(
+            session[CURR_USER_KEY],
+            cached=request.method in ('GET', 'HEAD'))
+
+    else:
+        g.user = None
+
+
+def load_current_user(user_id, cached=True):
+    """Get the logged-in user, from `current_users` when possible.
+
+    The cache holds the user's column values. On a hit they're attached to
+    this request's session as a persistent User without touching the
+    database; relationships still load lazily as usual. Anything that
+    changes what the row or its counters show should call
+    forget_current_user; other workers' copies age out after the TTL.
+    Deleted accounts are never logged in, whichever way they're found.
+    With `cached` false the row is always read, and the cache refreshed.
+    """
+
+    columns = current_users.get(user_id) if cached else None
+
+    if columns is not None and columns['deleted_at']:
+        forget_current_user(user_id)
+        return None
+
+    if columns is None:
+        user = User.query.get(user_id)
+        if user and user.deleted_at:
+            forget_current_user(user_id)
+            return None
+        if user:
+            current_users.set(user_id, {
+                attr.key: getattr(user, attr.key)
+                for attr in inspect(User).column_attrs
+            })
+        return user
+
+    user = User(**columns)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def forget_current_user(user_id):
+    """Drop a user from `current_users` after changing them."""
+
+    current_users.delete(user_id)
+
+
+def do_login(user):
+    """Log in user."""
+
+    session[CURR_USER_KEY] = user.id
+
+
+def do_logout():
+    """Logout user."""
+
+    if CURR_USER_KEY in session:
+        del session[CURR_USER_KEY]
+
+
+@views.route('/signup', methods=["GET", "POST"])
+def signup():
+    """Handle user signup.
+
+    Create new user and add to DB. Redirect to home page.
+
+    If form not valid, present form.
+
+    If the there already is a user with that username: flash message
+    and re-present form.
+    """
+
+    form = UserAddForm()
+
+    if form.validate_on_submit():
+        try:
+            user = User.signup(
+                username=form.username.data,
+                password=form.password.data,
+                email=form.email.data,
+                image_url=form.image_url.data or User.image_url.default.arg,
+            )
+            db.session.commit()
+
+        except IntegrityError:
+            flash("Username already taken", 'danger')
+            return render_template('users/signup.html', form=form)
+
+        do_login(user)
+    
+        return redirect("/")
+
+    else:
+        return render_template('users/signup.html', form=form)
+
+
+@views.route('/login', methods=["GET", "POST"])
+def login():
+    """Handle user login."""
+
+    form = LoginForm()
+
+    if form.validate_on_submit():
+        user = User.authenticate(form.username.data,
+                                 form.password.data)
+
+        if user:
+            # keeps the rehash authenticate() makes after a cost change
+            db.session.commit()
+            do_login(user)
+            flash(f"Hello, {user.username}!", "success")
+            return redirect("/")
+
+        flash("Invalid credentials.", 'danger')
+
+    return render_template('users/login.html', form=form)
+
+
+@views.route('/logout')
+def logout():
+    """Handle logout of user."""
+
+    # remove user id from session
+    do_logout()
+    flash("Successfully logged out!", "success")
+    return redirect("/login")
+
+
+##############################################################################
+# General user routes:
+
+@views.route('/users')
+def list_users():
+    """Page with listing of users.
+
+    Can take a 'q' param in querystring to search by username, bio or
+    location, and a 'page' param to page through the results.
+    """
+
+    search = request.args.get('q')
+    page = max(request.args.get('page', 1, type=int), 1)
+
+    users, has_next = search_users(search, page)
+
+    return render_template('users/index.html', users=users, search=search,
+                           page=page, has_next=has_next)
+
+
+@views.route('/users/<int:user_id>')
+def users_show(user_id):
+    """Show user profile."""
+
+    user = User.get_active_or_404(user_id)
+
+    # snagging messages in order from the database;
+    # user.messages won't be in order by default
+    messages, next_cursor = paginate(
+        Message.query.filter(Message.user_id == user_id),
+        Message.timestamp, Message.id,
+        before=request.args.get('before'))
+
+    liked_ids = Message.hydrate(messages, g.user)
+
+    state = (row_state(user), [msg.id for msg in messages], sorted(liked_ids),
+             next_cursor, g.user and g.user.is_following(user))
+
+    return conditional(state, lambda: render_template(
+        'users/show.html', user=user, messages=messages,
+        liked_ids=liked_ids, next_cursor=next_cursor))
+
+
+@views.route('/users/<int:user_id>/following')
+def show_following(user_id):
+    """Show list of people this user is following."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    user = User.get_active_or_404(user_id)
+    return user_list_page(user, 'users/following.html',
+                          User.followed_by(user_id), user.following_count)
+
+
+@views.route('/users/<int:user_id>/followers')
+def users_followers(user_id):
+    """Show list of followers of this user."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    user = User.get_active_or_404(user_id)
+    return user_list_page(user, 'users/followers.html',
+                          User.followers_of(user_id), user.followers_count)
+
+
+def user_list_page(user, template, users, count):
+    """Render `user`'s page listing the users `users` queries for.
+
+    Lists up to STREAM_LISTS_OVER long are rendered whole, behind an ETag.
+    Longer ones stream, fetching rows in batches as the page is written.
+    """
+
+    if count > current_app.config['STREAM_LISTS_OVER']:
+        return stream_template(template, user=user,
+                               users=users.yield_per(YIELD_PER))
+
+    listed = users.all()
+    state = (row_state(user), [row_state(other) for other in listed],
+             sorted(g.user.following_ids() & {other.id for other in listed}),
+             g.user.is_following(user))
+
+    return conditional(state, lambda: render_template(
+        template, user=user, users=listed))
+
+
+@views.route('/users/<int:user_id>/likes')
+def users_likes(user_id):
+    """Show list of liked messages"""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+
+    user = User.get_active_or_404(user_id)
+    user_likes = (Message.by_active_users()
+                  .join(Likes, Likes.message_id == Message.id)
+                  .filter(Likes.user_id == user_id)
+                  .all())
+    liked_ids = Message.hydrate(user_likes, g.user)
+
+    return render_template('/users/likes.html', user=user, likes=user_likes,
+                           liked_ids=liked_ids)
+
+
+@views.route('/users/add_like/<int:message_id>', methods=["POST"])
+def add_like(message_id):
+    """Handle message like"""
+
+    if not g.user:
+        flash("Access unathorized.", "danger")
+        return redirect('/')
+
+    liked, likes = Likes.toggle(g.user.id, message_id)
+    db.session.commit()
+
+    if liked is None:
+        # nothing changed: the message is missing, a deleted account's or
+        # the user's own
+        (Message.by_active_users()
+         .filter(Message.id == message_id)
+         .first_or_404())
+        flash("You cannot like your own message.", "danger")
+        return redirect('/')
+
+    forget_current_user(g.user.id)
+
+    if liked:
+        flash("Like added!", "success")
+    else:
+        flash('Like successfully removed!', "success")
+
+    return redirect('/')
+
+
+@views.route('/messages/<int:message_id>/like', methods=["POST"])
+def toggle_like(message_id):
+    """Like or unlike a message for the like buttons' XHR calls.
+
+    Returns JSON with the message's new state for this user and its like
+    count, e.g. {"message_id": 1, "liked": true, "likes": 3}.
+    """
+
+    if not g.user:
+        return jsonify(error="Access unauthorized."), 401
+
+    liked, likes = Likes.toggle(g.user.id, message_id)
+    db.session.commit()
+
+    if liked is None:
+        shown = Message.by_active_users().filter(Message.id == message_id)
+        if not db.session.query(shown.exists()).scalar():
+            return jsonify(error="Message not found."), 404
+        return jsonify(error="You cannot like your own message."), 403
+
+    forget_current_user(g.user.id)
+
+    return jsonify(message_id=message_id, liked=liked, likes=likes)
+
+    
+@views.route('/users/follow/<int:follow_id>', methods=['POST'])
+def add_follow(follow_id):
+    """Add a follow for the currently-logged-in user."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    followed_user = User.get_active_or_404(follow_id)
+    g.user.following.append(followed_user)
+    tasks.backfill.delay(follower_id=g.user.id, followed_id=followed_user.id)
+    db.session.commit()
+    forget_current_user(g.user.id)
+    forget_current_user(followed_user.id)
+
+    return redirect(f"/users/{g.user.id}/following")
+
+
+@views.route('/users/stop-following/<int:follow_id>', methods=['POST'])
+def stop_following(follow_id):
+    """Have currently-logged-in-user stop following this user."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    followed_user = User.query.get(follow_id)
+    g.user.following.remove(followed_user)
+    tasks.prune.delay(follower_id=g.user.id, followed_id=followed_user.id)
+    db.session.commit()
+    forget_current_user(g.user.id)
+    forget_current_user(followed_user.id)
+
+    return redirect(f"/users/{g.user.id}/following")
+
+
+@views.route('/users/profile', methods=["GET", "POST"])
+@no_store
+def profile():
+    """Update profile for current user."""
+
+    if not g.user:
+        flash("Access unathorized.", "danger")
+        return redirect("/")
+
+    # prepopulate form with logged in user info 
+    form = UserEditForm(obj=g.user)
+
+    if form.validate_on_submit():
+        username = g.user.username
+        user = User.authenticate(username, form.password.data)
+
+        # if authentication successful we update data on user
+        if user:
+            user.username = form.username.data
+            user.email = form.email.data
+            user.image_url = form.image_url.data
+            user.header_image_url = form.header_image_url.data
+            user.location = form.location.data
+            user.bio = form.bio.data
+
+            db.session.add(user)
+            db.session.commit()
+            forget_current_user(user.id)
+
+            return redirect(f"/users/{user.id}")
+            
+        else:
+            flash("Wrong password! Try again.", "danger")
+            return redirect("/")
+    
+    return render_template('/users/edit.html', form=form, user=g.user)
+
+
+@views.route('/users/delete', methods=["POST"])
+def delete_user():
+    """Delete user."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    do_logout()
+
+    # gone from the site now; its messages, likes and follows go in
+    # batches after the response
+    user_id = g.user.id
+    g.user.deleted_at = datetime.utcnow()
+    tasks.purge_user.delay(user_id=user_id)
+    db.session.commit()
+    forget_current_user(user_id)
+
+    return redirect("/signup")
+
+
+##############################################################################
+# Messages routes:
+
+@views.route('/messages/new', methods=["GET", "POST"])
+def messages_add():
+    """Add a message:
+
+    Show form if GET. If valid, update message and redirect to user page.
+    """
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    form = MessageForm()
+
+    if form.validate_on_submit():
+        msg = Message(text=form.text.data)
+        g.user.messages.append(msg)
+        db.session.flush()
+        # the author's own timeline now, their followers' after the response
+        Timeline.fan_out(msg, followers=False)
+        tasks.fan_out.delay(message_id=msg.id)
+        db.session.commit()
+        forget_current_user(g.user.id)
+
+        return redirect(f"/users/{g.user.id}")
+
+    return render_template('messages/new.html', form=form)
+
+
+@views.route('/messages/search')
+def messages_search():
+    """Search message text.
+
+    Takes a 'q' param with the words to look for; results are newest
+    first, with older pages reached through `?before=<timestamp,id>`.
+    """
+
+    search = request.args.get('q', '')
+
+    messages, next_cursor = search_messages(
+        search, before=request.args.get('before'))
+    liked_ids = Message.hydrate(messages, g.user)
+
+    return render_template('messages/search.html', messages=messages,
+                           search=search, liked_ids=liked_ids,
+                           next_cursor=next_cursor)
+
+
+@views.route('/messages/<int:message_id>', methods=["GET"])
+def messages_show(message_id):
+    """Show a message."""
+
+    msg = Message.query.get_or_404(message_id)
+    if msg.user.deleted_at:
+        abort(404)
+
+    state = (row_state(msg), row_state(msg.user),
+             g.user and g.user.is_following(msg.user))
+
+    return conditional(state, lambda: render_template(
+        'messages/show.html', message=msg))
+
+
+@views.route('/messages/<int:message_id>/delete', methods=["POST"])
+def messages_destroy(message_id):
+    """Delete a message."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    msg = Message.query.get_or_404(message_id)
+    # check that user can actually delete the message, i.e. they amde it 
+    if msg.user_id != g.user.id:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    Timeline.remove_message(msg.id)
+    db.session.delete(msg)
+    db.session.commit()
+    forget_current_user(g.user.id)
+    message_fragments.delete(message_id)
+
+    return redirect(f"/users/{g.user.id}")
+
+
+##############################################################################
+# Message list items
+
+
+@views.app_template_global()
+def message_fragment(msg):
+    """Render the viewer-independent part of a message's list item.
+
+    Cached in `message_fragments` by message id. Each entry carries the
+    version it was rendered from: the message's timestamp and its author's
+    username and avatar. A profile edit changes the version, so every
+    worker re-renders that author's messages on their next view; a reused
+    id comes with a new timestamp. Like buttons differ per viewer, so the
+    templates render those around this.
+    """
+
+    version = (msg.timestamp, msg.user.username, msg.user.image_url)
+    cached = message_fragments.get(msg.id)
+
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    html = Markup(current_app.jinja_env
+                  .get_template('messages/_item.html')
+                  .render(msg=msg))
+    message_fragments.set(msg.id, (version, html))
+    return html
+
+
+##############################################################################
+# Homepage and error pages
+
+@views.app_errorhandler(404)
+def not_found(error):
+    """404 page"""
+    return render_template('404.html'), 404
+
+
+@views.app_errorhandler(HashingBusy)
+def hashing_busy(error):
+    """503 page for when too many logins/signups are queued up."""
+    return render_template('503.html'), 503, {'Retry-After': '1'}
+
+
+def who_to_follow(user, limit=WHO_TO_FOLLOW_LIMIT):
+    """Accounts `user` might want to follow, best first; see graph.py."""
+
+    graph = current_app.extensions.get('graph')
+    if graph is None:
+        return []
+
+    # extra, in case some were deleted or followed (from another process)
+    # since the graph was loaded; those are checked against the database
+    excluded = user.following_ids() | {user.id}
+    ids = [user_id for user_id in graph.suggest(user.id, 2 * limit)
+           if user_id not in excluded]
+    users = {suggested.id: suggested for suggested in
+             User.query.filter(User.id.in_(ids), User.deleted_at.is_(None))}
+
+    return [users[user_id] for user_id in ids if user_id in users][:limit]
+
+
+@views.route('/')
+def homepage():
+    """Show homepage:
+
+    - anon users: no messages
+    - logged in: 100 most recent messages of followed_users, with
+      older pages reached through `?before=<timestamp,id>`
+    """
+
+    if g.user:
+
+        # the user's timeline already holds their own messages and those
+        # of everyone they follow, so this is one range scan on its index
+        messages, next_cursor = paginate(
+            Timeline.messages_for(g.user.id),
+            Timeline.timestamp, Timeline.message_id,
+            before=request.args.get('before'))
+
+        liked_ids = Message.hydrate(messages, g.user)
+
+        return render_template('home.html', messages=messages,
+                               liked_ids=liked_ids, next_cursor=next_cursor,
+                               suggestions=who_to_follow(g.user))
+
+    else:
+        return render_template('home-anon.html')